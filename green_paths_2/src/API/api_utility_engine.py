@@ -38,7 +38,10 @@ from ..database_controller import DatabaseController
 from green_paths_2.src.pipeline_controller import (
     init_config_and_data_handler,
 )
-from ..osm_network_controller import handle_osm_network_process
+from ..osm_network_controller import (
+    get_osm_network_clip_area,
+    handle_osm_network_process,
+)
 from ..preprocessing.main import preprocessing_pipeline
 from ..routing.main import (
     get_exposures_from_db,
@@ -126,9 +129,12 @@ def build_custom_cost_networks(
                 or (preprocess_in_background and not preprocessing_done)
             ):
                 logger.info("Starting preprocessing...")
-                osm_network_gdf = handle_osm_network_process(user_config=user_config)
+                osm_network_gdf, sampling_points = handle_osm_network_process(
+                    user_config=user_config
+                )
                 preprocessing_pipeline(
                     osm_network_gdf=osm_network_gdf,
+                    sampling_points=sampling_points,
                     data_handler=data_handler,
                     user_config=user_config,
                     preprocess_in_background=preprocess_in_background,
@@ -137,7 +143,8 @@ def build_custom_cost_networks(
                 preprocessing_done = True
 
             osm_segmented_network_path = validate_segmented_osm_network_path(
-                osm_segmented_network_path=user_config.osm_network.osm_pbf_file_path
+                osm_segmented_network_path=user_config.osm_network.osm_pbf_file_path,
+                clip_area=get_osm_network_clip_area(user_config),
             )
 
             normalized_exposures_dict = get_exposures_from_db(
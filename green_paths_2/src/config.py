@@ -72,6 +72,10 @@ PROJECT_CRS_KEY = "project_crs"
 
 DATA_COVERAGE_SAFETY_PERCENTAGE_KEY = "datas_coverage_safety_percentage"
 
+PREPROCESSING_WORKERS_KEY = "preprocessing_workers"
+
+RASTER_SAMPLING_WORKERS_KEY = "raster_sampling_workers"
+
 RASTER_CELL_RESOLUTION_KEY = "raster_cell_resolution"
 
 CUMULATIVE_RANGES_KEY = "cumulative_ranges"
@@ -147,6 +151,8 @@ OSM_CACHE_SEGMENTED_DIR_NAME: str = "segmented"
 
 RASTER_CACHE_DIR_NAME = "raster"
 
+RASTERIZATION_CACHE_DIR_NAME = "rasterized"
+
 LOGS_CACHE_DIR_NAME = "logs"
 
 
@@ -156,6 +162,12 @@ OSM_DEFAULT_FILE_EXTENSION: str = ".osm.pbf"
 
 OSM_SEGMENTED_DEFAULT_FILE_NAME_EXTENSION: str = "_segmented"
 
+OSM_SEGMENTED_MANIFEST_FILE_EXTENSION: str = ".manifest.json"
+
+OSM_SEGMENTED_CHANGES_FILE_EXTENSION: str = ".changes.json"
+PROCESSED_NETWORK_CACHE_FILE_EXTENSION: str = ".network.npz"
+RASTERIZATION_CACHE_FILE_EXTENSION: str = ".rasterized.tif"
+
 DESCRIPTOR_FILE_NAME = "data_description.txt"
 
 RASTER_FILE_SUFFIX = ".tif"
@@ -182,8 +194,62 @@ RASTER_NO_DATA_VALUE = -9999.0
 
 SEGMENT_POINTS_DEFAULT_SAMPLING_STRATEGY = "mean"
 
+# statistics of the sampling point values that can be stored per segment (data source segment_statistics),
+# in addition percentiles as p0...p100, e.g. p90
+SEGMENT_STATISTICS = ["mean", "min", "max", "median", "nodata_share"]
+SEGMENT_STATISTIC_PERCENTILE_PREFIX = "p"
+NODATA_SHARE_STATISTIC = "nodata_share"
+
+# how the segments are overlaid with the rasters (data source segment_sampling_method):
+# "points" samples the raster at the sampling points, "line_overlay" uses every raster cell crossed by
+# the segment, weighted by the length of the segment in the cell, "vector_overlay" (vector data only)
+# intersects the segments with the vector data without rasterizing it
+SEGMENT_SAMPLING_METHODS = ["points", "line_overlay", "vector_overlay"]
+DEFAULT_SEGMENT_SAMPLING_METHOD = "points"
+LINE_OVERLAY_SAMPLING_METHOD = "line_overlay"
+VECTOR_OVERLAY_SAMPLING_METHOD = "vector_overlay"
+
+# uncovered parts of the segments shorter than this (in meters) are not counted in the vector overlay
+VECTOR_OVERLAY_LENGTH_TOLERANCE = 1e-6
+
 SEGMENT_VALUES_ROUND_DECIMALS = 3
 
+# the segment store is exported to the db converting this many segments from the columns to rows at a time
+SEGMENT_STORE_EXPORT_CHUNK_SIZE = 100_000
+
+# rasters bigger than this are sampled window by window, reading at most this many bytes at a time
+RASTER_WINDOW_MAX_BYTES = 512 * 1024 * 1024
+
+# vector data is rasterized in tiles of this many cells in width and height
+RASTERIZATION_TILE_SIZE = 4096
+
+# number of worker processes rasterizing the tiles of vector data
+DEFAULT_RASTERIZATION_WORKERS = 1
+
+# number of worker processes calculating the segment values of the data sources
+DEFAULT_PREPROCESSING_WORKERS = 1
+
+# number of worker processes sampling a raster, the segments are split into this many chunks per worker
+DEFAULT_RASTER_SAMPLING_WORKERS = 1
+RASTER_SAMPLING_CHUNKS_PER_WORKER = 4
+
+# bump when the rasterized output changes, to invalidate the old rasterization caches
+RASTERIZATION_CACHE_VERSION = 2
+
+# the least recently used rasterization caches are removed when the cache directory grows over this size
+RASTERIZATION_CACHE_MAX_BYTES = 10 * 1024 * 1024 * 1024
+
+# creation options of the cached rasters (Cloud-Optimized GeoTIFFs)
+RASTERIZATION_CACHE_CREATION_OPTIONS = {
+    "COMPRESS": "DEFLATE",
+    "PREDICTOR": "YES",
+    "BLOCKSIZE": "512",
+    "BIGTIFF": "IF_SAFER",
+}
+
+# number of cached pyproj transformers for sampling rasters in their own CRS
+CRS_TRANSFORMER_CACHE_SIZE = 16
+
 SEGMENT_SAMPLING_POINTS_KEY = "sampling_points"
 
 DATA_COVERAGE_SAFETY_PERCENTAGE = 33
@@ -196,6 +262,101 @@ DEFAULT_BATCH_PROCENTAGE = 0.1
 
 DEFAULT_USER_ID = "GP2"
 
+# OSM SEGMENTER
+
+# CRS of the OSM node locations, the clip areas are given in it
+WGS84_CRS = 4326
+
+# buffer in meters around the routing origins and destinations, when clipping the network to their extent
+DEFAULT_CLIP_BUFFER_METERS = 2000
+
+# backend for the segmenter's intersection index: set, numpy or disk
+DEFAULT_INTERSECTION_INDEX_BACKEND = "numpy"
+
+# node refs are buffered and flushed to the intersection index in chunks of this size
+INTERSECTION_INDEX_CHUNK_SIZE = 10_000_000
+
+# use a bitmap for intersection lookups if it fits into this many bytes
+INTERSECTION_INDEX_BITMAP_MAX_BYTES = 256 * 1024 * 1024
+
+# sorted node and way ids are looked up from blocks of this many ids
+SORTED_ID_LOOKUP_BLOCK_SIZE = 4096
+
+# node locations are checked against the clip area in chunks of this size
+CLIP_NODE_CHUNK_SIZE = 1_000_000
+
+# osmium stores the coordinates as fixed point integers with this precision
+OSM_COORDINATE_PRECISION = 10_000_000
+
+# number of worker processes writing the segments
+DEFAULT_SEGMENTATION_WORKERS = 1
+
+# OSM PBF blocks are copied between files in chunks of this many bytes
+PBF_COPY_CHUNK_SIZE = 16 * 1024 * 1024
+
+# walk and bike routable highways, only these ways are kept in the segmented network
+# the highways excluded from the loaded network (NETWORK_EXCLUDED_HIGHWAY_TAGS) are not kept
+ROUTABLE_HIGHWAY_TAGS = [
+    "trunk",
+    "trunk_link",
+    "primary",
+    "primary_link",
+    "secondary",
+    "secondary_link",
+    "tertiary",
+    "tertiary_link",
+    "unclassified",
+    "residential",
+    "living_street",
+    "service",
+    "road",
+    "track",
+    "path",
+    "footway",
+    "cycleway",
+    "bridleway",
+    "pedestrian",
+    "steps",
+    "corridor",
+]
+
+# tag key to allowed values, a way is kept if any of its tags match
+DEFAULT_SEGMENTATION_WAY_FILTER = {"highway": ROUTABLE_HIGHWAY_TAGS}
+
+# segment ids are packed as -((parent way id << bits) | segment ordinal)
+SEGMENT_ID_ORDINAL_BITS = 16
+
+# stored in the segmented network cache manifests
+# bump when the segmented output changes, to invalidate the old caches
+OSM_SEGMENTER_VERSION = 4
+
+# read size when hashing the source OSM PBF for the cache manifest
+SEGMENTED_NETWORK_CACHE_HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+# OSM NETWORK LOADER
+
+# bump when the processed network changes, to invalidate the old processed network caches
+PROCESSED_NETWORK_CACHE_VERSION = 2
+
+# node location index for building the network geometries, see osmium.index.map_types()
+# flex_mem is in memory, sparse_file_array or dense_file_array store the locations on disk
+DEFAULT_NODE_LOCATION_INDEX = "flex_mem"
+
+# node location indexes backed by a temporary file
+FILE_NODE_LOCATION_INDEXES = ["sparse_file_array", "dense_file_array"]
+
+# ways with these highway tags are not part of the network, as in pyrosm's network_type="all"
+NETWORK_EXCLUDED_HIGHWAY_TAGS = [
+    "abandoned",
+    "construction",
+    "no",
+    "planned",
+    "platform",
+    "proposed",
+    "raceway",
+    "razed",
+]
+
 
 # default values for optional user configuration attributes
 # these will be used if the user does not specify them in the configuration file
@@ -226,6 +387,9 @@ DB_OUTPUT_RESULST_BASE_COLUMNS = {TO_ID_KEY: -1, FROM_ID_KEY: -1}
 # CACHE DIRS
 DATA_CACHE_DIR_PATH: str = os.path.join(BASE_DIR, "cache")
 AQI_DATA_CACHE_DIR_PATH = os.path.join(DATA_CACHE_DIR_PATH, RASTER_CACHE_DIR_NAME)
+RASTERIZATION_CACHE_DIR_PATH = os.path.join(
+    DATA_CACHE_DIR_PATH, RASTERIZATION_CACHE_DIR_NAME
+)
 
 # API
 
@@ -121,8 +121,13 @@ def convert_gdf_to_dict(
     return target_gdf.to_dict(orient=orient)
 
 
-def construct_osm_segmented_network_name(osm_source_path: str) -> str:
-    """Constructs the name for the segmented OSM network file."""
+def construct_osm_segmented_network_name(
+    osm_source_path: str, variant: str = None
+) -> str:
+    """
+    Constructs the name for the segmented OSM network file.
+    The variant key is added to the name for networks segmented with non-default parameters.
+    """
     # very bad solution but no time for better one
     if os.getenv("ENV") == "TEST":
         return (
@@ -144,7 +149,10 @@ def construct_osm_segmented_network_name(osm_source_path: str) -> str:
         network_name_no_extension + OSM_SEGMENTED_DEFAULT_FILE_NAME_EXTENSION
         if OSM_SEGMENTED_DEFAULT_FILE_NAME_EXTENSION not in network_name_no_extension
         else network_name_no_extension
-    ) + OSM_DEFAULT_FILE_EXTENSION
+    )
+    if variant:
+        osm_file_name += f"_{variant}"
+    osm_file_name += OSM_DEFAULT_FILE_EXTENSION
 
     # Ensure data_cache_dir_path is absolute
     data_cache_dir_path = (
@@ -1,7 +1,8 @@
 import os
 from collections import defaultdict
+from itertools import islice
 import sqlite3
-from typing import Dict, List, Any, Optional, Tuple
+from typing import Dict, Iterable, List, Any, Optional, Tuple
 
 from ..src.config import GP2_DB_PATH, GP2_DB_TEST_PATH, SEGMENT_STORE_TABLE, USER_ID_KEY
 from ..src.timer import time_logger
@@ -146,6 +147,42 @@ class DatabaseController:
             conn.commit()
         conn.close()
 
+    @time_logger
+    def add_many_rows(
+        self,
+        table: str,
+        columns: List[str],
+        rows: Iterable[Tuple[Any, ...]],
+        chunk_size: int = 10000,
+    ) -> None:
+        """
+        Add many records to the database from rows of values
+
+        Parameters
+        ----------
+        table : str
+            The table to add the records to.
+        columns : List[str]
+            The columns of the values in the rows.
+        rows : Iterable[Tuple[Any, ...]]
+            The rows to add to the table, read lazily chunk by chunk.
+        chunk_size : int
+            The size of the chunks to add to the database.
+        """
+        columns_str = ", ".join(columns)
+        placeholders = ", ".join(["?" for _ in columns])
+        rows = iter(rows)
+
+        conn = self.connect()
+        cursor = conn.cursor()
+        while chunk := list(islice(rows, chunk_size)):
+            cursor.executemany(
+                f"INSERT OR IGNORE INTO {table} ({columns_str}) VALUES ({placeholders})",
+                chunk,
+            )
+            conn.commit()
+        conn.close()
+
     def get_all_columns(self, table: str) -> List[str]:
         """
         Get all columns from a table
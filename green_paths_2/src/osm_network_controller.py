@@ -1,14 +1,70 @@
 """ This module contains the OSM network controller. """
 
 import geopandas as gpd
+from shapely.geometry.base import BaseGeometry
+
+from .config import DEFAULT_CLIP_BUFFER_METERS, DEFAULT_NODE_LOCATION_INDEX
+from .preprocessing.data_types import DataSourceModel
 from .preprocessing.osm_network_handler import OsmNetworkHandler
+from .preprocessing.sampling_points import SamplingPoints
 from .preprocessing.osm_segmenter import (
     segment_or_use_cache_osm_network,
 )
+from .preprocessing.study_area import (
+    clip_area_from_bbox,
+    clip_area_from_file,
+    clip_area_from_points,
+)
 from .preprocessing.user_config_parser import UserConfig
 
 
-def handle_osm_network_process(user_config: UserConfig) -> gpd.GeoDataFrame:
+def get_osm_network_clip_area(user_config: UserConfig) -> BaseGeometry | None:
+    """
+    Get the study area to clip the OSM network to, from the optional clip
+    configurations of the osm_network group.
+
+    Parameters
+    ----------
+    user_config : UserConfig
+        User configuration object.
+
+    Returns
+    -------
+    BaseGeometry | None
+        The clip area in WGS84, or None if the network is not clipped.
+    """
+    osm_network_config = user_config.osm_network
+    clip_bbox = getattr(osm_network_config, DataSourceModel.ClipBbox.value, None)
+    clip_polygon_file_path = getattr(
+        osm_network_config, DataSourceModel.ClipPolygonFilePath.value, None
+    )
+    clip_to_od_extent = getattr(
+        osm_network_config, DataSourceModel.ClipToODExtent.value, False
+    )
+    clip_buffer_meters = getattr(
+        osm_network_config, DataSourceModel.ClipBufferMeters.value, None
+    )
+
+    if clip_bbox:
+        return clip_area_from_bbox(clip_bbox, clip_buffer_meters or 0)
+    if clip_polygon_file_path:
+        return clip_area_from_file(clip_polygon_file_path, clip_buffer_meters or 0)
+    if clip_to_od_extent:
+        # the routing utilities import jpype, only needed when clipping to the OD files
+        from .routing.routing_utilities import init_origin_destinations_from_files
+
+        origins, destinations = init_origin_destinations_from_files(
+            user_config.routing, user_config.project.project_crs
+        )
+        if clip_buffer_meters is None:
+            clip_buffer_meters = DEFAULT_CLIP_BUFFER_METERS
+        return clip_area_from_points([origins, destinations], clip_buffer_meters)
+    return None
+
+
+def handle_osm_network_process(
+    user_config: UserConfig,
+) -> tuple[gpd.GeoDataFrame, SamplingPoints]:
     """
     Handle the OSM network process.
 
@@ -21,12 +77,22 @@ def handle_osm_network_process(user_config: UserConfig) -> gpd.GeoDataFrame:
     -------
     gpd.GeoDataFrame
         The OSM network GeoDataFrame.
+    SamplingPoints
+        The sampling points of the OSM network segments.
     """
     osm_network_pbf_file_path = segment_or_use_cache_osm_network(
-        user_config.osm_network.osm_pbf_file_path
+        user_config.osm_network.osm_pbf_file_path,
+        clip_area=get_osm_network_clip_area(user_config),
     )
 
-    network = OsmNetworkHandler(osm_pbf_file=osm_network_pbf_file_path)
+    network = OsmNetworkHandler(
+        osm_pbf_file=osm_network_pbf_file_path,
+        node_location_index=getattr(
+            user_config.osm_network,
+            DataSourceModel.NodeLocationIndex.value,
+            DEFAULT_NODE_LOCATION_INDEX,
+        ),
+    )
 
     if hasattr(user_config.osm_network, "segment_sampling_points_amount"):
         force_sampling_points_amount = (
@@ -42,4 +108,4 @@ def handle_osm_network_process(user_config: UserConfig) -> gpd.GeoDataFrame:
         force_sampling_points_amount=force_sampling_points_amount,
     )
     osm_network_gdf: gpd.GeoDataFrame = network.get_network_gdf()
-    return osm_network_gdf
+    return osm_network_gdf, network.get_sampling_points()
@@ -73,8 +73,10 @@ def handle_pipelines(
         db_controller = DatabaseController()
 
         if pipeline_name == PREPROCESSING_PIPELINE_NAME:
-            osm_network_gdf = handle_osm_network_process(user_config)
-            preprocessing_pipeline(osm_network_gdf, data_handler, user_config)
+            osm_network_gdf, sampling_points = handle_osm_network_process(user_config)
+            preprocessing_pipeline(
+                osm_network_gdf, sampling_points, data_handler, user_config
+            )
         elif pipeline_name == ROUTING_PIPELINE_NAME:
             routing_pipeline(data_handler, user_config)
         elif pipeline_name == ANALYSING_PIPELINE_NAME:
@@ -92,12 +94,22 @@ def handle_pipelines(
                         "Used -uc (use cache) flag, but nothing found from db segemnt_store, so will process preprocessing pipeline"
                     )
 
+            # the normalized exposures are handed to routing from the segment store,
+            # without reading them back from the db
+            normalized_exposures_dict = None
             if not skip_preprocessing:
-                osm_network_gdf = handle_osm_network_process(user_config)
-                preprocessing_pipeline(osm_network_gdf, data_handler, user_config)
+                osm_network_gdf, sampling_points = handle_osm_network_process(
+                    user_config
+                )
+                segment_store = preprocessing_pipeline(
+                    osm_network_gdf, sampling_points, data_handler, user_config
+                )
+                normalized_exposures_dict = segment_store.get_normalized_exposures(
+                    data_handler.get_data_source_names()
+                )
                 LOG.info("\n\n\n * * * \n\n\n")
 
-            routing_pipeline(data_handler, user_config)
+            routing_pipeline(data_handler, user_config, normalized_exposures_dict)
 
             LOG.info("\n\n\n * * * \n\n\n")
             exposure_analysing_pipeline(
@@ -12,6 +12,7 @@ from ..config import (
     TIF_FILE_EXTENSION,
 )
 from ..green_paths_exceptions import SpatialOperationError
+from .in_memory_raster import InMemoryRaster
 
 
 def validate_function_in_globals(custom_function_name: str) -> bool:
@@ -19,7 +20,7 @@ def validate_function_in_globals(custom_function_name: str) -> bool:
     return custom_function_name in globals()
 
 
-def apply_custom_processing_function(data_source: dict = None) -> str:
+def apply_custom_processing_function(data_source: dict = None) -> str | InMemoryRaster:
     """
     General function to apply custom processing to the data source.
 
@@ -27,7 +28,7 @@ def apply_custom_processing_function(data_source: dict = None) -> str:
     - data_source: The data source dictionary.
 
     Returns:
-    - The filepath of the processed data.
+    - The filepath of the processed data, or the processed raster data in memory.
     """
     custom_function_name = data_source.get_custom_processing_function()
     # to make sure that the function exists in globals
@@ -56,6 +57,20 @@ def convert_aq_nc_to_tif_and_scale_offset(data_source: dict) -> str:
     return created_tif_filepath
 
 
+def load_aq_nc_to_memory(data_source: dict) -> InMemoryRaster:
+    """
+    Load the AQI variable of a NetCDF file straight to memory, scaled and offset,
+    to be sampled without writing intermediate GeoTIFF files. The in-memory
+    alternative to convert_aq_nc_to_tif_and_scale_offset, which writes the data
+    to a GeoTIFF and rewrites it with the scale and offset applied.
+    """
+    return load_raster_nc_to_memory(
+        data_source.get_filepath(),
+        data_source.get_original_crs(),
+        data_source.get_data_column(),
+    )
+
+
 # CUSTOM FUNCTIONS FOR .NC RASTER CONVERSION TO TIF AND FIXING SCALE AND OFFSET
 
 # TODO: if using interpolation, skip fillna...
@@ -118,6 +133,39 @@ def convert_raster_nc_to_tif(
         raise SpatialOperationError(f"Error in converting AQI nc to tif: {e}")
 
 
+def load_raster_nc_to_memory(
+    input_raster_file_path: str,
+    original_crs: str | int,
+    data_column: str,
+    fill_na_value: float = 1.0,
+) -> InMemoryRaster:
+    """
+    Load a variable of a netCDF file to an in-memory raster. The file is opened
+    lazily, and only the variable is read, automatically scaled and offset by
+    xarray. The NaN values are filled like in convert_raster_nc_to_tif, and the
+    other dimensions than x and y (e.g. time) are the bands of the raster, like
+    in the exported GeoTiff.
+
+    Parameters:
+    - input_raster_file_path: The path of the nc file, e.g. allPollutants_2019-09-11T15.nc.
+    - original_crs: The CRS of the raster data.
+    - data_column: The name of the variable, e.g. AQI.
+    - fill_na_value: The value to fill the NaN values with.
+
+    Returns:
+    - The variable as an in-memory raster.
+    """
+    with xarray.open_dataset(input_raster_file_path) as data:
+        variable = data[data_column].rio.write_crs(original_crs)
+        variable = variable.transpose(..., variable.rio.y_dim, variable.rio.x_dim)
+        if variable.ndim > 3:
+            raise SpatialOperationError(
+                f"Variable {data_column} of {input_raster_file_path} has more than one band dimension: {variable.dims}"
+            )
+        values = variable.fillna(fill_na_value).values.astype(np.float32)
+        return InMemoryRaster(values, variable.rio.transform(), variable.rio.crs)
+
+
 def _has_unscaled_aqi(aqi_raster) -> bool:
     d_type = aqi_raster.dtypes[0]
     return d_type == "int8"
@@ -131,7 +179,6 @@ def _get_offset(aqi_raster) -> float:
     return aqi_raster.offsets[0]
 
 
-# TODO: could use save_to_raster_file?
 def fix_aqi_tiff_scale_offset(aqi_filepath: str) -> bool:
     try:
         # read and check the data
@@ -17,6 +17,7 @@ from ..preprocessing.custom_functions import (
 )
 from ..preprocessing.data_source import DataSource
 from ..preprocessing.data_types import DataTypes
+from ..preprocessing.in_memory_raster import InMemoryRaster
 from ..preprocessing.osm_network_handler import OsmNetworkHandler
 from ..preprocessing.raster_operations import (
     check_raster_file_crs,
@@ -259,7 +260,11 @@ class DataDescriptor:
                         f"NaN count: {nan_count}",
                     )
 
-                    if check_raster_file_crs(raster_path) != project_crs:
+                    # in-memory rasters are sampled in their own crs, without reprojecting
+                    if (
+                        not isinstance(raster_path, InMemoryRaster)
+                        and check_raster_file_crs(raster_path) != project_crs
+                    ):
                         LOG.info(
                             f"Raster not in project crs. Reprojecting {raster_path} to project crs: {project_crs}"
                         )
@@ -24,6 +24,10 @@ class DataSource:
         original_crs: Optional[str] = None,
         columns_of_interest: Optional[list[str]] = None,
         custom_processing_function: Optional[str] = None,
+        segment_statistics: Optional[list[str]] = None,
+        segment_sampling_method: Optional[str] = None,
+        raster_bands: Optional[list[int]] = None,
+        raster_variables: Optional[list[str]] = None,
         **source_specific_attributes: Any
     ):
         self.name = name
@@ -41,6 +45,10 @@ class DataSource:
         self.save_raster_file = save_raster_file
         self.source_specific_attributes = source_specific_attributes
         self.custom_processing_function = custom_processing_function
+        self.segment_statistics = segment_statistics
+        self.segment_sampling_method = segment_sampling_method
+        self.raster_bands = raster_bands
+        self.raster_variables = raster_variables
 
     def get_name(self):
         return self.name
@@ -120,6 +128,30 @@ class DataSource:
     def set_custom_processing_function(self, custom_processing_function: str):
         self.custom_processing_function = custom_processing_function
 
+    def get_segment_statistics(self):
+        return self.segment_statistics
+
+    def set_segment_statistics(self, segment_statistics: list[str]):
+        self.segment_statistics = segment_statistics
+
+    def get_segment_sampling_method(self):
+        return self.segment_sampling_method
+
+    def set_segment_sampling_method(self, segment_sampling_method: str):
+        self.segment_sampling_method = segment_sampling_method
+
+    def get_raster_bands(self):
+        return self.raster_bands
+
+    def set_raster_bands(self, raster_bands: list[int]):
+        self.raster_bands = raster_bands
+
+    def get_raster_variables(self):
+        return self.raster_variables
+
+    def set_raster_variables(self, raster_variables: list[str]):
+        self.raster_variables = raster_variables
+
     def get_save_raster_file(self):
         return self.save_raster_file
 
@@ -0,0 +1,469 @@
+""" Processing of the data sources to segment values, serially or in parallel. """
+
+import multiprocessing
+import shutil
+
+import numpy as np
+import shapely
+
+from ..config import (
+    DEFAULT_PREPROCESSING_WORKERS,
+    DEFAULT_RASTER_SAMPLING_WORKERS,
+    LINE_OVERLAY_SAMPLING_METHOD,
+    RASTER_NO_DATA_VALUE,
+    VECTOR_OVERLAY_SAMPLING_METHOD,
+)
+from ..data_utilities import determine_file_type
+from ..logging import setup_logger, LoggerColors
+from ..timer import time_logger
+from .custom_functions import apply_custom_processing_function
+from .data_types import DataTypes
+from .in_memory_raster import InMemoryRaster
+from .raster_operations import (
+    calculate_segment_raster_band_values_from_in_memory_raster,
+    calculate_segment_raster_band_values_from_raster_file,
+    calculate_segment_raster_values_from_raster_file,
+    get_rasterized_output_path,
+    rasterize_and_calculate_segment_values,
+    segment_value_arrays_to_dicts,
+)
+from .rasterization_cache import (
+    check_rasterization_cache,
+    evict_rasterization_caches,
+    get_rasterization_cache_key,
+    get_rasterization_cache_path,
+    write_rasterization_cache,
+)
+from .sampling_points import SamplingPoints
+from .shared_arrays import (
+    attach_shared_arrays,
+    release_shared_arrays,
+    share_arrays,
+)
+from .spatial_operations import create_buffer_for_geometries, has_only_point_geometries
+from .vector_overlay import (
+    calculate_segment_vector_overlay_values,
+    get_overlay_feature_geometries,
+)
+from .vector_processor import load_and_process_vector_data
+
+LOG = setup_logger(__name__, LoggerColors.BLUE.value)
+
+
+# The data sources are independent of each other, so they can be processed
+# in parallel, one data source per task. The packed sampling points (and the
+# network geometries as WKB, if a data source overlays them) are copied once
+# to shared memory blocks, which each worker maps when the pool starts, instead
+# of pickling them to every task. A worker returns the segment values packed
+# as one float array per statistic, aligned with the sampling points' osm ids
+# and NaN for the segments without a value, and the main process unpacks them
+# to the segment store.
+
+# the data sources using the network geometries instead of the sampling points
+NETWORK_GEOMETRY_SAMPLING_METHODS = [
+    LINE_OVERLAY_SAMPLING_METHOD,
+    VECTOR_OVERLAY_SAMPLING_METHOD,
+]
+
+
+def get_data_type(data_source) -> str:
+    """Get the configured data type of a data source, or determine it from the file."""
+    return data_source.get_data_type() or determine_file_type(
+        data_source.get_filepath()
+    )
+
+
+def process_vector_data_source(
+    data_name: str,
+    data_source,
+    sampling_points: SamplingPoints,
+    project_crs: int,
+    no_data_value: float,
+    segment_geometries: np.ndarray = None,
+    use_rasterization_cache: bool = True,
+    raster_sampling_workers: int = DEFAULT_RASTER_SAMPLING_WORKERS,
+) -> dict[str, dict]:
+    """Rasterize a vector data source (or use its rasterization cache) and calculate the segment values."""
+    # the rasterized vector data is cached, keyed by the vector
+    # data content and the parameters which change the raster
+    cache_path = None
+    if use_rasterization_cache:
+        cache_key = get_rasterization_cache_key(
+            data_source.get_filepath(),
+            {
+                "data_column": data_source.get_data_column(),
+                "data_buffer": data_source.get_data_buffer(),
+                "raster_cell_resolution": data_source.get_raster_cell_resolution(),
+                "project_crs": project_crs,
+                "original_crs": data_source.get_original_crs(),
+                "nodata_value": no_data_value,
+            },
+        )
+        cache_path = get_rasterization_cache_path(data_name, cache_key)
+
+    point_buffer = None
+    if cache_path is None or not check_rasterization_cache(cache_path):
+        cleaned_vector_gdf = load_and_process_vector_data(
+            data_name, data_source, project_crs
+        )
+
+        # if buffer for data is defined in config, apply it
+        # points are not buffered, but rasterized directly with
+        # the maximum value within the buffer
+        if data_source.get_data_buffer():
+            if has_only_point_geometries(cleaned_vector_gdf):
+                point_buffer = int(data_source.get_data_buffer())
+            else:
+                cleaned_vector_gdf = create_buffer_for_geometries(
+                    data_name,
+                    cleaned_vector_gdf,
+                    data_source.get_data_buffer(),
+                )
+
+        if cache_path:
+            write_rasterization_cache(
+                cache_path,
+                cleaned_vector_gdf,
+                data_source.get_data_column(),
+                data_source.get_raster_cell_resolution(),
+                no_data_value,
+                point_buffer=point_buffer,
+            )
+            evict_rasterization_caches(keep_paths=[cache_path])
+
+    if cache_path:
+        segment_values = calculate_segment_raster_values_from_raster_file(
+            sampling_points=sampling_points,
+            raster_file_path=cache_path,
+            raster_null_value=no_data_value,
+            segment_statistics=data_source.get_segment_statistics(),
+            segment_geometries=segment_geometries,
+            workers=raster_sampling_workers,
+        )
+        if data_source.get_save_raster_file():
+            shutil.copyfile(cache_path, get_rasterized_output_path(data_name))
+        return segment_values
+
+    return rasterize_and_calculate_segment_values(
+        data_name=data_name,
+        vector_data_gdf=cleaned_vector_gdf,
+        sampling_points=sampling_points,
+        data_column=data_source.get_data_column(),
+        raster_cell_resolution=data_source.get_raster_cell_resolution(),
+        save_raster_file=data_source.get_save_raster_file(),
+        raster_null_value=no_data_value,
+        segment_statistics=data_source.get_segment_statistics(),
+        segment_geometries=segment_geometries,
+        point_buffer=point_buffer,
+    )
+
+
+def process_data_source(
+    data_name: str,
+    data_source,
+    sampling_points: SamplingPoints,
+    network_geometries: np.ndarray,
+    project_crs: int,
+    use_rasterization_cache: bool = True,
+    raster_sampling_workers: int = DEFAULT_RASTER_SAMPLING_WORKERS,
+) -> dict[str, dict[str, dict]]:
+    """
+    Calculate the segment values of a data source.
+
+    Parameters:
+    - data_name: The name of the data source.
+    - data_source: The data source.
+    - sampling_points: The sampling points of the network segments.
+    - network_geometries: The segment geometries, in the order of the sampling points'
+      osm ids. Only needed by the line and vector overlay sampling methods.
+    - project_crs: The project CRS.
+    - use_rasterization_cache: If True, the rasterized vector data is cached and reused.
+    - raster_sampling_workers: Number of worker processes sampling the (rasterized) data.
+
+    Returns:
+    - The segment statistics by the segment store names to save them with. The
+      data source's own values are first, followed by the values of each configured
+      raster band or variable.
+    """
+    data_type = get_data_type(data_source)
+    no_data_value = data_source.get_no_data_value() or RASTER_NO_DATA_VALUE
+    sampling_method = data_source.get_segment_sampling_method()
+
+    # with the line overlay the segments are overlaid with the raster cells
+    # they cross, instead of sampling the raster at the sampling points
+    segment_geometries = (
+        network_geometries if sampling_method == LINE_OVERLAY_SAMPLING_METHOD else None
+    )
+
+    LOG.info(f"Processing datasource: {data_name} ({data_type})")
+
+    if (
+        data_type == DataTypes.Vector.value
+        and sampling_method == VECTOR_OVERLAY_SAMPLING_METHOD
+    ):
+        LOG.info("Processing vector data source with vector overlay")
+
+        # the segments are intersected with the vector data directly,
+        # without rasterizing it
+        cleaned_vector_gdf = load_and_process_vector_data(
+            data_name, data_source, project_crs
+        )
+        segment_values = calculate_segment_vector_overlay_values(
+            osm_ids=sampling_points.osm_ids,
+            segment_geometries=network_geometries,
+            feature_geometries=get_overlay_feature_geometries(
+                cleaned_vector_gdf.geometry.values,
+                data_source.get_data_buffer(),
+                data_source.get_raster_cell_resolution(),
+            ),
+            feature_values=cleaned_vector_gdf[data_source.get_data_column()].to_numpy(),
+            null_value=no_data_value,
+            segment_statistics=data_source.get_segment_statistics(),
+        )
+        return {data_name: segment_values}
+
+    if data_type == DataTypes.Vector.value:
+        LOG.info("Processing vector data source")
+        segment_values = process_vector_data_source(
+            data_name,
+            data_source,
+            sampling_points,
+            project_crs,
+            no_data_value,
+            segment_geometries,
+            use_rasterization_cache,
+            raster_sampling_workers,
+        )
+        return {data_name: segment_values}
+
+    if data_type == DataTypes.Raster.value:
+        LOG.info("Processing raster data source")
+
+        # check for possible custom processing function, which returns
+        # either a raster file path or the raster data in memory
+        raster_path = (
+            apply_custom_processing_function(
+                data_source,
+            )
+            if data_source.get_custom_processing_function()
+            else data_source.get_filepath()
+        )
+
+        # rasters in another crs are sampled as they are, by transforming
+        # the sampling points to the raster crs, without reprojecting to disk
+        raster_bands = data_source.get_raster_bands()
+        raster_variables = data_source.get_raster_variables()
+        if isinstance(raster_path, InMemoryRaster):
+            band_values = calculate_segment_raster_band_values_from_in_memory_raster(
+                sampling_points=sampling_points,
+                raster=raster_path,
+                raster_null_value=no_data_value,
+                sampling_points_crs=project_crs,
+                segment_statistics=data_source.get_segment_statistics(),
+                segment_geometries=segment_geometries,
+                raster_bands=raster_bands,
+                workers=raster_sampling_workers,
+            )
+        else:
+            band_values = calculate_segment_raster_band_values_from_raster_file(
+                sampling_points=sampling_points,
+                raster_file_path=raster_path,
+                raster_null_value=no_data_value,
+                sampling_points_crs=project_crs,
+                raster_original_crs=data_source.get_original_crs(),
+                raster_cell_resolution=data_source.get_raster_cell_resolution(),
+                segment_statistics=data_source.get_segment_statistics(),
+                segment_geometries=segment_geometries,
+                raster_bands=raster_bands,
+                raster_variables=raster_variables,
+                workers=raster_sampling_workers,
+            )
+
+        # the first band (or variable) is the value of the data source,
+        # all the configured bands are also stored in their own columns
+        segment_values = {data_name: next(iter(band_values.values()))}
+        if raster_bands or raster_variables:
+            segment_values.update(
+                (f"{data_name}_{label}", values)
+                for label, values in band_values.items()
+            )
+        return segment_values
+
+    return {}
+
+
+def pack_segment_values(segment_values: dict[str, dict]) -> dict[str, np.ndarray]:
+    """
+    Pack the segment values of each statistic to a float array, NaN for None.
+    segment_value_arrays_to_dicts unpacks them.
+    """
+    return {
+        statistic: np.array(
+            [np.nan if value is None else value for value in values.values()],
+            dtype=np.float64,
+        )
+        for statistic, values in segment_values.items()
+    }
+
+
+# the shared memory blocks and the arrays mapped from them are set once, when the pool starts
+_worker_shared_blocks = None
+_worker_sampling_points = None
+_worker_network_geometries = None
+_worker_project_crs = None
+_worker_use_rasterization_cache = None
+
+
+def _init_data_source_worker(
+    array_descriptions: dict[str, tuple[str, str, tuple]],
+    project_crs: int,
+    use_rasterization_cache: bool,
+) -> None:
+    global _worker_shared_blocks, _worker_sampling_points, _worker_network_geometries
+    global _worker_project_crs, _worker_use_rasterization_cache
+    _worker_shared_blocks, arrays = attach_shared_arrays(array_descriptions)
+    _worker_sampling_points = SamplingPoints(
+        arrays["osm_ids"], arrays["x"], arrays["y"], arrays["offsets"]
+    )
+    _worker_network_geometries = None
+    if "geometry_wkb" in arrays:
+        wkb_offsets = arrays["geometry_wkb_offsets"]
+        wkb = arrays["geometry_wkb"].tobytes()
+        _worker_network_geometries = shapely.from_wkb(
+            [
+                wkb[start:end]
+                for start, end in zip(
+                    wkb_offsets[:-1].tolist(), wkb_offsets[1:].tolist()
+                )
+            ]
+        )
+    _worker_project_crs = project_crs
+    _worker_use_rasterization_cache = use_rasterization_cache
+
+
+def _process_data_source_in_worker(
+    data_name: str, data_source
+) -> dict[str, dict[str, np.ndarray]]:
+    return {
+        store_name: pack_segment_values(segment_values)
+        for store_name, segment_values in process_data_source(
+            data_name,
+            data_source,
+            _worker_sampling_points,
+            _worker_network_geometries,
+            _worker_project_crs,
+            _worker_use_rasterization_cache,
+        ).items()
+    }
+
+
+def process_data_sources_in_parallel(
+    data_sources: dict,
+    sampling_points: SamplingPoints,
+    network_geometries: np.ndarray,
+    project_crs: int,
+    use_rasterization_cache: bool,
+    workers: int,
+) -> dict[str, dict[str, dict[str, dict]]]:
+    """
+    Process the data sources with multiple worker processes, one data source per task.
+    See process_data_sources for the parameters.
+    """
+    shared_arrays = {
+        "osm_ids": sampling_points.osm_ids,
+        "x": sampling_points.x,
+        "y": sampling_points.y,
+        "offsets": sampling_points.offsets,
+    }
+    # the network geometries are shared only if some data source overlays them
+    if network_geometries is not None and any(
+        data_source.get_segment_sampling_method() in NETWORK_GEOMETRY_SAMPLING_METHODS
+        for data_source in data_sources.values()
+    ):
+        geometry_wkb = shapely.to_wkb(network_geometries)
+        shared_arrays["geometry_wkb"] = np.frombuffer(
+            b"".join(geometry_wkb), dtype=np.uint8
+        )
+        shared_arrays["geometry_wkb_offsets"] = np.concatenate(
+            ([0], np.cumsum([len(wkb) for wkb in geometry_wkb]))
+        ).astype(np.int64)
+
+    shared_blocks, array_descriptions = share_arrays(shared_arrays)
+    try:
+        with multiprocessing.Pool(
+            processes=min(workers, len(data_sources)),
+            initializer=_init_data_source_worker,
+            initargs=(array_descriptions, project_crs, use_rasterization_cache),
+        ) as pool:
+            packed_results = pool.starmap(
+                _process_data_source_in_worker, data_sources.items()
+            )
+    finally:
+        release_shared_arrays(shared_blocks)
+
+    # the results are in the order of the data sources
+    return {
+        data_name: {
+            store_name: segment_value_arrays_to_dicts(
+                sampling_points.osm_ids, packed_values
+            )
+            for store_name, packed_values in data_source_results.items()
+        }
+        for data_name, data_source_results in zip(data_sources, packed_results)
+    }
+
+
+@time_logger
+def process_data_sources(
+    data_sources: dict,
+    sampling_points: SamplingPoints,
+    network_geometries: np.ndarray,
+    project_crs: int,
+    use_rasterization_cache: bool = True,
+    workers: int = DEFAULT_PREPROCESSING_WORKERS,
+    raster_sampling_workers: int = DEFAULT_RASTER_SAMPLING_WORKERS,
+) -> dict[str, dict[str, dict[str, dict]]]:
+    """
+    Calculate the segment values of all the data sources. With more than one
+    worker the data sources are processed in parallel worker processes.
+
+    Parameters:
+    - data_sources: The data sources by their names.
+    - sampling_points: The sampling points of the network segments.
+    - network_geometries: The segment geometries, in the order of the sampling points' osm ids.
+    - project_crs: The project CRS.
+    - use_rasterization_cache: If True, the rasterized vector data is cached and reused.
+    - workers: Number of worker processes, 1 processes the data sources in this process.
+    - raster_sampling_workers: Number of worker processes sampling the (rasterized) data
+      of a data source. Only used when the data sources are processed in this process,
+      the data source workers cannot start worker processes of their own.
+
+    Returns:
+    - The results of process_data_source by the data source names, in the
+      order of the data sources.
+    """
+    if workers > 1 and len(data_sources) > 1:
+        LOG.info(
+            f"Processing {len(data_sources)} data sources with {min(workers, len(data_sources))} workers."
+        )
+        return process_data_sources_in_parallel(
+            data_sources,
+            sampling_points,
+            network_geometries,
+            project_crs,
+            use_rasterization_cache,
+            workers,
+        )
+
+    return {
+        data_name: process_data_source(
+            data_name,
+            data_source,
+            sampling_points,
+            network_geometries,
+            project_crs,
+            use_rasterization_cache,
+            raster_sampling_workers,
+        )
+        for data_name, data_source in data_sources.items()
+    }
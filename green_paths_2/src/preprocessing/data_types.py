@@ -22,6 +22,10 @@ class DataSourceModel(Enum):
     MaxDataValue = "max_data_value"
     Columnsofinterest = "columns_of_interest"
     Saverasterfile = "save_raster_file"
+    SegmentStatistics = "segment_statistics"
+    SegmentSamplingMethod = "segment_sampling_method"
+    RasterBands = "raster_bands"
+    RasterVariables = "raster_variables"
     Origins = "origins"
     Destinations = "destinations"
     ODcrs = "od_crs"
@@ -36,6 +40,13 @@ class DataSourceModel(Enum):
     CumulativeRanges = "cumulative_ranges"
     SaveOutputName = "save_output_name"
     DatasCoverageSafetyPercentage = "datas_coverage_safety_percentage"
+    PreprocessingWorkers = "preprocessing_workers"
+    RasterSamplingWorkers = "raster_sampling_workers"
+    ClipBbox = "clip_bbox"
+    ClipPolygonFilePath = "clip_polygon_file_path"
+    ClipToODExtent = "clip_to_od_extent"
+    ClipBufferMeters = "clip_buffer_meters"
+    NodeLocationIndex = "node_location_index"
 
 
 class TravelModes(Enum):
@@ -0,0 +1,44 @@
+""" Rasters held in memory, e.g. returned by custom processing functions instead of raster files. """
+
+import numpy as np
+
+
+class InMemoryRaster:
+    """
+    A raster as a numpy array of its bands with the shape (bands, rows, cols),
+    the affine transform of the grid and its CRS. NaN is no data.
+    A custom processing function can return an InMemoryRaster instead of a
+    raster file path, so that e.g. a NetCDF variable is sampled without
+    writing and reading intermediate GeoTIFFs.
+    """
+
+    def __init__(self, data: np.ndarray, transform, crs):
+        data = np.asarray(data)
+        if data.ndim == 2:
+            data = data[np.newaxis]
+        if data.ndim != 3:
+            raise ValueError(
+                f"In-memory raster data should have 2 or 3 dimensions, got {data.ndim}."
+            )
+        self.data = data
+        self.transform = transform
+        self.crs = crs
+
+    @property
+    def count(self) -> int:
+        """Number of bands."""
+        return self.data.shape[0]
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        """The (rows, cols) of the raster grid."""
+        return self.data.shape[1:]
+
+    def read(self, bands: list[int]) -> np.ndarray:
+        """Get the given bands (numbered from 1) as an array of the shape (bands, rows, cols)."""
+        for band in bands:
+            if not 1 <= band <= self.count:
+                raise ValueError(
+                    f"Band {band} not found in in-memory raster with {self.count} bands."
+                )
+        return self.data[[band - 1 for band in bands]]
@@ -0,0 +1,175 @@
+""" Exact overlay of the network segments with raster cells, as an alternative to point sampling. """
+
+import numpy as np
+import shapely
+from pyproj import Transformer
+
+from ..logging import setup_logger, LoggerColors
+from ..timer import time_logger
+from .sampling_points import SamplingPoints
+
+LOG = setup_logger(__name__, LoggerColors.BLUE.value)
+
+
+# The segments are walked through the raster grid DDA-style, for all the
+# segments at once: each edge (pair of consecutive vertices) is split at the
+# grid lines it crosses, in raster pixel coordinates. Each resulting piece lies
+# in a single cell, and its length is the edge length times the piece's share
+# of the edge. The pieces are returned as "sampling points" at their midpoints,
+# with the piece lengths as weights, so the raster values are read like the
+# values of the sampling points and aggregated to length weighted statistics.
+
+
+def to_pixel_coordinates(
+    inverse_transform, x: np.ndarray, y: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """Get the (fractional) pixel column and row coordinates of the points."""
+    return (
+        inverse_transform.a * x + inverse_transform.b * y + inverse_transform.c,
+        inverse_transform.d * x + inverse_transform.e * y + inverse_transform.f,
+    )
+
+
+def get_grid_line_crossings(
+    start: np.ndarray, end: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Get the crossings of the edges with the integer grid lines of one axis.
+
+    Parameters:
+    - start: The pixel coordinate of the edge starts on the axis.
+    - end: The pixel coordinate of the edge ends on the axis.
+
+    Returns:
+    - The edge index of each crossing.
+    - The position of each crossing along its edge, from 0 (start) to 1 (end).
+    """
+    start_cells = np.floor(start)
+    end_cells = np.floor(end)
+    crossing_counts = np.abs(end_cells - start_cells).astype(np.int64)
+    edge_indices = np.repeat(np.arange(len(start)), crossing_counts)
+
+    # the crossed grid lines of each edge, in increasing order
+    first_lines = np.minimum(start_cells, end_cells) + 1
+    crossing_numbers = np.arange(len(edge_indices)) - np.repeat(
+        np.cumsum(crossing_counts) - crossing_counts, crossing_counts
+    )
+    grid_lines = first_lines[edge_indices] + crossing_numbers
+    positions = (grid_lines - start[edge_indices]) / (
+        end[edge_indices] - start[edge_indices]
+    )
+    return edge_indices, positions
+
+
+@time_logger
+def get_segment_cell_pieces(
+    osm_ids: np.ndarray,
+    geometries: np.ndarray,
+    transform,
+    transformer: Transformer = None,
+) -> tuple[SamplingPoints, np.ndarray]:
+    """
+    Split the segments into pieces that each lie within a single raster cell.
+
+    Parameters:
+    - osm_ids: The osm ids of the segments.
+    - geometries: The segment geometries, LineStrings or MultiLineStrings.
+    - transform: Affine transformation of the raster.
+    - transformer: Transformer from the geometries' CRS to the raster CRS, if they differ.
+
+    Returns:
+    - The midpoints of the pieces in the raster CRS, packed by segment like sampling points.
+      Pieces outside the raster get NaN coordinates.
+    - The length of each piece, in the units of the geometries' CRS.
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    parts, part_segment_indices = shapely.get_parts(geometries, return_index=True)
+    is_line = (shapely.get_type_id(parts) == shapely.GeometryType.LINESTRING) & ~(
+        shapely.is_empty(parts)
+    )
+    coordinates, vertex_part_indices = shapely.get_coordinates(
+        parts[is_line], return_index=True
+    )
+    part_segment_indices = part_segment_indices[is_line]
+
+    # edges between the consecutive vertices of a part
+    is_edge = vertex_part_indices[:-1] == vertex_part_indices[1:]
+    edge_starts = coordinates[:-1][is_edge]
+    edge_ends = coordinates[1:][is_edge]
+    edge_segment_indices = part_segment_indices[vertex_part_indices[:-1][is_edge]]
+    edge_lengths = np.hypot(*(edge_ends - edge_starts).T)
+
+    if transformer is not None:
+        edge_starts = np.column_stack(transformer.transform(*edge_starts.T))
+        edge_ends = np.column_stack(transformer.transform(*edge_ends.T))
+
+    # edges in pixel coordinates, an affine transformation keeps lines straight
+    inverse_transform = ~transform
+    start_cols, start_rows = to_pixel_coordinates(
+        inverse_transform, edge_starts[:, 0], edge_starts[:, 1]
+    )
+    end_cols, end_rows = to_pixel_coordinates(
+        inverse_transform, edge_ends[:, 0], edge_ends[:, 1]
+    )
+    # edges that could not be transformed to the raster CRS are dropped
+    is_kept_edge = (edge_lengths > 0) & np.isfinite(
+        start_cols + start_rows + end_cols + end_rows
+    )
+    edge_starts = edge_starts[is_kept_edge]
+    edge_ends = edge_ends[is_kept_edge]
+    edge_segment_indices = edge_segment_indices[is_kept_edge]
+    edge_lengths = edge_lengths[is_kept_edge]
+    start_cols, start_rows = start_cols[is_kept_edge], start_rows[is_kept_edge]
+    end_cols, end_rows = end_cols[is_kept_edge], end_rows[is_kept_edge]
+
+    col_edge_indices, col_positions = get_grid_line_crossings(start_cols, end_cols)
+    row_edge_indices, row_positions = get_grid_line_crossings(start_rows, end_rows)
+    edge_count = len(edge_lengths)
+    edge_indices = np.concatenate(
+        (
+            np.arange(edge_count),
+            col_edge_indices,
+            row_edge_indices,
+            np.arange(edge_count),
+        )
+    )
+    positions = np.concatenate(
+        (np.zeros(edge_count), col_positions, row_positions, np.ones(edge_count))
+    )
+    order = np.lexsort((positions, edge_indices))
+    edge_indices = edge_indices[order]
+    positions = positions[order]
+
+    # pieces between the consecutive split positions of an edge, crossings at
+    # a cell corner give an empty piece which is dropped
+    is_piece = (edge_indices[:-1] == edge_indices[1:]) & (
+        positions[:-1] < positions[1:]
+    )
+    piece_edge_indices = edge_indices[:-1][is_piece]
+    piece_starts = positions[:-1][is_piece]
+    piece_ends = positions[1:][is_piece]
+    piece_lengths = (piece_ends - piece_starts) * edge_lengths[piece_edge_indices]
+
+    middle_positions = ((piece_starts + piece_ends) / 2)[:, np.newaxis]
+    piece_middles = edge_starts[piece_edge_indices] + middle_positions * (
+        edge_ends[piece_edge_indices] - edge_starts[piece_edge_indices]
+    )
+    # the raster sampling truncates pixel coordinates towards zero, pieces left
+    # of or above the raster would fall into the first column or row
+    middle_cols, middle_rows = to_pixel_coordinates(
+        inverse_transform, piece_middles[:, 0], piece_middles[:, 1]
+    )
+    is_before_raster = (middle_cols < 0) | (middle_rows < 0)
+    piece_middles[is_before_raster] = np.nan
+
+    # pieces are in the order of the edges, which are in the order of the segments
+    segment_piece_counts = np.bincount(
+        edge_segment_indices[piece_edge_indices], minlength=len(geometries)
+    )
+    offsets = np.concatenate(([0], np.cumsum(segment_piece_counts)))
+
+    LOG.info(f"Split {len(geometries)} segments into {len(piece_lengths)} cell pieces.")
+    return (
+        SamplingPoints(osm_ids, piece_middles[:, 0], piece_middles[:, 1], offsets),
+        piece_lengths,
+    )
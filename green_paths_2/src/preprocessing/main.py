@@ -1,44 +1,23 @@
 """ Main module for preprocessing. """
 
-import os
 import geopandas as gpd
 
-from ...src.database_controller import (
-    DatabaseController,
-    split_data_by_length,
-)
-from ..data_utilities import (
-    determine_file_type,
-)
-from ..preprocessing.custom_functions import (
-    apply_custom_processing_function,
-)
-from ..preprocessing.spatial_operations import (
-    convert_geometries_to_wkt,
-    create_buffer_for_geometries,
-)
-from ..preprocessing.vector_processor import (
-    load_and_process_vector_data,
-)
+from ...src.database_controller import DatabaseController
 from ..preprocessing.user_data_handler import UserDataHandler
-from ..preprocessing.raster_operations import (
-    calculate_segment_raster_values_from_raster_file,
-    check_raster_file_crs,
-    rasterize_and_calculate_segment_values,
-    reproject_raster_to_crs,
-)
+from ..preprocessing.sampling_points import SamplingPoints
+from ..preprocessing.data_source_processor import process_data_sources
 from ..logging import setup_logger, LoggerColors
 from ..config import (
     DATA_COVERAGE_SAFETY_PERCENTAGE,
     DATA_COVERAGE_SAFETY_PERCENTAGE_KEY,
+    DEFAULT_PREPROCESSING_WORKERS,
+    DEFAULT_RASTER_SAMPLING_WORKERS,
     OSM_ID_KEY,
+    PREPROCESSING_WORKERS_KEY,
     PROJECT_KEY,
-    RASTER_FILE_SUFFIX,
-    RASTER_NO_DATA_VALUE,
-    REPROJECTED_RASTER_FILE_SUFFIX,
+    RASTER_SAMPLING_WORKERS_KEY,
     SEGMENT_STORE_TABLE,
 )
-from ..preprocessing.data_types import DataTypes
 from ..green_paths_exceptions import (
     ConfigDataError,
     PipeLineRuntimeError,
@@ -53,9 +32,12 @@ LOG = setup_logger(__name__, LoggerColors.GREEN.value)
 @time_logger
 def preprocessing_pipeline(
     osm_network_gdf: gpd.GeoDataFrame,
+    sampling_points: SamplingPoints,
     data_handler: UserDataHandler,
     user_config: UserConfig,
     preprocess_in_background: bool = False,
+    use_rasterization_cache: bool = True,
+    workers: int = None,
 ):
     """
     Run the whole preprocessing pipeline.
@@ -64,6 +46,8 @@ def preprocessing_pipeline(
     ----------
     osm_network_gdf : gpd.GeoDataFrame
         OSM network data.
+    sampling_points : SamplingPoints
+        Sampling points of the OSM network segments.
     user_config : UserConfig
         User configuration object.
     data_handler : UserDataHandler
@@ -71,13 +55,16 @@ def preprocessing_pipeline(
     preprocess_in_background : bool, optional
         If True, preprocess in the background, by default False.
         Not the best name for this. Basically means that will will empty the segment store table just before adding new data.
+    use_rasterization_cache : bool, optional
+        If True, the rasterized vector data sources are cached and reused, by default True.
+    workers : int, optional
+        Number of worker processes calculating the segment values of the data sources,
+        by default the preprocessing_workers of the project configuration (1 if not set).
 
     Returns
     -------
-    gpd.GeoDataFrame
-        The segment store GeoDataFrame.
-    gpd.GeoDataFrame
-        The OSM network GeoDataFrame.
+    SegmentValueStore
+        The segment store, with the normalized values for routing.
 
     Raises
     ------
@@ -90,88 +77,38 @@ def preprocessing_pipeline(
         segment_store = SegmentValueStore()
         project_crs = user_config.project.project_crs
 
-        for data_name, data_source in data_handler.data_sources.items():
-            data_conf_filepath = data_source.get_filepath()
-            data_type = data_source.get_data_type() or determine_file_type(
-                data_conf_filepath
-            )
-
-            no_data_value = data_source.get_no_data_value() or RASTER_NO_DATA_VALUE
-
-            LOG.info(f"Processing datasource: {data_name} ({data_type})")
-
-            if data_type == DataTypes.Vector.value:
-                LOG.info(f"Processing vector data source")
-
-                cleaned_vector_gdf = load_and_process_vector_data(
-                    data_name, data_source, project_crs
-                )
-
-                # if buffer for data is defined in config, apply it
-                if data_source.get_data_buffer():
-                    cleaned_vector_gdf = create_buffer_for_geometries(
-                        data_name, cleaned_vector_gdf, data_source.get_data_buffer()
-                    )
-
-                segment_values = rasterize_and_calculate_segment_values(
-                    data_name=data_name,
-                    vector_data_gdf=cleaned_vector_gdf,
-                    network_gdf=osm_network_gdf,
-                    data_column=data_source.get_data_column(),
-                    raster_cell_resolution=data_source.get_raster_cell_resolution(),
-                    save_raster_file=data_source.get_save_raster_file(),
-                    raster_null_value=no_data_value,
-                )
-
-                segment_store.save_segment_values(segment_values, data_name)
-
-            elif data_type == DataTypes.Raster.value:
-                LOG.info(f"Processing raster data source")
-
-                # check for possible custom processing function
-                raster_path = (
-                    apply_custom_processing_function(
-                        data_source,
-                    )
-                    if data_source.get_custom_processing_function()
-                    else data_conf_filepath
-                )
+        workers = workers or user_config.get_nested_attribute(
+            [PROJECT_KEY, PREPROCESSING_WORKERS_KEY],
+            default=DEFAULT_PREPROCESSING_WORKERS,
+        )
+        raster_sampling_workers = user_config.get_nested_attribute(
+            [PROJECT_KEY, RASTER_SAMPLING_WORKERS_KEY],
+            default=DEFAULT_RASTER_SAMPLING_WORKERS,
+        )
 
-                # check raster crs and reproject not project crs
-                if check_raster_file_crs(raster_path) != project_crs:
-                    reprojected_raster_filepath = raster_path.replace(
-                        RASTER_FILE_SUFFIX, REPROJECTED_RASTER_FILE_SUFFIX
-                    )
-
-                    reproject_raster_to_crs(
-                        input_raster_filepath=raster_path,
-                        output_raster_filepath=reprojected_raster_filepath,
-                        target_crs=project_crs,
-                        original_crs=data_source.get_original_crs(),
-                        new_raster_resolution=data_source.get_raster_cell_resolution(),
-                    )
-
-                # use reprojected file if it was created or exists
-                if os.path.exists(reprojected_raster_filepath):
-                    raster_path = reprojected_raster_filepath
-
-                segment_values = calculate_segment_raster_values_from_raster_file(
-                    network_gdf=osm_network_gdf,
-                    raster_file_path=raster_path,
-                    raster_null_value=no_data_value,
+        # the data sources are processed serially or in parallel workers,
+        # the results are saved in the order of the data sources
+        data_source_values = process_data_sources(
+            data_handler.data_sources,
+            sampling_points,
+            osm_network_gdf.geometry.values,
+            project_crs,
+            use_rasterization_cache=use_rasterization_cache,
+            workers=workers,
+            raster_sampling_workers=raster_sampling_workers,
+        )
+        for data_name, store_values in data_source_values.items():
+            segment_statistics = data_handler.data_sources[
+                data_name
+            ].get_segment_statistics()
+            for store_name, segment_values in store_values.items():
+                segment_store.save_segment_statistics(
+                    segment_values, store_name, segment_statistics
                 )
 
-                # remove reprojected raster file if it was created so it does not stay in the system
-                if os.path.exists(reprojected_raster_filepath):
-                    os.remove(reprojected_raster_filepath)
-
-                segment_store.save_segment_values(segment_values, data_name)
-
         all_data_sources = data_handler.get_data_sources()
 
-        all_osm_ids = segment_store.get_all_segment_osmids()
-
-        if not all_osm_ids or len(all_osm_ids) == 0:
+        if len(segment_store) == 0:
             LOG.error("no exposure data found for any segments!")
             raise ConfigDataError(
                 "No data was found from the datasources for any of the segments. Check the data sources (e.g. CRS's) and try again."
@@ -197,12 +134,10 @@ def preprocessing_pipeline(
         # combine exposures to geometries and convert the segment store to a GeoDataFrame
         segment_store.combine_exposures_to_geometries_and_lenghts(osm_network_gdf)
 
-        segment_store_dict = segment_store.get_store()
-        segment_store_wkt = convert_geometries_to_wkt(segment_store_dict)
+        # the columns of the store are exported to the db in chunks of rows
+        table_structure_from_data = segment_store.get_db_table_structure()
         db_handler = DatabaseController()
 
-        table_structure_from_data = next(iter(segment_store_wkt.values()))
-
         # FOR API to keep the db data live for longer for API calls
         # empty the segment store table to add new data
         if preprocess_in_background:
@@ -212,16 +147,17 @@ def preprocessing_pipeline(
             SEGMENT_STORE_TABLE, table_structure_from_data, force=True
         )
 
-        # Split data by length
-        split_data = split_data_by_length(segment_store_dict)
-
-        for _, subset in split_data.items():
-            db_handler.add_many_dict(SEGMENT_STORE_TABLE, subset)
+        db_handler.add_many_rows(
+            SEGMENT_STORE_TABLE,
+            list(table_structure_from_data),
+            segment_store.iterate_db_rows(),
+        )
 
         # make the osm_id index
         db_handler.create_index(SEGMENT_STORE_TABLE, OSM_ID_KEY)
 
         LOG.info("End of preprocessing pipeline.")
+        return segment_store
     except PipeLineRuntimeError as e:
         LOG.error(f"Preprocessing pipeline failed with error: {e}")
         raise e
@@ -1,17 +1,14 @@
 """ For dealing with OSM network related operations. """
 
-import math
 import geopandas as gpd
-from pyrosm import OSM
-
-from shapely.geometry import MultiLineString, LineString, Point
 
 from ..config import (
+    DEFAULT_NODE_LOCATION_INDEX,
     ID_KEY,
+    LENGTH_KEY,
     OSM_ID_KEY,
     NETWORK_COLUMNS_TO_KEEP,
     OSM_ID_KEY,
-    SEGMENT_SAMPLING_POINTS_KEY,
 )
 from ..data_utilities import (
     filter_gdf_by_columns_if_found,
@@ -22,6 +19,15 @@ from ..logging import setup_logger, LoggerColors
 from ..timer import time_logger
 
 
+from ..preprocessing.osm_network_loader import load_osm_network
+from ..preprocessing.processed_network_cache import (
+    get_processed_network_cache_key,
+    get_processed_network_cache_path,
+    read_processed_network_cache,
+    remove_stale_processed_network_caches,
+    write_processed_network_cache,
+)
+from ..preprocessing.sampling_points import SamplingPoints, generate_sampling_points
 from ..preprocessing.spatial_operations import (
     get_most_accurate_data_source_resolution,
     has_invalid_geometries,
@@ -34,9 +40,13 @@ LOG = setup_logger(__name__, LoggerColors.BLUE.value)
 
 
 class OsmNetworkHandler:
-    def __init__(self, osm_pbf_file=None):
+    def __init__(
+        self, osm_pbf_file=None, node_location_index=DEFAULT_NODE_LOCATION_INDEX
+    ):
         self.osm_pbf_file: str = osm_pbf_file
+        self.node_location_index: str = node_location_index
         self.network_gdf: gpd.GeoDataFrame = None
+        self.sampling_points: SamplingPoints = None
 
     def get_osm_pbf_file_path(self) -> str:
         return self.osm_pbf_file
@@ -44,6 +54,9 @@ class OsmNetworkHandler:
     def get_network_gdf(self) -> gpd.GeoDataFrame:
         return self.network_gdf
 
+    def get_sampling_points(self) -> SamplingPoints:
+        return self.sampling_points
+
     def set_network_gdf(self, network_gdf: gpd.GeoDataFrame) -> None:
         self.network_gdf = network_gdf
 
@@ -59,11 +72,9 @@ class OsmNetworkHandler:
 
     @time_logger
     def convert_network_to_gdf(self) -> None:
-        """Converts the OSM network to a GeoDataFrame."""
+        """Converts the OSM network to a GeoDataFrame with only the id and geometry columns."""
         LOG.info("converting OSM network to gdf")
-        osm_network = OSM(self.osm_pbf_file)
-        # TODO:  -> laita tää ottamaan vaa esim pyöräiltävät tai käveltävät tms.? -> ei vältsii ettei lähe liikaa kamaa pois?
-        network_gdf = osm_network.get_network(network_type="all")
+        network_gdf = load_osm_network(self.osm_pbf_file, self.node_location_index)
         LOG.info("successfully converted OSM network to gdf")
         LOG.info(f"network gdf size: {len(network_gdf)}")
         self.network_gdf = network_gdf
@@ -114,81 +125,26 @@ class OsmNetworkHandler:
         ].apply(lambda x: x.wkt)
         return target_column_name
 
-    def calculate_sampling_points(
-        self, road_segment_length: float, raster_resolution: int
-    ):
-        """
-        Calculate the number of sampling points based on the road segment length and raster resolution.
-
-        Parameters:
-        - road_segment_length: The length of the road segment.
-        - raster_resolution: The raster resolution of the data source.
-
-        Returns:
-        - The number of sampling points to generate.
-        """
-        return math.ceil(road_segment_length / raster_resolution) + 1
-
-    def sample_points(
-        self,
-        geometry,
-        segment_length: float,
-        raster_resolution: int,
-        force_sampling_points_amount: int = None,
-    ):
-        """
-        Generate evenly spaced sample points along the geometry based on segment length and raster resolution.
-        Handles both LineString and MultiLineString geometries.
-        """
-        if force_sampling_points_amount:
-            num_points = force_sampling_points_amount
-        else:
-            num_points = self.calculate_sampling_points(
-                segment_length, raster_resolution
-            )
-        points = []
-
-        if isinstance(geometry, LineString):
-            points = [
-                geometry.interpolate(float(i) / (num_points - 1), normalized=True)
-                for i in range(num_points)
-            ]
-        elif isinstance(geometry, MultiLineString):
-            for line in geometry.geoms:
-                points += [
-                    line.interpolate(float(i) / (num_points - 1), normalized=True)
-                    for i in range(num_points)
-                ]
-
-        return points
-
     @time_logger
     def generate_sampling_points(
         self,
         most_accurate_raster_resolution: int,
         force_sampling_points_amount: int = None,
-    ) -> gpd.GeoDataFrame:
+    ) -> None:
         """
-        Generate sampling points for each road segment.
+        Generate sampling points for each road segment, packed in flat coordinate arrays.
         The sampling points will be generated based on the most accurate raster resolution from the data sources.
         If force_sampling_points_amount is given, the number of sampling points will be forced to that amount.
 
         Parameters:
         - most_accurate_raster_resolution: The most accurate raster resolution from the data sources.
         - force_sampling_points_amount: The number of sampling points to generate for each road segment.
-
-        Returns:
-        - GeoDataFrame with sampling points added as a new column.
         """
-
-        self.network_gdf[SEGMENT_SAMPLING_POINTS_KEY] = self.network_gdf.apply(
-            lambda row: self.sample_points(
-                row.geometry,
-                row.length,
-                most_accurate_raster_resolution,
-                force_sampling_points_amount,
-            ),
-            axis=1,
+        self.sampling_points = generate_sampling_points(
+            self.network_gdf[OSM_ID_KEY].to_numpy(),
+            self.network_gdf.geometry.values,
+            most_accurate_raster_resolution,
+            force_sampling_points_amount,
         )
 
     def calculate_lengts_of_segments(self) -> gpd.GeoDataFrame:
@@ -198,7 +154,9 @@ class OsmNetworkHandler:
         Returns:
         - GeoDataFrame with a new column for the length of each road segment.
         """
-        self.network_gdf["length"] = self.network_gdf.geometry.apply(lambda x: x.length)
+        self.network_gdf[LENGTH_KEY] = self.network_gdf.geometry.apply(
+            lambda x: x.length
+        )
 
     def process_osm_network(
         self,
@@ -206,23 +164,48 @@ class OsmNetworkHandler:
         original_crs: int,
         data_sources: list,
         force_sampling_points_amount: int = None,
+        use_network_cache: bool = True,
     ) -> gpd.GeoDataFrame:
         """
-        Process OSM network.
-
-        :param user_config: User configurations.
+        Process OSM network. The sampling points of the segments are stored
+        in the handler, see get_sampling_points.
+        The processed network is cached next to the segmented network, keyed by
+        the segmented network's content and the CRS and sampling parameters.
+
+        :param project_crs: Project CRS.
+        :param original_crs: Original CRS of the OSM network.
+        :param data_sources: Data sources, for the sampling resolution.
+        :param force_sampling_points_amount: Forced amount of sampling points per segment.
+        :param use_network_cache: Use and update the processed network cache.
         :return: GeoDataFrame of the OSM network.
         """
         LOG.info("Processing OSM network.")
+        LOG.info("getting most accurate raster resolution")
+        most_accurate_raster_resolution = get_most_accurate_data_source_resolution(
+            data_sources
+        )
+
+        if use_network_cache:
+            cache_key = get_processed_network_cache_key(
+                self.osm_pbf_file,
+                {
+                    "project_crs": project_crs,
+                    "original_crs": original_crs,
+                    "raster_resolution": most_accurate_raster_resolution,
+                    "force_sampling_points_amount": force_sampling_points_amount,
+                },
+            )
+            cache_path = get_processed_network_cache_path(self.osm_pbf_file, cache_key)
+            cached_network = read_processed_network_cache(cache_path, project_crs)
+            if cached_network is not None:
+                self.network_gdf, self.sampling_points = cached_network
+                return self.get_network_gdf()
+
         self.convert_network_to_gdf()
         self.rename_column(ID_KEY, OSM_ID_KEY)
         self.handle_crs(project_crs, original_crs)
         self.network_filter_by_columns(NETWORK_COLUMNS_TO_KEEP)
         self.handle_invalid_geometries()
-        LOG.info("getting most accurate raster resolution")
-        most_accurate_raster_resolution = get_most_accurate_data_source_resolution(
-            data_sources
-        )
         LOG.info("calculating lengths of segments")
         self.calculate_lengts_of_segments()
         LOG.info("generating sampling points")
@@ -231,4 +214,10 @@ class OsmNetworkHandler:
             force_sampling_points_amount=force_sampling_points_amount,
         )
         LOG.info("successfully processed OSM network.")
+
+        if use_network_cache:
+            remove_stale_processed_network_caches(self.osm_pbf_file, cache_path)
+            write_processed_network_cache(
+                cache_path, self.network_gdf, self.sampling_points
+            )
         return self.get_network_gdf()
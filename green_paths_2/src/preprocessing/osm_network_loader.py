@@ -0,0 +1,143 @@
+""" Load the (segmented) OSM network into a GeoDataFrame using osmium. """
+
+import os
+import tempfile
+from array import array
+
+import geopandas as gpd
+import numpy as np
+import osmium
+import shapely
+
+from ..config import (
+    DEFAULT_NODE_LOCATION_INDEX,
+    FILE_NODE_LOCATION_INDEXES,
+    ID_KEY,
+    NETWORK_EXCLUDED_HIGHWAY_TAGS,
+    OSM_COORDINATE_PRECISION,
+    WGS84_CRS,
+)
+from ..green_paths_exceptions import OsmSegmenterError
+from ..logging import setup_logger, LoggerColors
+from ..timer import time_logger
+
+LOG = setup_logger(__name__, LoggerColors.BLUE.value)
+
+
+# osmium's value for the coordinates of a missing node location
+UNDEFINED_COORDINATE = 2147483647
+
+
+class NetworkWayCollector(osmium.SimpleHandler):
+    """
+    Collect the ids and the node coordinates of the network ways.
+    The coordinates are stored as osmium's fixed point integers into flat
+    arrays, the geometries are built from them at once in build_network_gdf.
+    Ways without a highway tag, with an excluded highway tag or area=yes are
+    skipped, as in pyrosm's network_type="all".
+    """
+
+    def __init__(self):
+        osmium.SimpleHandler.__init__(self)
+        self.excluded_highway_tags = set(NETWORK_EXCLUDED_HIGHWAY_TAGS)
+        self.way_ids = array("q")
+        self.node_counts = array("q")
+        self.xs = array("i")
+        self.ys = array("i")
+
+    def way(self, w):
+        highway = w.tags.get("highway")
+        if (
+            highway is None
+            or highway in self.excluded_highway_tags
+            or w.tags.get("area") == "yes"
+        ):
+            return
+        self.way_ids.append(w.id)
+        self.node_counts.append(len(w.nodes))
+        for node_ref in w.nodes:
+            self.xs.append(node_ref.x)
+            self.ys.append(node_ref.y)
+
+
+def build_network_gdf(collector: NetworkWayCollector) -> gpd.GeoDataFrame:
+    """
+    Build the network GeoDataFrame from the collected ways.
+    Ways with less than 2 nodes or with missing node locations are dropped.
+
+    Parameters:
+    - collector: NetworkWayCollector applied to the OSM file.
+
+    Returns:
+    - GeoDataFrame with the way ids and LineString geometries in WGS84.
+    """
+    way_ids = np.frombuffer(collector.way_ids, dtype=np.int64)
+    node_counts = np.frombuffer(collector.node_counts, dtype=np.int64)
+    xs = np.frombuffer(collector.xs, dtype=np.int32)
+    ys = np.frombuffer(collector.ys, dtype=np.int32)
+
+    # index of the way of each coordinate
+    way_indices = np.repeat(np.arange(len(way_ids)), node_counts)
+    missing_location = (xs == UNDEFINED_COORDINATE) | (ys == UNDEFINED_COORDINATE)
+    has_missing_location = np.bincount(
+        way_indices[missing_location], minlength=len(way_ids)
+    ).astype(bool)
+    if has_missing_location.any():
+        LOG.warning(
+            f"Dropping {int(has_missing_location.sum())} ways with missing node locations."
+        )
+
+    is_kept_way = (node_counts >= 2) & ~has_missing_location
+    is_kept_coordinate = is_kept_way[way_indices]
+    coordinates = np.column_stack(
+        (
+            xs[is_kept_coordinate] / OSM_COORDINATE_PRECISION,
+            ys[is_kept_coordinate] / OSM_COORDINATE_PRECISION,
+        )
+    )
+    # geometry index of each kept coordinate, numbered from 0 for the kept ways
+    geometry_indices = (np.cumsum(is_kept_way) - 1)[way_indices[is_kept_coordinate]]
+    geometries = shapely.linestrings(coordinates, indices=geometry_indices)
+
+    return gpd.GeoDataFrame(
+        {ID_KEY: way_ids[is_kept_way]}, geometry=geometries, crs=WGS84_CRS
+    )
+
+
+@time_logger
+def load_osm_network(
+    osm_pbf_file_path: str, node_location_index: str = DEFAULT_NODE_LOCATION_INDEX
+) -> gpd.GeoDataFrame:
+    """
+    Load the network ways of an OSM PBF file into a GeoDataFrame, without
+    building the tag columns. The file is read once, resolving the way node
+    locations with osmium's node location index.
+
+    Parameters:
+    - osm_pbf_file_path: Path to the (segmented) OSM PBF file.
+    - node_location_index: osmium node location index type. Use sparse_file_array
+      or dense_file_array to keep the locations in a temporary file for large extracts.
+
+    Returns:
+    - GeoDataFrame with the way ids (id) and LineString geometries in WGS84.
+    """
+    if node_location_index not in osmium.index.map_types():
+        raise OsmSegmenterError(
+            f"Unknown node location index {node_location_index}, should be one of {osmium.index.map_types()}."
+        )
+
+    collector = NetworkWayCollector()
+    if node_location_index in FILE_NODE_LOCATION_INDEXES:
+        with tempfile.TemporaryDirectory() as index_dir:
+            index_path = os.path.join(index_dir, "node_locations.idx")
+            collector.apply_file(
+                osm_pbf_file_path,
+                locations=True,
+                idx=f"{node_location_index},{index_path}",
+            )
+    else:
+        collector.apply_file(osm_pbf_file_path, locations=True, idx=node_location_index)
+
+    network_gdf = build_network_gdf(collector)
+    LOG.info(f"Loaded {len(network_gdf)} network ways from {osm_pbf_file_path}.")
+    return network_gdf
@@ -0,0 +1,470 @@
+""" Update a segmented OSM network incrementally from an OSM change file (.osc). """
+
+import datetime
+import json
+import os
+from collections import defaultdict
+
+import numpy as np
+import osmium
+
+from ..config import (
+    DEFAULT_INTERSECTION_INDEX_BACKEND,
+    DEFAULT_SEGMENTATION_WAY_FILTER,
+    OSM_SEGMENTED_CHANGES_FILE_EXTENSION,
+)
+from ..green_paths_exceptions import OsmSegmenterError
+from ..logging import setup_logger, LoggerColors
+from ..timer import time_logger
+from .osm_segmenter import (
+    IntersectionIndex,
+    SortedIdLookup,
+    compile_way_filter,
+    create_intersection_index,
+    create_segment_ways,
+    node_refs_to_array,
+    sorted_array_contains,
+    split_segment_id,
+    way_matches_filter,
+)
+from .segmented_network_cache import (
+    read_segmented_network_manifest,
+    update_segmented_network_manifest,
+)
+
+LOG = setup_logger(__name__, LoggerColors.RED.value)
+
+
+# The segmented network keeps the parent way id and the segment ordinal in the
+# segment id, so the original ways can be rebuilt from their segments: the
+# first node of a segment (other than the first one) is the last node of the
+# previous segment. Only the ways changed in the .osc file and the ways whose
+# intersections changed are segmented again, the other segments are copied.
+# Changed ways may reference nodes which were pruned from the segmented network
+# (e.g. a way retagged as routable), those are read from the source network.
+
+SEGMENT_TAG_KEYS = ("gp2_osm_id", "parent_id")
+
+
+def get_segment_parent_and_ordinal(w) -> tuple[int, int]:
+    """Get the parent way id and the ordinal of a segment, checking the id scheme."""
+    parent_id, ordinal = split_segment_id(w.id)
+    if w.tags.get("parent_id") != str(parent_id):
+        raise OsmSegmenterError(
+            f"Segment {w.id} does not match its parent_id tag, the network was segmented "
+            "with an older version. Segment the network again before updating it."
+        )
+    return parent_id, ordinal
+
+
+def get_segment_way_node_refs(w, ordinal: int) -> np.ndarray:
+    """Get the node refs a segment adds to its parent way, without the node shared with the previous segment."""
+    node_refs = node_refs_to_array(w.nodes)
+    return node_refs[1:] if ordinal else node_refs
+
+
+class OsmChangeCollector(osmium.SimpleHandler):
+    """
+    Collects the changed nodes and the created, modified and deleted ways of an
+    OSM change file. Ways not kept by the way filter are handled as deleted.
+    """
+
+    def __init__(self, way_filter: dict = None):
+        osmium.SimpleHandler.__init__(self)
+        self.way_filter = compile_way_filter(way_filter)
+        self.changed_node_ids = []
+        self.deleted_node_ids = []
+        self.changed_way_ids = set()
+        # id -> (node refs, tags) for the created and modified ways
+        self.new_ways = {}
+
+    def node(self, n):
+        self.changed_node_ids.append(n.id)
+        if n.deleted:
+            self.deleted_node_ids.append(n.id)
+
+    def way(self, w):
+        self.changed_way_ids.add(w.id)
+        if w.deleted or not way_matches_filter(w.tags, self.way_filter):
+            self.new_ways.pop(w.id, None)
+        else:
+            self.new_ways[w.id] = (
+                node_refs_to_array(w.nodes),
+                {tag.k: tag.v for tag in w.tags},
+            )
+
+
+class UpdateIntersectionCollector(osmium.SimpleHandler):
+    """
+    Collects the intersection nodes of the segmented network before and after
+    the change. The segments of the changed ways count only before the change.
+    As the first pass over the network, it also checks the segment id scheme.
+    """
+
+    def __init__(
+        self,
+        old_intersection_index: IntersectionIndex,
+        new_intersection_index: IntersectionIndex,
+        changed_way_ids: set,
+    ):
+        osmium.SimpleHandler.__init__(self)
+        self.old_intersection_index = old_intersection_index
+        self.new_intersection_index = new_intersection_index
+        self.changed_way_ids = changed_way_ids
+        self.changed_node_refs = []
+
+    def way(self, w):
+        parent_id, ordinal = get_segment_parent_and_ordinal(w)
+        node_refs = get_segment_way_node_refs(w, ordinal)
+        self.old_intersection_index.add_way(node_refs)
+        if parent_id in self.changed_way_ids:
+            self.changed_node_refs.append(node_refs)
+        else:
+            self.new_intersection_index.add_way(node_refs)
+
+
+class NeighbourWayCollector(osmium.SimpleHandler):
+    """Finds the unchanged ways which have segments on the nodes whose intersection status changed."""
+
+    def __init__(self, changed_intersection_nodes: np.ndarray, changed_way_ids: set):
+        osmium.SimpleHandler.__init__(self)
+        self.changed_intersection_nodes = changed_intersection_nodes
+        self.changed_way_ids = changed_way_ids
+        self.neighbour_way_ids = set()
+
+    def way(self, w):
+        parent_id, _ = split_segment_id(w.id)
+        if parent_id in self.changed_way_ids or parent_id in self.neighbour_way_ids:
+            return
+        if sorted_array_contains(
+            self.changed_intersection_nodes, node_refs_to_array(w.nodes)
+        ).any():
+            self.neighbour_way_ids.add(parent_id)
+
+
+class SourceNodeCollector(osmium.SimpleHandler):
+    """Copies the given nodes from the source OSM network."""
+
+    def __init__(self, node_ids: np.ndarray):
+        osmium.SimpleHandler.__init__(self)
+        self.node_ids = SortedIdLookup(node_ids)
+        self.nodes = []
+
+    def node(self, n):
+        if n.id in self.node_ids:
+            self.nodes.append(
+                osmium.osm.mutable.Node(
+                    id=n.id,
+                    version=n.version,
+                    changeset=n.changeset,
+                    timestamp=n.timestamp,
+                    uid=n.uid,
+                    user=n.user,
+                    tags={tag.k: tag.v for tag in n.tags},
+                    location=(n.location.lon, n.location.lat),
+                )
+            )
+
+
+def get_missing_nodes(
+    node_ids: np.ndarray, osm_source_path: str | None
+) -> list[osmium.osm.mutable.Node]:
+    """
+    Read the nodes referenced by the changed ways but missing from the
+    segmented network and the change file from the source OSM network.
+
+    :param node_ids: Sorted ids of the missing nodes.
+    :param osm_source_path: Path to the source OSM PBF file of the segmented network.
+    :return: The missing nodes sorted by id.
+    """
+    if not len(node_ids):
+        return []
+    if osm_source_path is None or not os.path.exists(osm_source_path):
+        raise OsmSegmenterError(
+            f"Changed ways reference {len(node_ids)} nodes which are not in the segmented "
+            f"network or the change file, and the source network {osm_source_path} "
+            "is not available to read them from."
+        )
+    node_collector = SourceNodeCollector(node_ids)
+    node_collector.apply_file(osm_source_path)
+    found_node_ids = [node.id for node in node_collector.nodes]
+    not_found_node_ids = np.setdiff1d(node_ids, found_node_ids)
+    if len(not_found_node_ids):
+        raise OsmSegmenterError(
+            f"Changed ways reference nodes missing from the segmented network, the change "
+            f"file and the source network {osm_source_path}: "
+            f"{not_found_node_ids[:10].tolist()}"
+        )
+    LOG.info(f"Read {len(node_ids)} nodes of the changed ways from {osm_source_path}.")
+    return sorted(node_collector.nodes, key=lambda node: node.id)
+
+
+class SegmentedNetworkUpdater(osmium.SimpleHandler):
+    """
+    Writes the updated segmented network from the segmented network merged
+    with the change file. Segments of the unaffected ways are copied, kept
+    ways from the change file are segmented, and the segments of the neighbour
+    ways are collected to be segmented again after the pass. Only the nodes
+    referenced by the updated network are written, the missing nodes read
+    from the source network are written among them in id order.
+    """
+
+    def __init__(
+        self,
+        writer,
+        intersection_index: IntersectionIndex,
+        changed_way_ids: set,
+        new_way_ids: set,
+        neighbour_way_ids: set,
+        moved_node_ids: np.ndarray,
+        missing_nodes: list = None,
+    ):
+        osmium.SimpleHandler.__init__(self)
+        self.writer = writer
+        self.intersection_index = intersection_index
+        self.changed_way_ids = changed_way_ids
+        self.new_way_ids = new_way_ids
+        self.neighbour_way_ids = neighbour_way_ids
+        self.moved_node_ids = moved_node_ids
+        self.missing_nodes = missing_nodes or []
+        self.missing_node_index = 0
+        self.timestamp = datetime.datetime.now()
+        # segment id -> (node refs, tags) of the replaced and the written segments
+        self.old_segments = {}
+        self.new_segments = {}
+        self.moved_segment_ids = []
+        # parent id -> [(ordinal, node refs, tags)]
+        self.neighbour_segments = defaultdict(list)
+
+    def write_missing_nodes(self, before_node_id: int | None = None):
+        """Write the missing nodes with an id smaller than the given one, all if None."""
+        while self.missing_node_index < len(self.missing_nodes) and (
+            before_node_id is None
+            or self.missing_nodes[self.missing_node_index].id < before_node_id
+        ):
+            self.writer.add_node(self.missing_nodes[self.missing_node_index])
+            self.missing_node_index += 1
+
+    def node(self, n):
+        self.write_missing_nodes(n.id)
+        if not n.deleted and self.intersection_index.is_referenced_node(n.id):
+            self.writer.add_node(n)
+
+    def way(self, w):
+        self.write_missing_nodes()
+        if w.deleted:
+            return
+        if w.id > 0:
+            # created or modified way from the change file
+            if w.id not in self.new_way_ids:
+                return
+            self.write_segments(
+                w.id,
+                node_refs_to_array(w.nodes),
+                {tag.k: tag.v for tag in w.tags},
+            )
+            return
+
+        parent_id, ordinal = split_segment_id(w.id)
+        if parent_id in self.changed_way_ids or parent_id in self.neighbour_way_ids:
+            node_refs = [node.ref for node in w.nodes]
+            tags = {tag.k: tag.v for tag in w.tags}
+            self.old_segments[w.id] = (node_refs, tags)
+            if parent_id in self.neighbour_way_ids:
+                self.neighbour_segments[parent_id].append((ordinal, node_refs, tags))
+            return
+
+        if (
+            len(self.moved_node_ids)
+            and sorted_array_contains(
+                self.moved_node_ids, node_refs_to_array(w.nodes)
+            ).any()
+        ):
+            self.moved_segment_ids.append(w.id)
+        self.writer.add_way(w)
+
+    def write_segments(self, parent_id: int, node_refs: np.ndarray, tags: dict):
+        for segment_way in create_segment_ways(
+            parent_id, node_refs, tags, self.intersection_index, self.timestamp
+        ):
+            self.new_segments[segment_way.id] = (segment_way.nodes, segment_way.tags)
+            self.writer.add_way(segment_way)
+
+    def write_neighbour_segments(self):
+        """Rebuild the neighbour ways from their old segments and segment them again."""
+        for parent_id, segments in self.neighbour_segments.items():
+            segments.sort(key=lambda segment: segment[0])
+            node_refs = list(segments[0][1])
+            for _, segment_node_refs, _ in segments[1:]:
+                node_refs.extend(segment_node_refs[1:])
+            tags = {
+                key: value
+                for key, value in segments[0][2].items()
+                if key not in SEGMENT_TAG_KEYS
+            }
+            self.write_segments(parent_id, np.array(node_refs, dtype=np.int64), tags)
+
+    def get_changes(self) -> dict[str, list[int]]:
+        """Get the added, removed and modified segment ids."""
+        old_ids = set(self.old_segments)
+        new_ids = set(self.new_segments)
+        modified_ids = set(self.moved_segment_ids)
+        for segment_id in old_ids & new_ids:
+            node_refs, tags = self.old_segments[segment_id]
+            new_node_refs, new_tags = self.new_segments[segment_id]
+            if (
+                list(node_refs) != list(new_node_refs)
+                or tags != new_tags
+                or sorted_array_contains(
+                    self.moved_node_ids, np.array(new_node_refs, dtype=np.int64)
+                ).any()
+            ):
+                modified_ids.add(segment_id)
+        return {
+            "added": sorted(new_ids - old_ids),
+            "removed": sorted(old_ids - new_ids),
+            "modified": sorted(modified_ids),
+        }
+
+
+def get_changes_path(osm_segmented_network_path: str) -> str:
+    """Get the path of the segment changes file of a segmented OSM network."""
+    return osm_segmented_network_path + OSM_SEGMENTED_CHANGES_FILE_EXTENSION
+
+
+@time_logger
+def update_segmented_osm_network(
+    osm_segmented_network_path: str,
+    osm_change_path: str,
+    intersection_index_backend: str = DEFAULT_INTERSECTION_INDEX_BACKEND,
+    way_filter: dict[str, list[str]] | None = DEFAULT_SEGMENTATION_WAY_FILTER,
+    osm_source_path: str | None = None,
+) -> dict[str, list[int]]:
+    """
+    Apply an OSM change file (.osc) to a segmented OSM network in place.
+    Only the ways changed in the file, and the ways whose intersections
+    changed, are segmented again.
+
+    The changed segment ids are written next to the network
+    (<network>.osm.pbf.changes.json), so that the segment store and the
+    cost networks can be patched instead of rebuilt.
+
+    :param osm_segmented_network_path: Path to the segmented OSM PBF file.
+    :param osm_change_path: Path to the OSM change file.
+    :param intersection_index_backend: Backend for the intersection indexes: set, numpy or disk.
+    :param way_filter: Tag filter for the kept ways, should be the one used in the segmentation.
+    :param osm_source_path: Path to the source OSM PBF file, for the nodes of the changed ways
+        which were pruned from the segmented network. Defaults to the source in the manifest.
+    :return: Dict with the added, removed and modified segment ids.
+    """
+    LOG.info(
+        f"Updating segmented OSM network {osm_segmented_network_path} with changes from {osm_change_path}."
+    )
+    change_collector = OsmChangeCollector(way_filter)
+    change_collector.apply_file(osm_change_path)
+    changed_way_ids = change_collector.changed_way_ids
+    LOG.info(
+        f"Change file has {len(change_collector.changed_node_ids)} changed nodes and {len(changed_way_ids)} changed ways."
+    )
+
+    updated_network_path = osm_segmented_network_path + ".updating.osm.pbf"
+    old_intersection_index = create_intersection_index(intersection_index_backend)
+    new_intersection_index = create_intersection_index(intersection_index_backend)
+    try:
+        # intersections before and after the change
+        intersection_collector = UpdateIntersectionCollector(
+            old_intersection_index, new_intersection_index, changed_way_ids
+        )
+        intersection_collector.apply_file(osm_segmented_network_path)
+        new_way_node_refs = [
+            node_refs for node_refs, _ in change_collector.new_ways.values()
+        ]
+        for node_refs in new_way_node_refs:
+            new_intersection_index.add_way(node_refs)
+        old_intersection_index.finalize()
+        new_intersection_index.finalize()
+
+        # only the nodes of the changed ways can change their intersection status
+        candidate_nodes = np.unique(
+            np.concatenate(
+                [
+                    np.empty(0, dtype=np.int64),
+                    *intersection_collector.changed_node_refs,
+                    *new_way_node_refs,
+                ]
+            )
+        )
+        # nodes of the changed ways that neither the segmented network nor the change file has
+        missing_node_ids = np.setdiff1d(
+            candidate_nodes,
+            np.setdiff1d(
+                change_collector.changed_node_ids, change_collector.deleted_node_ids
+            ),
+        )
+        missing_node_ids = missing_node_ids[
+            [
+                not old_intersection_index.is_referenced_node(node_id)
+                for node_id in missing_node_ids.tolist()
+            ]
+        ]
+        if len(missing_node_ids) and osm_source_path is None:
+            manifest = read_segmented_network_manifest(osm_segmented_network_path)
+            osm_source_path = (manifest or {}).get("source", {}).get("path")
+        missing_nodes = get_missing_nodes(missing_node_ids, osm_source_path)
+
+        changed_intersection_nodes = candidate_nodes[
+            old_intersection_index.is_intersection(candidate_nodes)
+            != new_intersection_index.is_intersection(candidate_nodes)
+        ]
+
+        neighbour_collector = NeighbourWayCollector(
+            changed_intersection_nodes, changed_way_ids
+        )
+        if len(changed_intersection_nodes):
+            neighbour_collector.apply_file(osm_segmented_network_path)
+        LOG.info(
+            f"{len(changed_intersection_nodes)} nodes changed intersection status, "
+            f"segmenting again {len(neighbour_collector.neighbour_way_ids)} neighbour ways."
+        )
+
+        if os.path.exists(updated_network_path):
+            os.remove(updated_network_path)
+        writer = osmium.SimpleWriter(updated_network_path)
+        try:
+            updater = SegmentedNetworkUpdater(
+                writer,
+                new_intersection_index,
+                changed_way_ids,
+                set(change_collector.new_ways),
+                neighbour_collector.neighbour_way_ids,
+                np.unique(np.array(change_collector.changed_node_ids, dtype=np.int64)),
+                missing_nodes,
+            )
+            merge_reader = osmium.MergeInputReader()
+            merge_reader.add_file(osm_segmented_network_path)
+            merge_reader.add_file(osm_change_path)
+            # only the newest version of each object, deleted objects are flagged
+            merge_reader.apply(updater, simplify=True)
+            updater.write_missing_nodes()
+            updater.write_neighbour_segments()
+        finally:
+            writer.close()
+    except Exception:
+        if os.path.exists(updated_network_path):
+            os.remove(updated_network_path)
+        raise
+    finally:
+        old_intersection_index.close()
+        new_intersection_index.close()
+
+    os.replace(updated_network_path, osm_segmented_network_path)
+    update_segmented_network_manifest(osm_segmented_network_path, osm_change_path)
+
+    segment_changes = updater.get_changes()
+    with open(get_changes_path(osm_segmented_network_path), "w") as changes_file:
+        json.dump(segment_changes, changes_file)
+    LOG.info(
+        f"Updated segmented OSM network: {len(segment_changes['added'])} added, "
+        f"{len(segment_changes['removed'])} removed and {len(segment_changes['modified'])} modified segments."
+    )
+    return segment_changes
@@ -1,171 +1,1038 @@
 """ Segment the OSM network into segments between intersections. """
 
+import bisect
 import datetime
+import multiprocessing
 import os
+from array import array
+import shutil
+import tempfile
+import numpy as np
 import osmium
+import shapely
+from shapely.geometry.base import BaseGeometry
 
+from ..config import (
+    DEFAULT_INTERSECTION_INDEX_BACKEND,
+    DEFAULT_SEGMENTATION_WAY_FILTER,
+    DEFAULT_SEGMENTATION_WORKERS,
+    CLIP_NODE_CHUNK_SIZE,
+    INTERSECTION_INDEX_BITMAP_MAX_BYTES,
+    INTERSECTION_INDEX_CHUNK_SIZE,
+    OSM_COORDINATE_PRECISION,
+    PBF_COPY_CHUNK_SIZE,
+    SORTED_ID_LOOKUP_BLOCK_SIZE,
+    SEGMENT_ID_ORDINAL_BITS,
+)
 from ..data_utilities import construct_osm_segmented_network_name
 from ..green_paths_exceptions import OsmSegmenterError
 from ..logging import setup_logger, LoggerColors
 from ..timer import time_logger
+from .segmented_network_cache import (
+    get_segmentation_parameters,
+    get_segmentation_variant,
+    remove_segmented_network_cache,
+    segmented_network_cache_is_valid,
+    write_segmented_network_manifest,
+)
 
 LOG = setup_logger(__name__, LoggerColors.RED.value)
 
 
-class IntersectionCollector(osmium.SimpleHandler):
-    def __init__(self):
-        osmium.SimpleHandler.__init__(self)
+# INTERSECTION INDEX BACKENDS
+# The intersection index collects the node references of all ways and
+# answers if a node is an intersection, i.e. it is referenced more than once.
+
+
+class IntersectionIndex:
+    """
+    Base class for the intersection index backends.
+    Node references are buffered into a growable int64 array
+    and flushed to the backend in chunks.
+    """
+
+    def __init__(self, chunk_size: int = INTERSECTION_INDEX_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self._buffer = np.empty(min(chunk_size, 1 << 16), dtype=np.int64)
+        self._buffer_size = 0
+
+    def add_way(self, node_refs: np.ndarray) -> None:
+        """Add the node references of a single way."""
+        refs_count = len(node_refs)
+        if self._buffer_size + refs_count > self.chunk_size:
+            self._flush_buffer()
+        required_size = self._buffer_size + refs_count
+        if required_size > len(self._buffer):
+            # grow the buffer by doubling, up to the chunk size
+            grown_buffer = np.empty(
+                max(required_size, min(len(self._buffer) * 2, self.chunk_size)),
+                dtype=np.int64,
+            )
+            grown_buffer[: self._buffer_size] = self._buffer[: self._buffer_size]
+            self._buffer = grown_buffer
+        self._buffer[self._buffer_size : self._buffer_size + refs_count] = node_refs
+        self._buffer_size += refs_count
+
+    def _flush_buffer(self) -> None:
+        if self._buffer_size:
+            chunk = np.sort(self._buffer[: self._buffer_size])
+            is_duplicate = chunk[1:] == chunk[:-1]
+            chunk_duplicates = chunk[1:][is_duplicate]
+            chunk_unique = chunk[np.concatenate(([True], ~is_duplicate))]
+            self._add_chunk(chunk_unique, chunk_duplicates)
+        self._buffer_size = 0
+
+    def _add_chunk(self, unique_refs: np.ndarray, duplicate_refs: np.ndarray) -> None:
+        """Add sorted unique refs of a chunk and the refs seen more than once in it."""
+        raise NotImplementedError
+
+    def finalize(self) -> None:
+        """Flush the remaining buffer, must be called before querying."""
+        self._flush_buffer()
+        self._buffer = np.empty(0, dtype=np.int64)
+
+    def is_intersection(self, node_refs: np.ndarray) -> np.ndarray:
+        """Return a boolean array telling which of the node refs are intersections."""
+        raise NotImplementedError
+
+    def is_referenced_node(self, node_id: int) -> bool:
+        """Check if a node is referenced by any of the added ways."""
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        """Number of intersection nodes."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Release resources (e.g. temporary files) held by the index."""
+        pass
+
+
+class SetIntersectionIndex(IntersectionIndex):
+    """The original Python set based index. Fast for small extracts, but ~70+ bytes per node."""
+
+    def __init__(self, chunk_size: int = INTERSECTION_INDEX_CHUNK_SIZE):
+        super().__init__(chunk_size)
         self.node_refs = set()
         self.intersection_nodes = set()
 
-    def way(self, w):
-        for node in w.nodes:
-            if node.ref in self.node_refs:
-                self.intersection_nodes.add(node.ref)
-            else:
-                self.node_refs.add(node.ref)
+    def _add_chunk(self, unique_refs: np.ndarray, duplicate_refs: np.ndarray) -> None:
+        unique_refs = unique_refs.tolist()
+        self.intersection_nodes.update(self.node_refs.intersection(unique_refs))
+        self.intersection_nodes.update(duplicate_refs.tolist())
+        self.node_refs.update(unique_refs)
+
+    def is_intersection(self, node_refs: np.ndarray) -> np.ndarray:
+        return np.fromiter(
+            (node_ref in self.intersection_nodes for node_ref in node_refs.tolist()),
+            dtype=bool,
+            count=len(node_refs),
+        )
+
+    def is_referenced_node(self, node_id: int) -> bool:
+        return node_id in self.node_refs
+
+    def __len__(self) -> int:
+        return len(self.intersection_nodes)
+
+
+class NumpyIntersectionIndex(IntersectionIndex):
+    """
+    In-memory index using sorted int64 arrays, duplicates are found with sort and unique.
+    Lookups use a bitmap if the id range of the intersections fits into the
+    bitmap budget, otherwise a binary search over the sorted intersections.
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = INTERSECTION_INDEX_CHUNK_SIZE,
+        bitmap_max_bytes: int = INTERSECTION_INDEX_BITMAP_MAX_BYTES,
+    ):
+        super().__init__(chunk_size)
+        self.bitmap_max_bytes = bitmap_max_bytes
+        self.node_refs = np.empty(0, dtype=np.int64)
+        self.intersection_nodes = np.empty(0, dtype=np.int64)
+        self._node_ref_parts = []
+        self._intersection_parts = []
+        self._bitmap = None
+        self._bitmap_min_ref = 0
+        self._referenced_nodes = SortedIdLookup(self.node_refs)
+
+    def _add_chunk(self, unique_refs: np.ndarray, duplicate_refs: np.ndarray) -> None:
+        # the chunks are merged once in finalize
+        self._node_ref_parts.append(unique_refs)
+        self._intersection_parts.append(duplicate_refs)
+
+    def finalize(self) -> None:
+        super().finalize()
+        # the stable sort merges the sorted chunks, refs found in more than one
+        # chunk are intersections as well
+        node_refs = np.concatenate([self.node_refs, *self._node_ref_parts])
+        self._node_ref_parts = []
+        node_refs.sort(kind="stable")
+        is_duplicate = node_refs[1:] == node_refs[:-1]
+        self._intersection_parts.append(node_refs[1:][is_duplicate])
+        self.node_refs = node_refs[np.concatenate(([True], ~is_duplicate))]
+        del node_refs, is_duplicate
+        self.intersection_nodes = np.unique(
+            np.concatenate([self.intersection_nodes, *self._intersection_parts])
+        )
+        self._intersection_parts = []
+        self._referenced_nodes = SortedIdLookup(self.node_refs)
+
+        self._bitmap = None
+        if len(self.intersection_nodes):
+            self._bitmap_min_ref = int(self.intersection_nodes[0])
+            id_span = int(self.intersection_nodes[-1]) - self._bitmap_min_ref + 1
+            if id_span // 8 + 1 <= self.bitmap_max_bytes:
+                self._bitmap = np.zeros(id_span // 8 + 1, dtype=np.uint8)
+                set_bitmap_bits(
+                    self._bitmap, self.intersection_nodes - self._bitmap_min_ref
+                )
+
+    def is_intersection(self, node_refs: np.ndarray) -> np.ndarray:
+        if self._bitmap is None:
+            return sorted_array_contains(self.intersection_nodes, node_refs)
+        return get_bitmap_bits(self._bitmap, node_refs - self._bitmap_min_ref)
+
+    def is_referenced_node(self, node_id: int) -> bool:
+        return node_id in self._referenced_nodes
+
+    def __len__(self) -> int:
+        return len(self.intersection_nodes)
+
+
+class DiskIntersectionIndex(IntersectionIndex):
+    """
+    Disk-backed index for extracts bigger than memory. Uses two memory mapped
+    bitmaps (seen nodes and intersection nodes) indexed by the node id,
+    so the operating system pages only the touched parts into memory.
+    Needs about 2 bits of disk per id up to the largest node id.
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = INTERSECTION_INDEX_CHUNK_SIZE,
+        directory: str = None,
+    ):
+        super().__init__(chunk_size)
+        self.directory = tempfile.mkdtemp(prefix="gp2_intersections_", dir=directory)
+        self._seen_path = os.path.join(self.directory, "seen.bitmap")
+        self._intersections_path = os.path.join(self.directory, "intersections.bitmap")
+        self._capacity = 0
+        self._seen = None
+        self._intersections = None
+        self._intersection_count = 0
+
+    def _ensure_capacity(self, max_ref: int) -> None:
+        required_bytes = max_ref // 8 + 1
+        if required_bytes <= self._capacity:
+            return
+        new_capacity = max(required_bytes + required_bytes // 2, 1 << 20)
+        for path in (self._seen_path, self._intersections_path):
+            # extending a file fills it with zeros
+            with open(path, "ab") as bitmap_file:
+                bitmap_file.truncate(new_capacity)
+        self._seen = np.memmap(self._seen_path, dtype=np.uint8, mode="r+")
+        self._intersections = np.memmap(
+            self._intersections_path, dtype=np.uint8, mode="r+"
+        )
+        self._capacity = new_capacity
+
+    def _add_chunk(self, unique_refs: np.ndarray, duplicate_refs: np.ndarray) -> None:
+        if not len(unique_refs):
+            return
+        if unique_refs[0] < 0:
+            raise OsmSegmenterError(
+                "Disk intersection index supports only positive node ids."
+            )
+        self._ensure_capacity(int(unique_refs[-1]))
+        # seen in the earlier chunks or more than once in this one, the duplicates
+        # are found from the sorted unique refs
+        is_new_intersection = get_bitmap_bits(self._seen, unique_refs)
+        is_new_intersection[np.searchsorted(unique_refs, duplicate_refs)] = True
+        new_intersections = unique_refs[is_new_intersection]
+        already_counted = get_bitmap_bits(self._intersections, new_intersections)
+        self._intersection_count += int(np.count_nonzero(~already_counted))
+        set_bitmap_bits(self._intersections, new_intersections)
+        set_bitmap_bits(self._seen, unique_refs)
+
+    def is_intersection(self, node_refs: np.ndarray) -> np.ndarray:
+        if self._intersections is None:
+            return np.zeros(len(node_refs), dtype=bool)
+        return get_bitmap_bits(self._intersections, node_refs)
+
+    def is_referenced_node(self, node_id: int) -> bool:
+        if node_id < 0 or node_id >> 3 >= self._capacity:
+            return False
+        return bool(self._seen[node_id >> 3] >> (node_id & 7) & 1)
+
+    def __len__(self) -> int:
+        return self._intersection_count
+
+    def __getstate__(self) -> dict:
+        # the memory maps are reopened in the worker processes, not copied
+        state = self.__dict__.copy()
+        state["_seen"] = None
+        state["_intersections"] = None
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        if self._capacity:
+            self._seen = np.memmap(self._seen_path, dtype=np.uint8, mode="r")
+            self._intersections = np.memmap(
+                self._intersections_path, dtype=np.uint8, mode="r"
+            )
+
+    def close(self) -> None:
+        self._seen = None
+        self._intersections = None
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+INTERSECTION_INDEX_BACKENDS = {
+    "set": SetIntersectionIndex,
+    "numpy": NumpyIntersectionIndex,
+    "disk": DiskIntersectionIndex,
+}
+
+
+def create_intersection_index(backend: str = DEFAULT_INTERSECTION_INDEX_BACKEND):
+    """Create an intersection index by backend name (set, numpy or disk)."""
+    if backend not in INTERSECTION_INDEX_BACKENDS:
+        raise OsmSegmenterError(
+            f"Unknown intersection index backend: {backend}. Options are: {list(INTERSECTION_INDEX_BACKENDS)}"
+        )
+    return INTERSECTION_INDEX_BACKENDS[backend]()
 
 
-# Check if a node is a cutting point
-def is_cutting_point(node, intersection_nodes):
-    return node.ref in intersection_nodes
+def sorted_array_contains(sorted_array: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Check which values are found from the sorted array with a binary search."""
+    if not len(sorted_array):
+        return np.zeros(len(values), dtype=bool)
+    positions = np.searchsorted(sorted_array, values)
+    positions[positions == len(sorted_array)] = 0
+    return sorted_array[positions] == values
 
 
-# Create a new unique ID for the segment
-# minus sign is used to avoid conflicts with existing IDs
-# and to indicate that these are not real OSM IDs from the OSM database
-# Initialize the base OSM ID
-base_osm_id = -1
+class SortedIdLookup:
+    """
+    Membership lookups from a sorted int64 array of ids. The ids of a PBF come
+    in ascending order, so the lookups are done from a block of Python ints,
+    and the block is moved forward with a binary search only when the queried
+    ids go past it. Any query order gives correct answers.
+    """
+
+    def __init__(self, sorted_ids: np.ndarray):
+        self.sorted_ids = sorted_ids
+        self._block = []
+        self._block_low = 0
+        self._block_high = -1
+
+    def __contains__(self, queried_id: int) -> bool:
+        if not (self._block_low <= queried_id <= self._block_high):
+            block_start = int(np.searchsorted(self.sorted_ids, queried_id))
+            block_end = block_start + SORTED_ID_LOOKUP_BLOCK_SIZE
+            self._block = self.sorted_ids[block_start:block_end].tolist()
+            self._block_low = queried_id
+            self._block_high = (
+                self._block[-1] if block_end < len(self.sorted_ids) else float("inf")
+            )
+        position = bisect.bisect_left(self._block, queried_id)
+        return position < len(self._block) and self._block[position] == queried_id
 
+    def __len__(self) -> int:
+        return len(self.sorted_ids)
 
-def generate_new_id():
-    global base_osm_id
-    new_id = base_osm_id
-    base_osm_id -= 1
-    return new_id
 
+def set_bitmap_bits(bitmap: np.ndarray, positions: np.ndarray) -> None:
+    """Set the bits of the given (sorted, unique) positions in a uint8 bitmap."""
+    np.bitwise_or.at(
+        bitmap, positions >> 3, np.left_shift(1, positions & 7).astype(np.uint8)
+    )
+
+
+def get_bitmap_bits(bitmap: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    """Get the bits of the given positions, positions outside of the bitmap are False."""
+    byte_positions = positions >> 3
+    in_range = (positions >= 0) & (byte_positions < len(bitmap))
+    bits = np.zeros(len(positions), dtype=bool)
+    bits[in_range] = (
+        bitmap[byte_positions[in_range]] >> (positions[in_range] & 7) & 1
+    ).astype(bool)
+    return bits
+
+
+def compile_way_filter(way_filter: dict[str, list[str]] | None) -> dict | None:
+    """Convert the tag values of a way filter to sets for fast lookups."""
+    if way_filter is None:
+        return None
+    return {key: frozenset(values) for key, values in way_filter.items()}
+
+
+def way_matches_filter(tags, way_filter: dict | None) -> bool:
+    """
+    Check if a way is kept by the way filter. A way is kept if any of its
+    tags has one of the filter values for the key. None keeps all the ways.
+    """
+    if way_filter is None:
+        return True
+    return any(tags.get(key) in values for key, values in way_filter.items())
+
+
+class IntersectionCollector(osmium.SimpleHandler):
+    """
+    First pass over the source file. Collects the nodes that are shared by
+    more than one way (or visited twice by the same way), these are the points
+    where the ways are cut into segments. Only the ways kept by the way filter
+    are collected, so the index also knows which nodes the output needs.
+    """
 
-class SegmentCreator(osmium.SimpleHandler):
-    def __init__(self, intersection_nodes):
+    def __init__(self, intersection_index: IntersectionIndex, way_filter: dict = None):
         osmium.SimpleHandler.__init__(self)
-        self.intersection_nodes = intersection_nodes
-        self.segments = []
+        self.intersection_index = intersection_index
+        self.way_filter = compile_way_filter(way_filter)
+        self.way_count = 0
+        # ids of the kept ways, only these are segmented in the second pass
+        self.way_ids = array("q")
 
     def way(self, w):
-        current_segment_nodes = []
-        for node in w.nodes:
-            # Store node references
-            current_segment_nodes.append(node.ref)
-            if is_cutting_point(node, self.intersection_nodes):
-                if len(current_segment_nodes) > 1:
-                    # Deep-copy tags into a Python dict
-                    tags_dict = {tag.k: tag.v for tag in w.tags}
-                    parent_id_tag = {"parent_id": str(w.id)}
-                    merged_tags = {**tags_dict, **parent_id_tag}
-                    # tags_dict["parent_id"] = w.id
-                    self.segments.append(
-                        {
-                            "nodes": current_segment_nodes.copy(),
-                            "tags": merged_tags,
-                        }
-                    )
-                current_segment_nodes = [node.ref]
-
-        # Handle the last segment
-        if len(current_segment_nodes) > 1:
-            tags_dict = {tag.k: tag.v for tag in w.tags}
-            parent_id_tag = {"parent_id": str(w.id)}
-            merged_tags = {**tags_dict, **parent_id_tag}
-            self.segments.append(
-                {
-                    "nodes": current_segment_nodes.copy(),
-                    "tags": merged_tags,
-                }
+        self.way_count += 1
+        if not way_matches_filter(w.tags, self.way_filter):
+            return
+        node_refs = node_refs_to_array(w.nodes)
+        if not self.keep_way_nodes(node_refs):
+            return
+        self.intersection_index.add_way(node_refs)
+        self.way_ids.append(w.id)
+
+    def keep_way_nodes(self, node_refs: np.ndarray) -> bool:
+        """Check if a way passing the tag filter is kept based on its nodes."""
+        return True
+
+
+class ClippingIntersectionCollector(IntersectionCollector):
+    """
+    IntersectionCollector which keeps only the ways with at least one node
+    inside the clip area. The ways crossing the border are kept whole.
+    The nodes come before the ways in a PBF, so the nodes inside the area are
+    collected in the same pass, checking their locations in chunks.
+    """
+
+    def __init__(
+        self,
+        intersection_index: IntersectionIndex,
+        way_filter: dict = None,
+        clip_area: BaseGeometry = None,
+    ):
+        super().__init__(intersection_index, way_filter)
+        self.clip_area = clip_area
+        shapely.prepare(self.clip_area)
+        self._node_ids = array("q")
+        self._node_xs = array("i")
+        self._node_ys = array("i")
+        self._inside_node_parts = []
+        self.inside_node_ids = None
+
+    def node(self, n):
+        # coordinates as fixed point integers, these need no location checks
+        self._node_ids.append(n.id)
+        self._node_xs.append(n.location.x)
+        self._node_ys.append(n.location.y)
+        if len(self._node_ids) >= CLIP_NODE_CHUNK_SIZE:
+            self._flush_nodes()
+
+    def _flush_nodes(self) -> None:
+        if len(self._node_ids):
+            node_ids = np.frombuffer(self._node_ids, dtype=np.int64)
+            is_inside = shapely.contains_xy(
+                self.clip_area,
+                np.frombuffer(self._node_xs, dtype=np.int32) / OSM_COORDINATE_PRECISION,
+                np.frombuffer(self._node_ys, dtype=np.int32) / OSM_COORDINATE_PRECISION,
+            )
+            self._inside_node_parts.append(node_ids[is_inside].copy())
+        self._node_ids = array("q")
+        self._node_xs = array("i")
+        self._node_ys = array("i")
+
+    def keep_way_nodes(self, node_refs: np.ndarray) -> bool:
+        if self.inside_node_ids is None:
+            # first way, all the nodes have been read
+            self._flush_nodes()
+            self.inside_node_ids = np.sort(
+                np.concatenate([np.empty(0, dtype=np.int64), *self._inside_node_parts])
             )
+            self._inside_node_parts = []
+            LOG.info(f"Found {len(self.inside_node_ids)} nodes inside the clip area.")
+        return bool(sorted_array_contains(self.inside_node_ids, node_refs).any())
 
 
-# Handler to copy nodes
-class NodeCopyHandler(osmium.SimpleHandler):
-    def __init__(self, writer):
-        super().__init__()
+def node_refs_to_array(way_nodes) -> np.ndarray:
+    """Convert the node list of an osmium way to an int64 array of node refs."""
+    return np.fromiter(
+        (node.ref for node in way_nodes), dtype=np.int64, count=len(way_nodes)
+    )
+
+
+def split_way_node_refs(
+    node_refs: np.ndarray, is_cutting_point: np.ndarray
+) -> list[list[int]]:
+    """
+    Split the node references of a way into segments between intersections.
+    Only the inner nodes of the way can cut it.
+
+    Parameters:
+    - node_refs: The node references of the way in order.
+    - is_cutting_point: Boolean array, True for the nodes that are intersections.
+
+    Returns:
+    - List of segments, each a list of (at least two) node references.
+    """
+    if len(node_refs) < 2:
+        return []
+    cut_positions = np.flatnonzero(is_cutting_point[1:-1]) + 1
+    segment_bounds = [0, *cut_positions.tolist(), len(node_refs) - 1]
+    node_refs = node_refs.tolist()
+    return [
+        node_refs[segment_start : segment_end + 1]
+        for segment_start, segment_end in zip(segment_bounds, segment_bounds[1:])
+    ]
+
+
+def create_segment_id(parent_id: int, ordinal: int) -> int:
+    """
+    Create a stable segment id from the parent way id and the position of the
+    segment within the way. The parent id and the ordinal are packed into one
+    int64, the sign is flipped to avoid conflicts with the real OSM ids and to
+    indicate that these are not from the OSM database.
+    Re-segmenting an unchanged network gives the same ids.
+
+    Parameters:
+    - parent_id: The OSM id of the way the segment is cut from.
+    - ordinal: The position of the segment within the way, starting from 0.
+
+    Returns:
+    - The segment id (gp2_osm_id).
+    """
+    if parent_id < 0 or parent_id >= 1 << (63 - SEGMENT_ID_ORDINAL_BITS):
+        raise OsmSegmenterError(
+            f"Cannot create segment id for way {parent_id}, way id out of range."
+        )
+    if ordinal >= 1 << SEGMENT_ID_ORDINAL_BITS:
+        raise OsmSegmenterError(
+            f"Way {parent_id} has more than {1 << SEGMENT_ID_ORDINAL_BITS} segments."
+        )
+    return -((parent_id << SEGMENT_ID_ORDINAL_BITS) | ordinal)
+
+
+def split_segment_id(segment_id: int) -> tuple[int, int]:
+    """Get the parent way id and the ordinal of the segment from a segment id."""
+    packed_id = -segment_id
+    return (
+        packed_id >> SEGMENT_ID_ORDINAL_BITS,
+        packed_id & ((1 << SEGMENT_ID_ORDINAL_BITS) - 1),
+    )
+
+
+def create_segment_ways(
+    parent_id: int,
+    node_refs: np.ndarray,
+    tags: dict,
+    intersection_index: IntersectionIndex,
+    timestamp: datetime.datetime,
+) -> list:
+    """
+    Split a way into segments between the intersection nodes.
+
+    Parameters:
+    - parent_id: The OSM id of the way.
+    - node_refs: The node references of the way in order.
+    - tags: The tags of the way, shared by all the segments.
+    - intersection_index: Finalized intersection index.
+    - timestamp: Timestamp for the segments.
+
+    Returns:
+    - List of osmium mutable ways, one per segment.
+    """
+    # one batched lookup per way
+    segments = split_way_node_refs(
+        node_refs, intersection_index.is_intersection(node_refs)
+    )
+    if not segments:
+        return []
+
+    tags_dict = dict(tags)
+    tags_dict["parent_id"] = str(parent_id)
+
+    segment_ways = []
+    for ordinal, segment_nodes in enumerate(segments):
+        segment_id = create_segment_id(parent_id, ordinal)
+        segment_tags = dict(tags_dict)
+        segment_tags["gp2_osm_id"] = str(segment_id)
+
+        segment_ways.append(
+            osmium.osm.mutable.Way(
+                id=segment_id,
+                version=1,
+                visible=True,
+                changeset=1,
+                timestamp=timestamp,
+                uid=1,
+                user="GreenPaths2",
+                tags=segment_tags,
+                nodes=segment_nodes,
+            )
+        )
+    return segment_ways
+
+
+class SegmentWriter(osmium.SimpleHandler):
+    """
+    Second pass over the source file. Writes the segmented ways straight to
+    the writer while streaming, so that no segments are kept in memory.
+    Memory use depends only on the intersection nodes.
+
+    Segment ids are derived from the parent way id and the position of the
+    segment within the way, see create_segment_id.
+
+    Only the ways kept in the first pass (by the way filter and the clip area)
+    are segmented.
+    """
+
+    def __init__(
+        self,
+        writer,
+        intersection_index: IntersectionIndex,
+        kept_way_ids: np.ndarray,
+    ):
+        osmium.SimpleHandler.__init__(self)
         self.writer = writer
+        self.intersection_index = intersection_index
+        self.kept_way_ids = SortedIdLookup(kept_way_ids)
+        self.timestamp = datetime.datetime.now()
+        self.segment_count = 0
+        self.node_count = 0
+        self.kept_node_count = 0
+
+    def way(self, w):
+        if w.id not in self.kept_way_ids:
+            return
+
+        for segment_way in create_segment_ways(
+            w.id,
+            node_refs_to_array(w.nodes),
+            {tag.k: tag.v for tag in w.tags},
+            self.intersection_index,
+            self.timestamp,
+        ):
+            # write the way to the new OSM PBF file
+            self.writer.add_way(segment_way)
+            self.segment_count += 1
+
+
+class NodeAndSegmentWriter(SegmentWriter):
+    """SegmentWriter that also copies the nodes referenced by the kept ways."""
 
     def node(self, n):
-        self.writer.add_node(n)
+        self.node_count += 1
+        if self.intersection_index.is_referenced_node(n.id):
+            self.writer.add_node(n)
+            self.kept_node_count += 1
+
+
+# OSM PBF BLOCKS
+# An OSM PBF file is a sequence of blobs: a 4 byte big-endian length, a
+# BlobHeader message of that length and the blob data. The first blob is the
+# OSMHeader, the others are OSMData blocks of at most 8000 objects each.
+# The blobs are located from their headers without decoding the data, so the
+# parallel segmentation hands each worker a byte range of blocks to parse,
+# and concatenates the blocks of the part files into the segmented network.
+
+PBF_HEADER_BLOB_TYPE = "OSMHeader"
+
+
+def _read_protobuf_varint(buffer: bytes, position: int) -> tuple[int, int]:
+    """Read a protobuf varint, returns the value and the position after it."""
+    value = 0
+    shift = 0
+    while True:
+        byte = buffer[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def read_pbf_blobs(osm_pbf_path: str) -> list[tuple[str, int, int]]:
+    """
+    Locate the blobs of an OSM PBF file by reading only their headers.
+
+    Parameters:
+    - osm_pbf_path: Path to the OSM PBF file.
+
+    Returns:
+    - List of (blob type, offset, size) in file order, the size includes the headers.
+    """
+    blobs = []
+    file_size = os.path.getsize(osm_pbf_path)
+    with open(osm_pbf_path, "rb") as pbf_file:
+        offset = 0
+        while offset < file_size:
+            blob_header_size = int.from_bytes(pbf_file.read(4), "big")
+            blob_header = pbf_file.read(blob_header_size)
+            blob_type, data_size = None, None
+            position = 0
+            try:
+                while position < len(blob_header):
+                    key, position = _read_protobuf_varint(blob_header, position)
+                    field_number, wire_type = key >> 3, key & 7
+                    if wire_type == 0:
+                        value, position = _read_protobuf_varint(blob_header, position)
+                        if field_number == 3:
+                            data_size = value
+                    elif wire_type == 2:
+                        length, position = _read_protobuf_varint(blob_header, position)
+                        if field_number == 1:
+                            blob_type = blob_header[
+                                position : position + length
+                            ].decode()
+                        position += length
+                    else:
+                        break
+            except (IndexError, UnicodeDecodeError):
+                blob_type = None
+            if (
+                len(blob_header) != blob_header_size
+                or blob_type is None
+                or data_size is None
+                or (not blobs and blob_type != PBF_HEADER_BLOB_TYPE)
+            ):
+                raise OsmSegmenterError(
+                    f"Could not read the blocks of {osm_pbf_path}, it is not a valid OSM PBF file."
+                )
+            blob_size = 4 + blob_header_size + data_size
+            blobs.append((blob_type, offset, blob_size))
+            offset += blob_size
+            pbf_file.seek(offset)
+    return blobs
+
+
+def split_pbf_data_blobs(
+    blobs: list[tuple[str, int, int]], parts: int
+) -> list[tuple[int, int]]:
+    """
+    Split the data blobs of an OSM PBF file into contiguous byte ranges of
+    about the same size. A blob is never split.
+
+    Parameters:
+    - blobs: The blobs of the file, see read_pbf_blobs.
+    - parts: Number of ranges to create.
+
+    Returns:
+    - List of half-open (start, end) byte ranges in file order, at most parts of them.
+    """
+    data_blobs = [
+        (offset, size)
+        for blob_type, offset, size in blobs
+        if blob_type != PBF_HEADER_BLOB_TYPE
+    ]
+    if not data_blobs:
+        return []
+    data_start = data_blobs[0][0]
+    blob_ends = np.array([offset + size for offset, size in data_blobs])
+    # each range ends at the end of the first blob reaching its share of the bytes
+    targets = data_start + (blob_ends[-1] - data_start) * np.arange(1, parts) / parts
+    bounds = [
+        data_start,
+        *blob_ends[np.searchsorted(blob_ends, targets)].tolist(),
+        int(blob_ends[-1]),
+    ]
+    return [
+        (range_start, range_end)
+        for range_start, range_end in zip(bounds, bounds[1:])
+        if range_start < range_end
+    ]
+
+
+def _copy_file_range(source_file, target_file, start: int, end: int) -> None:
+    source_file.seek(start)
+    remaining = end - start
+    while remaining:
+        chunk = source_file.read(min(remaining, PBF_COPY_CHUNK_SIZE))
+        if not chunk:
+            raise OsmSegmenterError(f"Unexpected end of file in {source_file.name}.")
+        target_file.write(chunk)
+        remaining -= len(chunk)
+
+
+def concatenate_pbf_files(osm_pbf_paths: list[str], output_path: str) -> None:
+    """
+    Concatenate OSM PBF files without decoding them: the header of the first
+    file is written, followed by the data blobs of all the files in order.
+    """
+    with open(output_path, "wb") as output_file:
+        for file_number, osm_pbf_path in enumerate(osm_pbf_paths):
+            _, header_offset, header_size = read_pbf_blobs(osm_pbf_path)[0]
+            with open(osm_pbf_path, "rb") as pbf_file:
+                _copy_file_range(
+                    pbf_file,
+                    output_file,
+                    header_offset + header_size if file_number else header_offset,
+                    os.path.getsize(osm_pbf_path),
+                )
+
+
+# the intersection index and the kept way ids are handed to the workers once, when the pool starts
+_worker_intersection_index = None
+_worker_kept_way_ids = None
+
+
+def _init_segmentation_worker(
+    intersection_index: IntersectionIndex, kept_way_ids: np.ndarray
+) -> None:
+    global _worker_intersection_index, _worker_kept_way_ids
+    _worker_intersection_index = intersection_index
+    _worker_kept_way_ids = kept_way_ids
+
+
+def _segment_pbf_blocks(
+    osm_source_path: str,
+    part_path: str,
+    header_range: tuple[int, int],
+    block_range: tuple[int, int],
+) -> tuple[int, int, int]:
+    """
+    Copy the nodes and segment the ways of one byte range of source blocks to
+    a part file. The blocks are first copied after the source header to an
+    input file of their own, so that only they are parsed.
+    Returns the segment count, the source node count and the kept node count.
+    """
+    part_source_path = part_path + ".source.osm.pbf"
+    try:
+        with open(osm_source_path, "rb") as source_file, open(
+            part_source_path, "wb"
+        ) as part_source_file:
+            _copy_file_range(source_file, part_source_file, *header_range)
+            _copy_file_range(source_file, part_source_file, *block_range)
+        writer = osmium.SimpleWriter(part_path)
+        try:
+            segment_writer = NodeAndSegmentWriter(
+                writer, _worker_intersection_index, _worker_kept_way_ids
+            )
+            segment_writer.apply_file(part_source_path)
+        finally:
+            writer.close()
+    finally:
+        if os.path.exists(part_source_path):
+            os.remove(part_source_path)
+    return (
+        segment_writer.segment_count,
+        segment_writer.node_count,
+        segment_writer.kept_node_count,
+    )
+
+
+def write_segments_in_parallel(
+    osm_source_path: str,
+    osm_segmented_network_path: str,
+    intersection_index: IntersectionIndex,
+    kept_way_ids: np.ndarray,
+    workers: int,
+) -> tuple[int, int, int]:
+    """
+    Copy the nodes and segment the ways with multiple worker processes.
+    The blocks of the source file are split into contiguous byte ranges, and
+    each worker parses only the blocks of its range, writing a part file.
+    The part files are concatenated block by block into the segmented OSM PBF
+    file, keeping the node and way order of the source.
+
+    The byte ranges are copied to temporary files next to the output, so this
+    needs about the size of the source file of extra disk space.
+
+    Parameters:
+    - osm_source_path: Path to the source OSM PBF file.
+    - osm_segmented_network_path: Path for the segmented OSM PBF file.
+    - intersection_index: Finalized intersection index.
+    - kept_way_ids: Sorted ids of the ways kept in the first pass.
+    - workers: Number of worker processes.
+
+    Returns:
+    - Number of written segments, source nodes and kept nodes.
+    """
+    blobs = read_pbf_blobs(osm_source_path)
+    _, header_offset, header_size = blobs[0]
+    header_range = (header_offset, header_offset + header_size)
+    block_ranges = split_pbf_data_blobs(blobs, workers)
+    if not block_ranges:
+        # no blocks, still write a valid file
+        block_ranges = [(header_range[1], header_range[1])]
+
+    parts_directory = tempfile.mkdtemp(
+        prefix="gp2_segment_parts_",
+        dir=os.path.dirname(os.path.abspath(osm_segmented_network_path)),
+    )
+    try:
+        part_paths = [
+            os.path.join(parts_directory, f"part_{part_number}.osm.pbf")
+            for part_number in range(len(block_ranges))
+        ]
+        with multiprocessing.Pool(
+            processes=min(workers, len(block_ranges)),
+            initializer=_init_segmentation_worker,
+            initargs=(intersection_index, kept_way_ids),
+        ) as pool:
+            part_counts = pool.starmap(
+                _segment_pbf_blocks,
+                [
+                    (osm_source_path, part_path, header_range, block_range)
+                    for part_path, block_range in zip(part_paths, block_ranges)
+                ],
+            )
+        concatenate_pbf_files(part_paths, osm_segmented_network_path)
+    finally:
+        shutil.rmtree(parts_directory, ignore_errors=True)
+    segment_count, node_count, kept_node_count = np.sum(part_counts, axis=0).tolist()
+    return segment_count, node_count, kept_node_count
+
+
+def create_segmentation_report(
+    osm_source_path: str,
+    osm_segmented_network_path: str,
+    way_count: int,
+    kept_way_count: int,
+    segment_count: int,
+    node_count: int,
+    kept_node_count: int,
+) -> dict:
+    """Log and return how much the segmented network shrank compared to the source."""
+    source_file_size = os.path.getsize(osm_source_path)
+    segmented_file_size = os.path.getsize(osm_segmented_network_path)
+    LOG.info(
+        f"Segmented file is {segmented_file_size / 1e6:.1f}MB, "
+        f"{segmented_file_size / max(source_file_size, 1):.0%} of the source {source_file_size / 1e6:.1f}MB. "
+        f"Kept {kept_way_count}/{way_count} ways (as {segment_count} segments) "
+        f"and {kept_node_count}/{node_count} nodes."
+    )
+    return {
+        "source_file_size": source_file_size,
+        "segmented_file_size": segmented_file_size,
+        "way_count": way_count,
+        "kept_way_count": kept_way_count,
+        "segment_count": segment_count,
+        "node_count": node_count,
+        "kept_node_count": kept_node_count,
+    }
 
 
 @time_logger
-def segment_or_use_cache_osm_network(osm_source_path: str) -> str:
+def segment_or_use_cache_osm_network(
+    osm_source_path: str,
+    intersection_index_backend: str = DEFAULT_INTERSECTION_INDEX_BACKEND,
+    workers: int = DEFAULT_SEGMENTATION_WORKERS,
+    way_filter: dict[str, list[str]] | None = DEFAULT_SEGMENTATION_WAY_FILTER,
+    clip_area: BaseGeometry = None,
+) -> str:
     """
     Segment the OSM network into segments between intersections.
     The name is taken from the source path if not provided.
 
+    The segmentation streams through the source file twice: first to collect
+    the intersection nodes, then to copy the nodes and write the segmented ways.
+    With more than one worker the second pass is split by the blocks of the
+    source file between worker processes, the first pass is always serial.
+    The segment ids are derived from the parent way id and the position of
+    the segment, so they are the same for any worker count and between runs.
+
+    Only the ways kept by the way filter (by default the walk and bike routable
+    highways) are segmented, and only the nodes referenced by them are copied.
+    If a clip area is given, only the ways with a node inside it are kept.
+
     Preprocessing pipeline will search for the segmented OSM network from the cache directory.
-    Using name pattern <filename>_segmented.osm.pbf.
+    Using name pattern <filename>_segmented.osm.pbf, with a variant key added to the name
+    for a non-default way filter or a clip area, so that e.g. clipped and unclipped networks
+    are cached side by side. The cached network is used if its manifest
+    (<filename>_segmented.osm.pbf.manifest.json) matches the source file and the parameters.
 
     :param osm_source_path: Path to the OSM PBF file.
     :param name: Name for the segmented OSM PBF file. If not provided, the default name is used.
+    :param intersection_index_backend: Backend for the intersection index: set, numpy or disk.
+    :param workers: Number of worker processes for the second pass.
+    :param way_filter: Tag key to allowed values filter for the kept ways, None keeps all the ways.
+    :param clip_area: Study area in WGS84 (lon, lat) to clip the network to, see study_area.py.
     :return: Path to the segmented OSM PBF file.
     """
+    if workers < 1:
+        raise OsmSegmenterError(f"Number of workers must be at least 1, got {workers}.")
+
+    # networks segmented with other parameters are cached side by side
+    segmentation_parameters = get_segmentation_parameters(way_filter, clip_area)
+    segmentation_variant = get_segmentation_variant(segmentation_parameters)
+
     try:
-        LOG.info(f"Starting to segment the OSM network.")
+        LOG.info("Starting to segment the OSM network.")
         LOG.info(f"Using file from path: {osm_source_path}")
         osm_segmented_network_path = construct_osm_segmented_network_name(
-            osm_source_path
+            osm_source_path, segmentation_variant
         )
 
-        if os.path.exists(osm_segmented_network_path):
-            LOG.info(f"Found segmented OSM network from cache, checking if valid.")
-            if not osm_pbf_is_valid(osm_segmented_network_path, max_ways=1000):
-                raise ValueError(
-                    f"Segmented OSM network file {osm_segmented_network_path} is not valid."
-                )
+        if segmented_network_cache_is_valid(
+            osm_segmented_network_path, osm_source_path, segmentation_parameters
+        ):
             LOG.info(
-                f"Found valid segmented OSM network from cache. Skipping segmentation."
+                "Found valid segmented OSM network from cache. Skipping segmentation."
             )
             return osm_segmented_network_path
 
+        # stale or unknown cache, segment again
+        remove_segmented_network_cache(osm_segmented_network_path)
         LOG.info(f"Segmenting the OSM network to path: {osm_segmented_network_path}")
-        # Initialize writer for the new OSM PBF file
-        writer = osmium.SimpleWriter(osm_segmented_network_path)
-        node_handler = NodeCopyHandler(writer)
-        # Process the OSM file with the node handler
-        node_handler.apply_file(osm_source_path)
-
-        # Load intersection nodes
-        collector = IntersectionCollector()
-        collector.apply_file(osm_source_path)
-        intersection_nodes = collector.intersection_nodes
-
-        # Create segments based on the collected intersection nodes
-        creator = SegmentCreator(intersection_nodes)
-        creator.apply_file(osm_source_path)
-
-        for _, segment in enumerate(creator.segments):
-            unique_new_id = generate_new_id()
 
-            segment["tags"]["gp2_osm_id"] = str(unique_new_id)
-
-            way = osmium.osm.mutable.Way(
-                segment,
-                id=unique_new_id,
-                version=1,
-                visible=True,
-                changeset=1,
-                timestamp=datetime.datetime.now(),
-                uid=1,
-                user="GreenPaths2",
-                tags=dict(segment["tags"]),
-                nodes=list(segment["nodes"]),
+        intersection_index = create_intersection_index(intersection_index_backend)
+        try:
+            # 1st pass: collect intersection nodes, only ways are read (and node locations when clipping)
+            if clip_area is None:
+                collector = IntersectionCollector(intersection_index, way_filter)
+            else:
+                collector = ClippingIntersectionCollector(
+                    intersection_index, way_filter, clip_area
+                )
+            collector.apply_file(osm_source_path)
+            kept_way_ids = np.sort(np.frombuffer(collector.way_ids, dtype=np.int64))
+            intersection_index.finalize()
+            LOG.info(
+                f"Found {len(intersection_index)} intersection nodes using {intersection_index_backend} index."
             )
 
-            # write the way to the new OSM PBF file
-            writer.add_way(way)
-        writer.close()
+            # 2nd pass: copy nodes and write segments to the new OSM PBF file
+            if workers > 1:
+                LOG.info(f"Writing segments with {workers} workers.")
+                segment_count, node_count, kept_node_count = write_segments_in_parallel(
+                    osm_source_path,
+                    osm_segmented_network_path,
+                    intersection_index,
+                    kept_way_ids,
+                    workers,
+                )
+            else:
+                writer = osmium.SimpleWriter(osm_segmented_network_path)
+                try:
+                    segment_writer = NodeAndSegmentWriter(
+                        writer, intersection_index, kept_way_ids
+                    )
+                    segment_writer.apply_file(osm_source_path)
+                finally:
+                    writer.close()
+                segment_count = segment_writer.segment_count
+                node_count = segment_writer.node_count
+                kept_node_count = segment_writer.kept_node_count
+        finally:
+            intersection_index.close()
+        LOG.info(f"Wrote {segment_count} segments.")
     except OsmSegmenterError as e:
         # if something goes wrong, remove the file
-        if os.path.exists(osm_segmented_network_path):
-            os.remove(osm_segmented_network_path)
+        remove_segmented_network_cache(osm_segmented_network_path)
         LOG.error(f"Segmentation failed with error: {e}")
         raise e
 
@@ -175,7 +1042,22 @@ def segment_or_use_cache_osm_network(osm_source_path: str) -> str:
         raise OsmSegmenterError(
             f"Segmented OSM network file {osm_segmented_network_path} is not valid."
         )
-    LOG.info(f"Segmenting the OSM network finished.")
+    segmentation_report = create_segmentation_report(
+        osm_source_path,
+        osm_segmented_network_path,
+        collector.way_count,
+        len(kept_way_ids),
+        segment_count,
+        node_count,
+        kept_node_count,
+    )
+    write_segmented_network_manifest(
+        osm_segmented_network_path,
+        osm_source_path,
+        segmentation_parameters,
+        segmentation_report,
+    )
+    LOG.info("Segmenting the OSM network finished.")
     return osm_segmented_network_path
 
 
@@ -0,0 +1,157 @@
+""" Cache for the processed OSM network GeoDataFrame. """
+
+import glob
+import hashlib
+import json
+import os
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from ..config import (
+    GEOMETRY_KEY,
+    LENGTH_KEY,
+    OSM_ID_KEY,
+    PROCESSED_NETWORK_CACHE_FILE_EXTENSION,
+    PROCESSED_NETWORK_CACHE_VERSION,
+)
+from ..logging import setup_logger, LoggerColors
+from .sampling_points import SamplingPoints
+from .segmented_network_cache import get_segmented_network_sha256
+
+LOG = setup_logger(__name__, LoggerColors.BLUE.value)
+
+
+# The processed network (ids, geometries in the project CRS, lengths and
+# sampling points) is stored next to the segmented network as a numpy .npz
+# file of plain columns: the geometries as concatenated WKB with their lengths
+# and the packed sampling point arrays as they are.
+# The file name holds a key of the segmented network's content hash and the
+# processing parameters, so any change in them is a cache miss. The content
+# hash is kept in the segmented network's manifest, so a cache hit does not
+# read the whole segmented network.
+
+
+def get_processed_network_cache_key(
+    osm_segmented_network_path: str, processing_parameters: dict
+) -> str:
+    """
+    Get the cache key of a processed network.
+
+    Parameters:
+    - osm_segmented_network_path: Path to the segmented OSM PBF file.
+    - processing_parameters: CRS and sampling parameters of the processing.
+
+    Returns:
+    - Short hash of the segmented network content and the parameters.
+    """
+    key_json = json.dumps(
+        {
+            "version": PROCESSED_NETWORK_CACHE_VERSION,
+            "segmented_sha256": get_segmented_network_sha256(
+                osm_segmented_network_path
+            ),
+            "parameters": processing_parameters,
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(key_json.encode()).hexdigest()[:16]
+
+
+def get_processed_network_cache_path(
+    osm_segmented_network_path: str, cache_key: str
+) -> str:
+    """Get the path of the processed network cache of a segmented OSM network."""
+    return f"{osm_segmented_network_path}.{cache_key}{PROCESSED_NETWORK_CACHE_FILE_EXTENSION}"
+
+
+def write_processed_network_cache(
+    cache_path: str, network_gdf: gpd.GeoDataFrame, sampling_points: SamplingPoints
+) -> None:
+    """
+    Write the processed network to the cache.
+
+    Parameters:
+    - cache_path: Path to the cache file.
+    - network_gdf: Processed network with ids, geometries and lengths.
+    - sampling_points: Sampling points of the network segments.
+    """
+    geometries_wkb = shapely.to_wkb(network_gdf.geometry.values)
+    wkb_lengths = np.fromiter(map(len, geometries_wkb), dtype=np.int64)
+
+    # write to a temporary file first, a partial cache file must never be read
+    temporary_cache_path = cache_path + ".tmp.npz"
+    np.savez(
+        temporary_cache_path,
+        index=network_gdf.index.to_numpy(dtype=np.int64),
+        osm_ids=network_gdf[OSM_ID_KEY].to_numpy(dtype=np.int64),
+        geometries_wkb=np.frombuffer(b"".join(geometries_wkb), dtype=np.uint8),
+        wkb_lengths=wkb_lengths,
+        lengths=network_gdf[LENGTH_KEY].to_numpy(dtype=np.float64),
+        sampling_point_x=sampling_points.x,
+        sampling_point_y=sampling_points.y,
+        sampling_point_offsets=sampling_points.offsets,
+    )
+    os.replace(temporary_cache_path, cache_path)
+    LOG.info(f"Saved processed network to cache {cache_path}")
+
+
+def read_processed_network_cache(
+    cache_path: str, crs: str | int
+) -> tuple[gpd.GeoDataFrame, SamplingPoints] | None:
+    """
+    Read the processed network from the cache.
+
+    Parameters:
+    - cache_path: Path to the cache file.
+    - crs: CRS of the cached geometries, the project CRS.
+
+    Returns:
+    - The processed network and its sampling points, or None if the cache file is missing or unreadable.
+    """
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with np.load(cache_path) as cache:
+            columns = {name: cache[name] for name in cache.files}
+    except (OSError, ValueError, KeyError) as e:
+        LOG.warning(f"Could not read processed network cache {cache_path}: {e}")
+        return None
+
+    wkb_offsets = np.concatenate(([0], np.cumsum(columns["wkb_lengths"])))
+    wkb_buffer = columns["geometries_wkb"].tobytes()
+    geometries = shapely.from_wkb(
+        [wkb_buffer[start:end] for start, end in zip(wkb_offsets[:-1], wkb_offsets[1:])]
+    )
+
+    network_gdf = gpd.GeoDataFrame(
+        {
+            OSM_ID_KEY: columns["osm_ids"],
+            GEOMETRY_KEY: geometries,
+            LENGTH_KEY: columns["lengths"],
+        },
+        geometry=GEOMETRY_KEY,
+        crs=crs,
+        index=columns["index"],
+    )
+    sampling_points = SamplingPoints(
+        columns["osm_ids"],
+        columns["sampling_point_x"],
+        columns["sampling_point_y"],
+        columns["sampling_point_offsets"],
+    )
+    LOG.info(f"Loaded processed network from cache {cache_path}")
+    return network_gdf, sampling_points
+
+
+def remove_stale_processed_network_caches(
+    osm_segmented_network_path: str, current_cache_path: str
+) -> None:
+    """Remove the processed network caches of a segmented network, other than the current one."""
+    for cache_path in glob.glob(
+        f"{glob.escape(osm_segmented_network_path)}.*{PROCESSED_NETWORK_CACHE_FILE_EXTENSION}"
+    ):
+        if cache_path != current_cache_path:
+            os.remove(cache_path)
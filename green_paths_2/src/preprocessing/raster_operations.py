@@ -1,30 +1,55 @@
 """ Raster processing module. """
 
+import math
+import multiprocessing
 import os
 import time
+from functools import lru_cache
 import geopandas as gpd
 import numpy as np
-from pyproj import CRS
+import shapely
+from pyproj import CRS, Transformer
 import rasterio
+from rasterio import windows
 from rasterio.features import rasterize
 from rasterio.transform import from_origin
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window
 
 import rasterio
 from rasterio.enums import Resampling
 from rasterio.warp import calculate_default_transform, reproject
 
 from ..config import (
-    OSM_ID_KEY,
     OUTPUT_FINAL_RESULTS_DIR_PATH,
+    CRS_TRANSFORMER_CACHE_SIZE,
+    DEFAULT_RASTERIZATION_WORKERS,
+    DEFAULT_RASTER_SAMPLING_WORKERS,
+    RASTERIZATION_TILE_SIZE,
+    RASTER_SAMPLING_CHUNKS_PER_WORKER,
     RASTER_NO_DATA_VALUE,
+    RASTER_WINDOW_MAX_BYTES,
+    NODATA_SHARE_STATISTIC,
     SEGMENT_POINTS_DEFAULT_SAMPLING_STRATEGY,
-    SEGMENT_SAMPLING_POINTS_KEY,
+    SEGMENT_STATISTIC_PERCENTILE_PREFIX,
+    SEGMENT_STATISTICS,
     SEGMENT_VALUES_ROUND_DECIMALS,
 )
 
 
 from ..green_paths_exceptions import SpatialOperationError
 from ..logging import setup_logger, LoggerColors
+from ..timer import time_logger
+from .in_memory_raster import InMemoryRaster
+from .line_raster_overlay import get_segment_cell_pieces, to_pixel_coordinates
+from .sampling_points import SamplingPoints
+from .shared_arrays import (
+    attach_shared_arrays,
+    create_shared_array,
+    get_shared_array,
+    release_shared_arrays,
+    share_arrays,
+)
 
 LOG = setup_logger(__name__, LoggerColors.PURPLE.value)
 
@@ -32,6 +57,7 @@ LOG = setup_logger(__name__, LoggerColors.PURPLE.value)
 def calculate_raster_dimensions(
     vector_data_gdf: gpd.GeoDataFrame,
     raster_cell_resolution: int,
+    bounds_buffer: float = 0,
 ) -> tuple[int, int, rasterio.transform.Affine]:
     """
     Calculate raster dimensions based on the vector data.
@@ -39,13 +65,16 @@ def calculate_raster_dimensions(
     Parameters:
     - vector_data_gdf: The GeoDataFrame containing the vector data.
     - raster_cell_resolution: The resolution of the raster cells in meters.
+    - bounds_buffer: Buffer around the vector data's bounds, e.g. the buffer of point data.
 
     Returns:
     - width: Width of the raster.
     - height: Height of the raster.
     - transform: Affine transformation for the raster.
     """
-    bounds = vector_data_gdf.total_bounds
+    bounds = vector_data_gdf.total_bounds + np.array(
+        [-bounds_buffer, -bounds_buffer, bounds_buffer, bounds_buffer]
+    )
     width = int((bounds[2] - bounds[0]) / raster_cell_resolution)
     height = int((bounds[3] - bounds[1]) / raster_cell_resolution)
     transform = from_origin(
@@ -54,242 +83,929 @@ def calculate_raster_dimensions(
     return width, height, transform
 
 
-def rasterize_vector_data(
+def get_vector_features_to_rasterize(
+    vector_data_gdf: gpd.GeoDataFrame, data_column: str
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Get the geometries and the values of the vector features in the order they
+    are burned to the raster, ascending by value so that the maximum value wins.
+    """
+    feature_values = vector_data_gdf[data_column].to_numpy(dtype=np.float64)
+    order = np.argsort(feature_values, kind="stable")
+    return np.asarray(vector_data_gdf.geometry.array)[order], feature_values[order]
+
+
+def get_disk_kernel_half_widths(
+    radius: float, cell_width: float, cell_height: float
+) -> np.ndarray:
+    """
+    Get the half widths, in cells, of the rows of a disk shaped kernel. A cell
+    is in the kernel if it is within the radius from the center of the kernel's
+    center cell, i.e. the cells touched by a buffered point at its cell's center.
+
+    Returns:
+    - The half width of each row from the row offset -n to n, -1 for empty rows.
+    """
+    row_count = int(math.floor(radius / cell_height + 0.5))
+    row_offsets = np.arange(-row_count, row_count + 1)
+    row_distances = np.maximum(0, (np.abs(row_offsets) - 0.5) * cell_height)
+    half_widths = np.floor(
+        np.sqrt(np.maximum(0, radius**2 - row_distances**2)) / cell_width + 0.5
+    ).astype(np.int64)
+    half_widths[row_distances > radius] = -1
+    return half_widths
+
+
+def sliding_max_along_rows(grid: np.ndarray, half_width: int) -> np.ndarray:
+    """
+    Get the maximum of each cell and the half_width cells on both of its sides
+    in the same row. The maxima of spans of cells are doubled until the span
+    covers half of the window, and each window is then covered by two spans.
+    """
+    window_width = 2 * half_width + 1
+    span_max = np.pad(grid, ((0, 0), (half_width, half_width)), constant_values=-np.inf)
+    span = 1
+    while span * 2 <= window_width:
+        span_max = np.maximum(span_max[:, :-span], span_max[:, span:])
+        span *= 2
+    width = grid.shape[1]
+    return np.maximum(
+        span_max[:, :width],
+        span_max[:, window_width - span : window_width - span + width],
+    )
+
+
+def dilate_with_disk(grid: np.ndarray, half_widths: np.ndarray) -> np.ndarray:
+    """
+    Get the maximum of each cell's disk shaped neighbourhood, as given by
+    get_disk_kernel_half_widths. The disk is split to rows, and the row maxima
+    are shifted over the grid, so the cost does not grow with the disk area.
+    """
+    row_count = len(half_widths) // 2
+    height = grid.shape[0]
+    dilated = np.full(grid.shape, -np.inf)
+    row_maxima = {}
+    for row_offset, half_width in zip(range(-row_count, row_count + 1), half_widths):
+        if half_width < 0 or abs(row_offset) >= height:
+            continue
+        if half_width not in row_maxima:
+            row_maxima[half_width] = sliding_max_along_rows(grid, half_width)
+        row_max = row_maxima[half_width]
+        if row_offset >= 0:
+            np.maximum(
+                dilated[: height - row_offset],
+                row_max[row_offset:],
+                out=dilated[: height - row_offset],
+            )
+        else:
+            np.maximum(
+                dilated[-row_offset:],
+                row_max[: height + row_offset],
+                out=dilated[-row_offset:],
+            )
+    return dilated
+
+
+def rasterize_points_tile(
+    x: np.ndarray,
+    y: np.ndarray,
+    point_values: np.ndarray,
+    transform,
+    window: Window,
+    nodata_value: float | int,
+    point_buffer: float,
+) -> np.ndarray:
+    """
+    Rasterize points with the maximum value within point_buffer from each cell,
+    without buffering the points to polygons. The points are binned to the
+    cells (maximum value per cell) of the tile and a margin around it, and the
+    bins are dilated with a disk of radius point_buffer. This is the same as
+    rasterizing the buffered points with all_touched, except for cells the
+    buffer only just touches, as the points are binned to their cell centers.
+
+    Parameters:
+    - x: The x coordinates of the points.
+    - y: The y coordinates of the points.
+    - point_values: The values of the points.
+    - transform: Affine transformation of the whole raster grid.
+    - window: The tile's window in the raster grid.
+    - nodata_value: The value of the cells without points within the buffer.
+    - point_buffer: The buffer of the points.
+
+    Returns:
+    - The rasterized tile.
+    """
+    half_widths = get_disk_kernel_half_widths(
+        point_buffer, abs(transform.a), abs(transform.e)
+    )
+    row_margin = len(half_widths) // 2
+    col_margin = max(int(half_widths.max()), 0)
+    tile_height, tile_width = int(window.height), int(window.width)
+    grid_shape = (tile_height + 2 * row_margin, tile_width + 2 * col_margin)
+
+    cols, rows = to_pixel_coordinates(~transform, x, y)
+    rows = np.floor(rows) - (window.row_off - row_margin)
+    cols = np.floor(cols) - (window.col_off - col_margin)
+    is_inside = (
+        (rows >= 0) & (rows < grid_shape[0]) & (cols >= 0) & (cols < grid_shape[1])
+    )
+    bins = np.full(grid_shape, -np.inf)
+    np.fmax.at(
+        bins,
+        (rows[is_inside].astype(np.int64), cols[is_inside].astype(np.int64)),
+        point_values[is_inside],
+    )
+    tile = dilate_with_disk(bins, half_widths)[
+        row_margin : row_margin + tile_height, col_margin : col_margin + tile_width
+    ]
+    return np.where(np.isneginf(tile), nodata_value, tile).astype(np.float32)
+
+
+def rasterize_tile(
+    geometries: np.ndarray,
+    feature_values: np.ndarray,
+    tree: shapely.STRtree,
+    transform,
+    window: Window,
+    nodata_value: float | int,
+    point_buffer: float = None,
+) -> np.ndarray:
+    """
+    Rasterize a tile (window) of the raster grid, burning only the features
+    whose bounding box intersects the tile. The tile has the same values as
+    the same window of the whole rasterized grid.
+
+    Parameters:
+    - geometries: The feature geometries in the burn order.
+    - feature_values: The feature values in the burn order.
+    - tree: STRtree of the geometries.
+    - transform: Affine transformation of the whole raster grid.
+    - window: The tile's window in the raster grid.
+    - nodata_value: The value of the cells without features.
+    - point_buffer: If given, the geometries are points, which are rasterized
+      with the maximum value within this distance, see rasterize_points_tile.
+
+    Returns:
+    - The rasterized tile.
+    """
+    tile_shape = (int(window.height), int(window.width))
+    tile_bounds = windows.bounds(window, transform)
+    if point_buffer is not None:
+        # the points within the buffer (and a cell) from the tile reach its cells
+        query_distance = point_buffer + max(abs(transform.a), abs(transform.e))
+        tile_bounds = (
+            tile_bounds[0] - query_distance,
+            tile_bounds[1] - query_distance,
+            tile_bounds[2] + query_distance,
+            tile_bounds[3] + query_distance,
+        )
+    # sorting the indices keeps the burn order
+    feature_indices = np.sort(tree.query(shapely.box(*tile_bounds)))
+    if len(feature_indices) == 0:
+        return np.full(tile_shape, nodata_value, dtype=np.float32)
+    if point_buffer is not None:
+        return rasterize_points_tile(
+            shapely.get_x(geometries[feature_indices]),
+            shapely.get_y(geometries[feature_indices]),
+            feature_values[feature_indices],
+            transform,
+            window,
+            nodata_value,
+            point_buffer,
+        )
+    return rasterize(
+        zip(geometries[feature_indices], feature_values[feature_indices]),
+        out_shape=tile_shape,
+        transform=windows.transform(window, transform),
+        fill=nodata_value,
+        all_touched=True,
+        dtype="float32",
+    )
+
+
+# the features are handed to the rasterization workers once, when the pool starts
+_worker_geometries = None
+_worker_feature_values = None
+_worker_tree = None
+_worker_transform = None
+_worker_nodata_value = None
+_worker_point_buffer = None
+
+
+def _init_rasterization_worker(
+    geometries: np.ndarray,
+    feature_values: np.ndarray,
+    transform,
+    nodata_value: float | int,
+    point_buffer: float = None,
+) -> None:
+    global _worker_geometries, _worker_feature_values, _worker_tree, _worker_transform, _worker_nodata_value, _worker_point_buffer
+    _worker_geometries = geometries
+    _worker_feature_values = feature_values
+    _worker_tree = shapely.STRtree(geometries)
+    _worker_transform = transform
+    _worker_nodata_value = nodata_value
+    _worker_point_buffer = point_buffer
+
+
+def _rasterize_tile_values_at_points(
+    window: Window, rows: np.ndarray, cols: np.ndarray
+) -> np.ndarray:
+    """Rasterize a tile in a worker and read its values at the given raster indices."""
+    tile = rasterize_tile(
+        _worker_geometries,
+        _worker_feature_values,
+        _worker_tree,
+        _worker_transform,
+        window,
+        _worker_nodata_value,
+        _worker_point_buffer,
+    )
+    return tile[rows - window.row_off, cols - window.col_off]
+
+
+@time_logger
+def rasterize_values_at_points_in_tiles(
     vector_data_gdf: gpd.GeoDataFrame,
+    data_column: str,
+    x: np.ndarray,
+    y: np.ndarray,
     width: int,
     height: int,
     transform,
-    data_column: str,
     nodata_value: float | int,
-) -> rasterio.io.DatasetWriter:
-    """Rasterize vector data by using the maximum value for each pixel."""
-    vector_data_gdf = vector_data_gdf.sort_values(by=data_column, ascending=True)
+    tile_size: int = RASTERIZATION_TILE_SIZE,
+    workers: int = DEFAULT_RASTERIZATION_WORKERS,
+    point_buffer: float = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Get the values of the rasterized vector data at the given points, without
+    building the whole raster. The raster grid is split into tiles of
+    tile_size x tile_size cells, and only the tiles with points are rasterized,
+    one at a time or in a pool of worker processes. The tiles are aligned to
+    the raster grid, so their cells need no overlap to match the whole raster.
 
-    # use rasterio for rasterization
-    raster = rasterize(
+    Parameters:
+    - vector_data_gdf: The GeoDataFrame containing the vector data.
+    - data_column: The name of the column containing the values to rasterize.
+    - x: The x coordinates of the points.
+    - y: The y coordinates of the points.
+    - width: Width of the raster grid.
+    - height: Height of the raster grid.
+    - transform: Affine transformation of the raster grid.
+    - nodata_value: The value of the cells without features.
+    - tile_size: The width and height of the tiles in cells.
+    - workers: Number of worker processes rasterizing the tiles.
+    - point_buffer: If given, the vector data is points, rasterized with the
+      maximum value within this distance.
+
+    Returns:
+    - The raster values as float64, NaN outside the raster.
+    - Boolean mask of the points inside the raster.
+    """
+    rows, cols, is_inside = get_raster_indices_at_points(
+        x, y, transform, (height, width)
+    )
+    tiles = group_points_by_window(
+        rows, cols, is_inside, (tile_size, tile_size), (height, width)
+    )
+    LOG.info(
+        f"Rasterizing {len(tiles)} tiles of {tile_size} x {tile_size} cells with sampling points."
+    )
+    tasks = [
         (
-            (geom, value)
-            for geom, value in zip(
-                vector_data_gdf.geometry, vector_data_gdf[data_column]
-            )
-        ),
-        out_shape=(height, width),
-        transform=transform,
-        fill=nodata_value,  # Use a no-data value for areas that are not covered by any polygon
-        all_touched=True,  # Consider all pixels that touch a geometry
-        dtype="float32",
+            window,
+            rows[point_indices].astype(np.int64),
+            cols[point_indices].astype(np.int64),
+        )
+        for window, point_indices in tiles
+    ]
+
+    geometries, feature_values = get_vector_features_to_rasterize(
+        vector_data_gdf, data_column
     )
-    return raster
+    if workers > 1 and len(tasks) > 1:
+        LOG.info(f"Rasterizing tiles with {workers} workers.")
+        with multiprocessing.Pool(
+            processes=min(workers, len(tasks)),
+            initializer=_init_rasterization_worker,
+            initargs=(
+                geometries,
+                feature_values,
+                transform,
+                nodata_value,
+                point_buffer,
+            ),
+        ) as pool:
+            tile_values = pool.starmap(_rasterize_tile_values_at_points, tasks)
+    else:
+        tree = shapely.STRtree(geometries)
+        tile_values = [
+            rasterize_tile(
+                geometries,
+                feature_values,
+                tree,
+                transform,
+                window,
+                nodata_value,
+                point_buffer,
+            )[tile_rows - window.row_off, tile_cols - window.col_off]
+            for window, tile_rows, tile_cols in tasks
+        ]
 
+    values = np.full(len(x), np.nan)
+    for (_, point_indices), point_values in zip(tiles, tile_values):
+        values[point_indices] = point_values
+    return values, is_inside
 
-def save_to_raster_file(
-    raster, output_path, transform, width, height, crs, nodata, dtype="float32"
-):
-    """
-    Saves a numpy array as a raster file.
 
-    Parameters:
-    - raster: The numpy array to save.
-    - output_path: Path to the output raster file.
-    - transform: Affine transform for the raster.
-    - width: Width of the raster.
-    - height: Height of the raster.
-    - crs: Coordinate reference system of the raster.
-    - dtype: Data type of the raster. Default is 'float32'.
-    - nodata: No data value for the raster. Default is None.
+def save_tiled_raster_file(
+    vector_data_gdf: gpd.GeoDataFrame,
+    data_column: str,
+    output_path: str,
+    width: int,
+    height: int,
+    transform,
+    nodata_value: float | int,
+    tile_size: int = RASTERIZATION_TILE_SIZE,
+    creation_options: dict = None,
+    point_buffer: float = None,
+) -> None:
+    """
+    Rasterize the vector data to a tiled GeoTIFF tile by tile, so that the whole
+    raster is never in memory. creation_options are passed to the GeoTIFF driver,
+    e.g. {"COMPRESS": "DEFLATE"}. With point_buffer, the vector data is points,
+    rasterized with the maximum value within the buffer.
     """
     LOG.info(f"Saving raster to {output_path}")
-    raster_meta = {
-        "driver": "GTiff",
-        "dtype": dtype,
-        "nodata": nodata,
-        "width": width,
-        "height": height,
-        "count": 1,
-        "crs": crs,
-        "transform": transform,
-    }
+    geometries, feature_values = get_vector_features_to_rasterize(
+        vector_data_gdf, data_column
+    )
+    tree = shapely.STRtree(geometries)
+    with rasterio.open(
+        output_path,
+        "w",
+        driver="GTiff",
+        dtype="float32",
+        nodata=nodata_value,
+        width=width,
+        height=height,
+        count=1,
+        crs=vector_data_gdf.crs,
+        transform=transform,
+        tiled=True,
+        BIGTIFF="IF_SAFER",
+        **(creation_options or {}),
+    ) as dst:
+        for row_off in range(0, height, tile_size):
+            for col_off in range(0, width, tile_size):
+                window = Window(
+                    col_off,
+                    row_off,
+                    min(tile_size, width - col_off),
+                    min(tile_size, height - row_off),
+                )
+                dst.write(
+                    rasterize_tile(
+                        geometries,
+                        feature_values,
+                        tree,
+                        transform,
+                        window,
+                        nodata_value,
+                        point_buffer,
+                    ),
+                    1,
+                    window=window,
+                )
 
-    with rasterio.open(output_path, "w", **raster_meta) as dst:
-        # Write to first band
-        dst.write(raster, 1)
+
+def get_rasterized_output_path(data_name: str) -> str:
+    """Get a timestamped path for saving the rasterized data of a data source."""
+    timestr = time.strftime("%H-%M-%S")
+    return os.path.join(
+        OUTPUT_FINAL_RESULTS_DIR_PATH, data_name + "-" + timestr + "-raster.tif"
+    )
 
 
 def rasterize_and_calculate_segment_values(
     data_name: str,
     vector_data_gdf: gpd.GeoDataFrame,
-    network_gdf: gpd.GeoDataFrame,
+    sampling_points: SamplingPoints,
     data_column: str,
     raster_cell_resolution: int,
     save_raster_file: bool = False,
     raster_null_value: float = None,
-) -> dict[int, float]:
+    segment_statistics: list[str] = None,
+    segment_geometries: np.ndarray = None,
+    tile_size: int = RASTERIZATION_TILE_SIZE,
+    workers: int = DEFAULT_RASTERIZATION_WORKERS,
+    point_buffer: float = None,
+) -> dict[str, dict[int, float]]:
     """
-    Rasterize vector data and save it to a raster file.
+    Rasterize vector data and calculate the raster values of the road segments.
+    The raster is rasterized in tiles, only where the segments are, so that the
+    whole raster is never in memory.
 
     Parameters:
     - vector_data_gdf: The GeoDataFrame containing the vector data.
+    - sampling_points: The sampling points of the road segments.
     - data_column: The name of the column containing the values to rasterize.
     - raster_cell_resolution: The resolution of the raster cells in meters.
     - save_raster_file: Whether to save the raster to a file. Default is False.
+    - segment_statistics: Statistics to calculate in addition to the default sampling strategy.
+    - segment_geometries: The segment geometries, if given the segments are overlaid
+      with the raster cells (length weighted) instead of sampling them at the sampling points.
+    - tile_size: The width and height of the rasterized tiles in cells.
+    - workers: Number of worker processes rasterizing the tiles.
+    - point_buffer: If given, the vector data is points, which are rasterized
+      with the maximum value within this distance instead of buffering them.
 
     Returns:
-    - A dictionary containing the raster value for each road segment.
+    - A dictionary of the statistics, each containing the raster value for each road segment.
     """
     LOG.info(f"Rasterizing vector data: {data_name}")
     # Calculate raster dimensions and transformation
     width, height, transform = calculate_raster_dimensions(
-        vector_data_gdf, raster_cell_resolution
+        vector_data_gdf, raster_cell_resolution, point_buffer or 0
     )
 
-    # Rasterize the vector data
-    raster = rasterize_vector_data(
-        vector_data_gdf=vector_data_gdf,
-        width=width,
-        height=height,
-        transform=transform,
-        data_column=data_column,
-        nodata_value=raster_null_value,
-    )
+    weights = None
+    if segment_geometries is not None:
+        sampling_points, weights = get_segment_cell_pieces(
+            sampling_points.osm_ids, segment_geometries, transform
+        )
 
-    timestr = time.strftime("%H-%M-%S")
-    output_raster_path = os.path.join(
-        OUTPUT_FINAL_RESULTS_DIR_PATH, data_name + "-" + timestr + "-raster.tif"
+    # Rasterize the vector data where the sampling points are
+    values, is_inside = rasterize_values_at_points_in_tiles(
+        vector_data_gdf,
+        data_column,
+        sampling_points.x,
+        sampling_points.y,
+        width,
+        height,
+        transform,
+        raster_null_value,
+        tile_size,
+        workers,
+        point_buffer,
     )
-
-    raster_segment_values = calculate_segment_raster_values(
-        network_gdf, raster, transform, raster_null_value
+    raster_segment_values = aggregate_point_values_to_segments(
+        sampling_points,
+        values,
+        is_inside,
+        raster_null_value,
+        segment_statistics,
+        weights,
     )
 
     # Save the raster to a new file if so configured
     if save_raster_file:
-        # Save the raster to a new file
-        save_to_raster_file(
-            raster,
-            output_raster_path,
-            transform,
+        save_tiled_raster_file(
+            vector_data_gdf,
+            data_column,
+            get_rasterized_output_path(data_name),
             width,
             height,
-            vector_data_gdf.crs,
-            nodata=raster_null_value,
+            transform,
+            raster_null_value,
+            tile_size,
+            point_buffer=point_buffer,
         )
 
     return raster_segment_values
 
 
-def get_raster_value_at_point(point, raster_data, transform):
-    """Get the raster value at a given point."""
-    # edit: changed from row, col to col, row -> fix working?
-    col, row = ~transform * (
-        point.x,
-        point.y,
-    )  # Transform point coordinates to raster indices
-    row, col = int(row), int(col)  # Convert to integer indices
-    # Check if indices are within the raster dimensions
-    if 0 <= row < raster_data.shape[0] and 0 <= col < raster_data.shape[1]:
-        return raster_data[row, col]
-    else:
-        return None  # or np.nan, or another value indicating no data
+def get_raster_indices_at_points(
+    x: np.ndarray, y: np.ndarray, transform, raster_shape: tuple[int, int]
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Get the raster row and column indices of the given point coordinates.
 
+    Returns:
+    - The row and column indices as floats, truncated towards zero like int().
+    - Boolean mask of the points inside the raster.
+    """
+    inverse_transform = ~transform
+    cols = np.trunc(
+        inverse_transform.a * x + inverse_transform.b * y + inverse_transform.c
+    )
+    rows = np.trunc(
+        inverse_transform.d * x + inverse_transform.e * y + inverse_transform.f
+    )
+    is_inside = (
+        (rows >= 0) & (rows < raster_shape[0]) & (cols >= 0) & (cols < raster_shape[1])
+    )
+    return rows, cols, is_inside
 
-def aggregate_values(
-    values: list[float | None],
-    raster_null_value: float | int,
-    method="mean",
-) -> float:
+
+def get_raster_values_at_points(
+    x: np.ndarray, y: np.ndarray, raster_data: np.ndarray, transform
+) -> tuple[np.ndarray, np.ndarray]:
     """
-    Aggregate values based on the given method.
-    If all values are np.nan, the function returns None.
-    Uses np.nan[mean | max | min] to ignore np.nan values in calculations.
+    Get the raster values at the given point coordinates, for all the points at once.
 
     Parameters:
-    - values: A list of values to aggregate.
-    - method: The aggregation method to use. Options are 'mean', 'max', and 'min'.
-    - raster_null_value: The null value used in the raster data.
+    - x: The x coordinates of the points.
+    - y: The y coordinates of the points.
+    - raster_data: The raster data.
+    - transform: Affine transformation for the raster.
 
     Returns:
-    - The aggregated value or None if no valid values exist.
-    """
-    # Drop values that are None, equal to the raster null value, or RASTER_NO_DATA_VALUE
-    values = [
-        v
-        for v in values
-        if v is not None
-        and v != raster_null_value
-        and v != RASTER_NO_DATA_VALUE
-        and v != float(RASTER_NO_DATA_VALUE)
+    - The raster values as float64, NaN outside the raster.
+    - Boolean mask of the points inside the raster.
+    """
+    rows, cols, is_inside = get_raster_indices_at_points(
+        x, y, transform, raster_data.shape
+    )
+    values = np.full(len(x), np.nan)
+    values[is_inside] = raster_data[
+        rows[is_inside].astype(np.int64), cols[is_inside].astype(np.int64)
     ]
+    return values, is_inside
+
+
+def reduce_segment_values(
+    ufunc: np.ufunc, values: np.ndarray, offsets: np.ndarray, empty_value: float
+) -> np.ndarray:
+    """
+    Reduce the point values of each segment with ufunc.reduceat over the segment offsets.
+    Segments without points get empty_value.
+    """
+    counts = np.diff(offsets)
+    reduced = np.full(len(counts), empty_value, dtype=np.float64)
+    has_points = counts > 0
+    if has_points.any():
+        # reduceat of an empty range gives the value at its start, so reduce only the non-empty segments
+        reduced[has_points] = ufunc.reduceat(values, offsets[:-1][has_points])
+    return reduced
+
+
+def get_segment_statistic_percentile(statistic: str) -> float | None:
+    """
+    Get the percentile (0...100) of a percentile statistic, e.g. 90 for "p90"
+    and 50 for "median". None if the statistic is not a percentile.
+    """
+    if statistic == "median":
+        return 50.0
+    percentile = statistic.removeprefix(SEGMENT_STATISTIC_PERCENTILE_PREFIX)
+    if percentile != statistic and percentile.isdigit() and int(percentile) <= 100:
+        return float(percentile)
+    return None
+
+
+def is_valid_segment_statistic(statistic: str) -> bool:
+    """Check if the statistic can be calculated for the segments."""
+    return statistic in SEGMENT_STATISTICS or (
+        isinstance(statistic, str)
+        and get_segment_statistic_percentile(statistic) is not None
+    )
 
-    if not values:  # If all values were filtered out, return None
-        return None
 
-    values = np.array(values, dtype=float)
+def calculate_segment_percentiles(
+    values: np.ndarray,
+    is_valid: np.ndarray,
+    offsets: np.ndarray,
+    valid_counts: np.ndarray,
+    percentiles: list[float],
+    weights: np.ndarray = None,
+) -> list[np.ndarray]:
+    """
+    Calculate percentiles of the valid point values of each segment, with
+    linear interpolation like numpy.percentile. The valid values are sorted
+    once by segment and value for all the percentiles.
+    With weights, the weighted percentile is the first value at which the
+    cumulative weight of the segment reaches the percentile (inverted CDF).
+    """
+    counts = np.diff(offsets)
+    point_segment_indices = np.repeat(np.arange(len(counts)), counts)[is_valid]
+    valid_values = values[is_valid]
+    order = np.lexsort((valid_values, point_segment_indices))
+    sorted_values = valid_values[order]
 
-    # If all remaining values are np.nan, return None
-    if np.all(np.isnan(values)):
-        return None
+    valid_counts = valid_counts.astype(np.int64)
+    has_value = valid_counts > 0
+    starts = np.cumsum(valid_counts) - valid_counts
+    if weights is not None:
+        cumulative_weights = np.cumsum(weights[is_valid][order])
+        start_weights = np.concatenate(([0], cumulative_weights))[starts[has_value]]
+        end_weights = cumulative_weights[
+            starts[has_value] + valid_counts[has_value] - 1
+        ]
+
+    results = []
+    for percentile in percentiles:
+        segment_percentiles = np.full(len(counts), np.nan)
+        if weights is not None:
+            target_weights = start_weights + (end_weights - start_weights) * (
+                percentile / 100
+            )
+            indices = np.clip(
+                np.searchsorted(cumulative_weights, target_weights, side="left"),
+                starts[has_value],
+                starts[has_value] + valid_counts[has_value] - 1,
+            )
+            segment_percentiles[has_value] = sorted_values[indices]
+        else:
+            positions = (valid_counts[has_value] - 1) * percentile / 100
+            lower = np.floor(positions).astype(np.int64)
+            upper = np.ceil(positions).astype(np.int64)
+            lower_values = sorted_values[starts[has_value] + lower]
+            upper_values = sorted_values[starts[has_value] + upper]
+            segment_percentiles[has_value] = lower_values + (
+                upper_values - lower_values
+            ) * (positions - lower)
+        results.append(segment_percentiles)
+    return results
 
-    # Aggregation based on the method
-    if method == "mean":
-        return np.nanmean(values)
-    elif method == "max":
-        return np.nanmax(values)
-    elif method == "min":
-        return np.nanmin(values)
+
+def calculate_segment_statistics(
+    values: np.ndarray,
+    is_valid: np.ndarray,
+    offsets: np.ndarray,
+    statistics: list[str],
+    weights: np.ndarray = None,
+) -> dict[str, tuple[np.ndarray, np.ndarray]]:
+    """
+    Calculate several statistics of the valid point values of each segment at once.
+
+    Parameters:
+    - values: The point values of all the segments.
+    - is_valid: Boolean mask of the values to aggregate.
+    - offsets: The segment offsets into the point values.
+    - statistics: The statistics to calculate: mean, min, max, median,
+      nodata_share (share of the points without a valid value) or percentiles as p0...p100.
+    - weights: Optional weight of each point, e.g. the length of the segment in a
+      raster cell. The mean, the nodata share and the percentiles are then weighted.
+
+    Returns:
+    - For each statistic, the value of each segment and a boolean mask of the segments with a value.
+    """
+    valid_counts = reduce_segment_values(
+        np.add, is_valid.astype(np.float64), offsets, 0
+    )
+    has_value = valid_counts > 0
+    if weights is None:
+        valid_weights = valid_counts
     else:
-        raise ValueError(f"Unsupported aggregation method: {method}")
+        valid_weights = reduce_segment_values(
+            np.add, np.where(is_valid, weights, 0), offsets, 0
+        )
+
+    segment_statistics = {}
+    percentile_statistics = []
+    for statistic in statistics:
+        if statistic == "mean":
+            weighted_values = values if weights is None else values * weights
+            sums = reduce_segment_values(
+                np.add, np.where(is_valid, weighted_values, 0), offsets, 0
+            )
+            with np.errstate(divide="ignore", invalid="ignore"):
+                segment_statistics[statistic] = (sums / valid_weights, has_value)
+        elif statistic == "max":
+            segment_statistics[statistic] = (
+                reduce_segment_values(
+                    np.maximum, np.where(is_valid, values, -np.inf), offsets, -np.inf
+                ),
+                has_value,
+            )
+        elif statistic == "min":
+            segment_statistics[statistic] = (
+                reduce_segment_values(
+                    np.minimum, np.where(is_valid, values, np.inf), offsets, np.inf
+                ),
+                has_value,
+            )
+        elif statistic == NODATA_SHARE_STATISTIC:
+            if weights is None:
+                total_weights = np.diff(offsets).astype(np.float64)
+            else:
+                total_weights = reduce_segment_values(np.add, weights, offsets, 0)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                segment_statistics[statistic] = (
+                    1 - valid_weights / total_weights,
+                    total_weights > 0,
+                )
+        elif get_segment_statistic_percentile(statistic) is not None:
+            percentile_statistics.append(statistic)
+        else:
+            raise ValueError(f"Unsupported aggregation method: {statistic}")
+
+    if percentile_statistics:
+        percentiles = calculate_segment_percentiles(
+            values,
+            is_valid,
+            offsets,
+            valid_counts,
+            [get_segment_statistic_percentile(s) for s in percentile_statistics],
+            weights,
+        )
+        for statistic, segment_percentiles in zip(percentile_statistics, percentiles):
+            segment_statistics[statistic] = (segment_percentiles, has_value)
+
+    return segment_statistics
 
 
 def calculate_segment_raster_values(
-    network_gdf: gpd.GeoDataFrame,
+    sampling_points: SamplingPoints,
     raster_data,
     transform,
     raster_null_value: float = None,
-) -> dict:
+    segment_statistics: list[str] = None,
+    segment_geometries: np.ndarray = None,
+    workers: int = DEFAULT_RASTER_SAMPLING_WORKERS,
+) -> dict[str, dict]:
     """
     Calculate raster values for each road segment.
+    The values of all the sampling points are read at once, values outside the
+    raster, the raster null value, RASTER_NO_DATA_VALUE and NaN are dropped, and
+    the remaining values are aggregated per segment.
+    If segment_geometries are given, the values of the cells crossed by the
+    segments are read instead and aggregated weighted by the length of the
+    segment in each cell.
+    With more than one worker, the raster is copied to shared memory and the
+    segments are sampled in chunks by a pool of worker processes.
 
     Parameters:
-    - network_gdf: The GeoDataFrame containing the road network data.
+    - sampling_points: The sampling points of the road segments.
     - raster_data: The raster data.
     - transform: Affine transformation for the raster.
+    - raster_null_value: The null value used in the raster data.
+    - segment_statistics: Statistics to calculate in addition to the default sampling strategy.
+    - segment_geometries: The segment geometries in the raster CRS, for the line overlay.
+    - workers: Number of worker processes sampling the raster.
 
     Returns:
-    - A dictionary containing the raster values for each road segment.
+    - A dictionary of the statistics, each containing the raster values for each road segment.
 
     """
-    # Loop over road segments and their sample points
-    segment_raster_values: dict = {}
-    for _, row in network_gdf.iterrows():
-        # Extract raster values for each sample point
-        values = [
-            get_raster_value_at_point(pt, raster_data, transform)
-            for pt in row[SEGMENT_SAMPLING_POINTS_KEY]
-        ]
+    weights = None
+    if segment_geometries is not None:
+        sampling_points, weights = get_segment_cell_pieces(
+            sampling_points.osm_ids, segment_geometries, transform
+        )
+    if workers > 1 and len(sampling_points) > 1:
+        raster_data = np.asarray(raster_data)
+        shared_blocks, array_descriptions = share_arrays(
+            {"raster": raster_data[np.newaxis]}
+        )
+        try:
+            return calculate_segment_shared_raster_band_values_in_parallel(
+                sampling_points,
+                array_descriptions["raster"],
+                transform,
+                [(1, 0, None)],
+                raster_null_value,
+                segment_statistics,
+                weights,
+                workers,
+            )[0]
+        finally:
+            release_shared_arrays(shared_blocks)
+    values, is_inside = get_raster_values_at_points(
+        sampling_points.x, sampling_points.y, raster_data, transform
+    )
+    return aggregate_point_values_to_segments(
+        sampling_points,
+        values,
+        is_inside,
+        raster_null_value,
+        segment_statistics,
+        weights,
+    )
 
-        # Aggregate the values for the segment
-        # round to 2 decimals
-        value_for_segment = aggregate_values(
-            values,
-            method=SEGMENT_POINTS_DEFAULT_SAMPLING_STRATEGY,
-            raster_null_value=raster_null_value,
+
+def get_segment_statistics_to_calculate(
+    segment_statistics: list[str] = None,
+) -> list[str]:
+    """Get the default sampling strategy and the given statistics, without duplicates."""
+    return list(
+        dict.fromkeys(
+            [SEGMENT_POINTS_DEFAULT_SAMPLING_STRATEGY, *(segment_statistics or [])]
         )
+    )
+
 
-        osm_id = row[OSM_ID_KEY]
+def aggregate_point_values_to_segments(
+    sampling_points: SamplingPoints,
+    values: np.ndarray,
+    is_inside: np.ndarray,
+    raster_null_value: float = None,
+    segment_statistics: list[str] = None,
+    weights: np.ndarray = None,
+) -> dict[str, dict]:
+    """
+    Aggregate the raster values of the sampling points to segment values.
 
+    Parameters:
+    - sampling_points: The sampling points of the road segments.
+    - values: The raster value of each sampling point.
+    - is_inside: Boolean mask of the sampling points inside the raster.
+    - raster_null_value: The null value used in the raster data.
+    - segment_statistics: Statistics to calculate in addition to the default sampling strategy.
+    - weights: Optional weight of each sampling point, e.g. the length of a segment piece.
+
+    Returns:
+    - A dictionary of the statistics, each containing the raster values for each road segment.
+    """
+    return aggregate_values_to_segments(
+        sampling_points.osm_ids,
+        sampling_points.offsets,
+        values,
+        is_inside,
+        raster_null_value,
+        segment_statistics,
+        weights,
+    )
+
+
+def aggregate_values_to_segments(
+    osm_ids: np.ndarray,
+    offsets: np.ndarray,
+    values: np.ndarray,
+    is_inside: np.ndarray,
+    null_value: float = None,
+    segment_statistics: list[str] = None,
+    weights: np.ndarray = None,
+) -> dict[str, dict]:
+    """
+    Aggregate values packed by segment (e.g. of sampling points) to segment values.
+    Values outside the data, the null value, RASTER_NO_DATA_VALUE and NaN are
+    dropped, they only count in the nodata share. A zero mean is not stored,
+    like segments without values, the other statistics store zeros.
+
+    Parameters:
+    - osm_ids: The osm ids of the segments.
+    - offsets: The offsets of each segment's values, with the end offset last.
+    - values: The values of all the segments.
+    - is_inside: Boolean mask of the values inside the data.
+    - null_value: The null value used in the data.
+    - segment_statistics: Statistics to calculate in addition to the default sampling strategy.
+    - weights: Optional weight of each value, e.g. the length of a segment piece.
+
+    Returns:
+    - A dictionary of the statistics, each containing the values for each road segment.
+    """
+    return segment_value_arrays_to_dicts(
+        osm_ids,
+        calculate_segment_value_arrays(
+            offsets, values, is_inside, null_value, segment_statistics, weights
+        ),
+    )
+
+
+def calculate_segment_value_arrays(
+    offsets: np.ndarray,
+    values: np.ndarray,
+    is_inside: np.ndarray,
+    null_value: float = None,
+    segment_statistics: list[str] = None,
+    weights: np.ndarray = None,
+) -> dict[str, np.ndarray]:
+    """
+    Aggregate values packed by segment to rounded segment values, as arrays.
+    See aggregate_values_to_segments for the parameters.
+
+    Returns:
+    - For each statistic, the value of each segment, NaN for the segments without a stored value.
+    """
+    is_valid = is_inside & ~np.isnan(values) & (values != RASTER_NO_DATA_VALUE)
+    if null_value is not None:
+        is_valid &= values != null_value
+
+    segment_values = {}
+    for statistic, (aggregated, has_value) in calculate_segment_statistics(
+        values,
+        is_valid,
+        offsets,
+        get_segment_statistics_to_calculate(segment_statistics),
+        weights,
+    ).items():
         # do not store None values
         # this most likely means that the segment is outside of the raster
-        # or no data value
-        if not value_for_segment or value_for_segment is None:
-            segment_raster_values[osm_id] = None
-            continue
-
-        # round and store value
-        segment_raster_values[osm_id] = round(
-            value_for_segment, SEGMENT_VALUES_ROUND_DECIMALS
+        # or no data value, a zero mean (the data source's value) is not stored
+        # either, the other statistics are stored as they are
+        is_stored = has_value
+        if statistic == SEGMENT_POINTS_DEFAULT_SAMPLING_STRATEGY:
+            is_stored = is_stored & (aggregated != 0)
+        segment_values[statistic] = np.where(
+            is_stored, np.round(aggregated, SEGMENT_VALUES_ROUND_DECIMALS), np.nan
         )
-        # Store or use the aggregated value as needed
-    return segment_raster_values
+    return segment_values
+
+
+def segment_value_arrays_to_dicts(
+    osm_ids: np.ndarray, segment_value_arrays: dict[str, np.ndarray]
+) -> dict[str, dict]:
+    """Convert the segment value arrays of each statistic to osm_id -> value dictionaries, None for NaN."""
+    osm_ids = np.asarray(osm_ids).tolist()
+    return {
+        statistic: {
+            osm_id: None if math.isnan(value) else value
+            for osm_id, value in zip(osm_ids, values.tolist())
+        }
+        for statistic, values in segment_value_arrays.items()
+    }
 
 
 def check_raster_file_crs(raster_filepath: str):
@@ -364,28 +1080,827 @@ def reproject_raster_to_crs(
         raise ValueError(f"Error in reprojecting raster: {e}")
 
 
-def calculate_segment_raster_values_from_raster_file(
-    network_gdf: gpd.GeoDataFrame,
-    raster_file_path: str,
+def get_raster_window_shape(
+    raster_src: rasterio.io.DatasetReader, window_max_bytes: int
+) -> tuple[int, int]:
+    """
+    Get the shape (rows, cols) of the reading windows, aligned to the raster's blocks.
+    A window is at least one block, even if the block is bigger than window_max_bytes.
+    """
+    block_rows, block_cols = raster_src.block_shapes[0]
+    item_size = np.dtype(raster_src.dtypes[0]).itemsize
+    window_blocks = max(1, window_max_bytes // (block_rows * block_cols * item_size))
+    if block_cols >= raster_src.width:
+        # stripped raster, windows of full width strips
+        window_shape = (window_blocks * block_rows, raster_src.width)
+    else:
+        side_blocks = max(1, math.isqrt(window_blocks))
+        window_shape = (side_blocks * block_rows, side_blocks * block_cols)
+    return min(window_shape[0], raster_src.height), min(
+        window_shape[1], raster_src.width
+    )
+
+
+def group_points_by_window(
+    rows: np.ndarray,
+    cols: np.ndarray,
+    is_inside: np.ndarray,
+    window_shape: tuple[int, int],
+    raster_shape: tuple[int, int],
+) -> list[tuple[Window, np.ndarray]]:
+    """
+    Group the points inside the raster by the grid aligned window they fall in.
+
+    Parameters:
+    - rows: The row indices of the points.
+    - cols: The column indices of the points.
+    - is_inside: Boolean mask of the points inside the raster.
+    - window_shape: The shape (rows, cols) of the windows.
+    - raster_shape: The shape (rows, cols) of the raster.
+
+    Returns:
+    - List of the windows with points, and the indices of the points in each window.
+    """
+    window_rows, window_cols = window_shape
+    windows_per_row = math.ceil(raster_shape[1] / window_cols)
+
+    point_indices = np.flatnonzero(is_inside)
+    point_windows = (rows[point_indices].astype(np.int64) // window_rows) * (
+        windows_per_row
+    ) + cols[point_indices].astype(np.int64) // window_cols
+    order = np.argsort(point_windows, kind="stable")
+    window_ids, window_starts = np.unique(point_windows[order], return_index=True)
+    window_ends = np.append(window_starts[1:], len(order))
+
+    point_windows = []
+    for window_id, start, end in zip(window_ids.tolist(), window_starts, window_ends):
+        row_off = (window_id // windows_per_row) * window_rows
+        col_off = (window_id % windows_per_row) * window_cols
+        window = Window(
+            col_off,
+            row_off,
+            min(window_cols, raster_shape[1] - col_off),
+            min(window_rows, raster_shape[0] - row_off),
+        )
+        point_windows.append((window, point_indices[order[start:end]]))
+    return point_windows
+
+
+def read_raster_values_at_points_in_windows(
+    raster_src: rasterio.io.DatasetReader,
+    rows: np.ndarray,
+    cols: np.ndarray,
+    is_inside: np.ndarray,
+    bands: list[int],
+    window_max_bytes: int = RASTER_WINDOW_MAX_BYTES,
+) -> np.ndarray:
+    """
+    Read the raster values of the given bands at the given raster indices window by window.
+    The points are grouped by the block aligned window they fall in, and only
+    the windows with points are read, one at a time, all the bands at once.
+
+    Parameters:
+    - raster_src: The opened raster.
+    - rows: The row indices of the points.
+    - cols: The column indices of the points.
+    - is_inside: Boolean mask of the points inside the raster.
+    - bands: The band numbers to read.
+    - window_max_bytes: Maximum size of a read window in bytes, for all the bands.
+
+    Returns:
+    - The raster values as float64 with the shape (bands, points), NaN outside the raster.
+    """
+    window_shape = get_raster_window_shape(raster_src, window_max_bytes // len(bands))
+    point_windows = group_points_by_window(
+        rows, cols, is_inside, window_shape, raster_src.shape
+    )
+    LOG.info(
+        f"Reading {len(point_windows)} windows of {window_shape[0]} x {window_shape[1]} cells with sampling points."
+    )
+
+    values = np.full((len(bands), len(is_inside)), np.nan)
+    for window, point_indices in point_windows:
+        window_data = raster_src.read(bands, window=window)
+        values[:, point_indices] = window_data[
+            :,
+            rows[point_indices].astype(np.int64) - window.row_off,
+            cols[point_indices].astype(np.int64) - window.col_off,
+        ]
+    return values
+
+
+def read_raster_band_values_at_points(
+    raster_src: rasterio.io.DatasetReader,
+    rows: np.ndarray,
+    cols: np.ndarray,
+    is_inside: np.ndarray,
+    bands: list[int],
+    window_max_bytes: int = RASTER_WINDOW_MAX_BYTES,
+) -> np.ndarray:
+    """
+    Read the raster values of the given bands at the given raster indices.
+    The bands are read whole if they fit in window_max_bytes, otherwise window by window.
+    Bands with a scale or an offset (e.g. packed NetCDF variables) are unpacked,
+    the raster's own nodata value is then NaN.
+
+    Returns:
+    - The raster values as float64 with the shape (bands, points), NaN outside the raster.
+    """
+    item_size = np.dtype(raster_src.dtypes[0]).itemsize
+    if (
+        raster_src.width * raster_src.height * item_size * len(bands)
+        <= window_max_bytes
+    ):
+        values = np.full((len(bands), len(is_inside)), np.nan)
+        values[:, is_inside] = raster_src.read(bands)[
+            :, rows[is_inside].astype(np.int64), cols[is_inside].astype(np.int64)
+        ]
+    else:
+        LOG.info(f"Raster {raster_src.name} is sampled window by window.")
+        values = read_raster_values_at_points_in_windows(
+            raster_src, rows, cols, is_inside, bands, window_max_bytes
+        )
+
+    for band_values, band in zip(values, bands):
+        unpack_raster_band_values(
+            band_values,
+            raster_src.scales[band - 1],
+            raster_src.offsets[band - 1],
+            raster_src.nodata,
+        )
+    return values
+
+
+def unpack_raster_band_values(
+    band_values: np.ndarray, scale: float, offset: float, nodata: float = None
+) -> None:
+    """
+    Apply the scale and the offset of a band to its values in place. The band's
+    own nodata value is then NaN. Values of bands without a scale or an offset
+    are not changed.
+    """
+    if scale != 1 or offset != 0:
+        if nodata is not None:
+            band_values[band_values == nodata] = np.nan
+        band_values *= scale
+        band_values += offset
+
+
+def calculate_segment_raster_band_value_arrays(
+    raster_data: np.ndarray,
+    transform,
+    x: np.ndarray,
+    y: np.ndarray,
+    offsets: np.ndarray,
+    band_unpacking: list[tuple[float, float, float]],
     raster_null_value: float = None,
-) -> dict:
+    segment_statistics: list[str] = None,
+    weights: np.ndarray = None,
+) -> list[dict[str, np.ndarray]]:
     """
-    Calculate raster values for each road segment from a raster file.
+    Sample the bands of an in-memory raster at the points of the segments and
+    aggregate them to segment value arrays.
 
     Parameters:
-    - network_gdf: The GeoDataFrame containing the road network data.
-    - raster_file_path: The path to the raster file.
+    - raster_data: The raster bands with the shape (bands, rows, cols).
+    - transform: Affine transformation for the raster.
+    - x: The x coordinates of the points of the segments.
+    - y: The y coordinates of the points of the segments.
+    - offsets: The segment offsets into the points.
+    - band_unpacking: The (scale, offset, nodata) of each band, see unpack_raster_band_values.
+    - raster_null_value: The null value used in the raster data.
+    - segment_statistics: Statistics to calculate in addition to the default sampling strategy.
+    - weights: Optional weight of each point, e.g. the length of a segment piece.
+
+    Returns:
+    - The segment value arrays of each band, see calculate_segment_value_arrays.
+    """
+    rows, cols, is_inside = get_raster_indices_at_points(
+        x, y, transform, raster_data.shape[1:]
+    )
+    inside_rows = rows[is_inside].astype(np.int64)
+    inside_cols = cols[is_inside].astype(np.int64)
+
+    band_value_arrays = []
+    for band_data, (scale, offset, nodata) in zip(raster_data, band_unpacking):
+        values = np.full(len(x), np.nan)
+        values[is_inside] = band_data[inside_rows, inside_cols]
+        unpack_raster_band_values(values, scale, offset, nodata)
+        band_value_arrays.append(
+            calculate_segment_value_arrays(
+                offsets,
+                values,
+                is_inside,
+                raster_null_value,
+                segment_statistics,
+                weights,
+            )
+        )
+    return band_value_arrays
+
+
+def split_segments_into_chunks(
+    offsets: np.ndarray, chunk_count: int
+) -> list[tuple[int, int]]:
+    """
+    Split the segments into at most chunk_count chunks of consecutive segments
+    with about the same number of points.
+
+    Returns:
+    - The (start, end) segment indices of each chunk.
+    """
+    segment_count = len(offsets) - 1
+    point_targets = np.linspace(0, offsets[-1], chunk_count + 1)[1:-1]
+    bounds = np.unique(
+        np.concatenate(
+            (
+                [0],
+                np.clip(np.searchsorted(offsets, point_targets), 0, segment_count),
+                [segment_count],
+            )
+        )
+    )
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+# The raster bands are in a shared memory block, and the sampling points (or
+# the cell pieces of the line overlay) are split into chunks of consecutive
+# segments. Each worker maps the raster and the points once, when the pool
+# starts, samples and aggregates the segments of a chunk at a time, and returns
+# only the small segment value arrays of the chunk, which are concatenated in
+# chunk order. The raster is never copied to the workers.
+_worker_sampling_blocks = None
+_worker_sampling_arrays = None
+_worker_sampling_transform = None
+_worker_band_unpacking = None
+_worker_raster_null_value = None
+_worker_segment_statistics = None
+
+
+def _init_raster_sampling_worker(
+    array_descriptions: dict[str, tuple[str, str, tuple]],
+    transform,
+    band_unpacking: list[tuple[float, float, float]],
+    raster_null_value: float,
+    segment_statistics: list[str],
+) -> None:
+    global _worker_sampling_blocks, _worker_sampling_arrays, _worker_sampling_transform
+    global _worker_band_unpacking, _worker_raster_null_value, _worker_segment_statistics
+    _worker_sampling_blocks, _worker_sampling_arrays = attach_shared_arrays(
+        array_descriptions
+    )
+    _worker_sampling_transform = transform
+    _worker_band_unpacking = band_unpacking
+    _worker_raster_null_value = raster_null_value
+    _worker_segment_statistics = segment_statistics
+
+
+def _sample_raster_segment_chunk(
+    start_segment: int, end_segment: int
+) -> list[dict[str, np.ndarray]]:
+    """Sample the raster bands for the segments of a chunk in a worker."""
+    arrays = _worker_sampling_arrays
+    offsets = arrays["offsets"][start_segment : end_segment + 1]
+    start_point, end_point = int(offsets[0]), int(offsets[-1])
+    weights = arrays.get("weights")
+    return calculate_segment_raster_band_value_arrays(
+        arrays["raster"],
+        _worker_sampling_transform,
+        arrays["x"][start_point:end_point],
+        arrays["y"][start_point:end_point],
+        offsets - start_point,
+        _worker_band_unpacking,
+        _worker_raster_null_value,
+        _worker_segment_statistics,
+        None if weights is None else weights[start_point:end_point],
+    )
+
+
+@time_logger
+def calculate_segment_shared_raster_band_values_in_parallel(
+    sampling_points: SamplingPoints,
+    raster_description: tuple[str, str, tuple],
+    transform,
+    band_unpacking: list[tuple[float, float, float]],
+    raster_null_value: float = None,
+    segment_statistics: list[str] = None,
+    weights: np.ndarray = None,
+    workers: int = DEFAULT_RASTER_SAMPLING_WORKERS,
+) -> list[dict[str, dict]]:
+    """
+    Calculate raster values for each road segment from raster bands in shared
+    memory, with a pool of worker processes sampling chunks of the segments.
+
+    Parameters:
+    - sampling_points: The sampling points (or cell pieces) of the road segments.
+    - raster_description: The description of the shared (bands, rows, cols) raster
+      array, see create_shared_array.
+    - transform: Affine transformation for the raster.
+    - band_unpacking: The (scale, offset, nodata) of each band, see unpack_raster_band_values.
+    - raster_null_value: The null value used in the raster data.
+    - segment_statistics: Statistics to calculate in addition to the default sampling strategy.
+    - weights: Optional weight of each point, e.g. the length of a segment piece.
+    - workers: Number of worker processes.
+
+    Returns:
+    - For each band, a dictionary of the statistics, each containing the raster
+      values for each road segment.
+    """
+    chunks = split_segments_into_chunks(
+        sampling_points.offsets, workers * RASTER_SAMPLING_CHUNKS_PER_WORKER
+    )
+    shared_arrays = {
+        "x": sampling_points.x,
+        "y": sampling_points.y,
+        "offsets": sampling_points.offsets,
+    }
+    if weights is not None:
+        shared_arrays["weights"] = np.asarray(weights, dtype=np.float64)
+    LOG.info(
+        f"Sampling {sampling_points.point_count} points of {len(sampling_points)} segments in {len(chunks)} chunks with {workers} workers."
+    )
+
+    shared_blocks, array_descriptions = share_arrays(shared_arrays)
+    array_descriptions["raster"] = raster_description
+    try:
+        with multiprocessing.Pool(
+            processes=max(1, min(workers, len(chunks))),
+            initializer=_init_raster_sampling_worker,
+            initargs=(
+                array_descriptions,
+                transform,
+                band_unpacking,
+                raster_null_value,
+                segment_statistics,
+            ),
+        ) as pool:
+            chunk_values = pool.starmap(_sample_raster_segment_chunk, chunks)
+    finally:
+        release_shared_arrays(shared_blocks)
+
+    statistics = get_segment_statistics_to_calculate(segment_statistics)
+    return [
+        segment_value_arrays_to_dicts(
+            sampling_points.osm_ids,
+            {
+                statistic: np.concatenate(
+                    [band_chunks[band][statistic] for band_chunks in chunk_values]
+                )
+                for statistic in statistics
+            },
+        )
+        for band in range(len(band_unpacking))
+    ]
+
+
+def calculate_segment_raster_band_values_in_parallel(
+    raster_src: rasterio.io.DatasetReader,
+    bands: list[int],
+    sampling_points: SamplingPoints,
+    raster_null_value: float = None,
+    segment_statistics: list[str] = None,
+    weights: np.ndarray = None,
+    workers: int = DEFAULT_RASTER_SAMPLING_WORKERS,
+) -> list[dict[str, dict]]:
+    """
+    Read the bands of a raster straight into shared memory and calculate the
+    raster values for each road segment with a pool of worker processes.
+    See calculate_segment_shared_raster_band_values_in_parallel.
+    """
+    raster_block, raster_description = create_shared_array(
+        (len(bands), *raster_src.shape), raster_src.dtypes[0]
+    )
+    try:
+        raster_src.read(bands, out=get_shared_array(raster_block, raster_description))
+        return calculate_segment_shared_raster_band_values_in_parallel(
+            sampling_points,
+            raster_description,
+            raster_src.transform,
+            [
+                (
+                    raster_src.scales[band - 1],
+                    raster_src.offsets[band - 1],
+                    raster_src.nodata,
+                )
+                for band in bands
+            ],
+            raster_null_value,
+            segment_statistics,
+            weights,
+            workers,
+        )
+    finally:
+        release_shared_arrays([raster_block])
+
+
+@lru_cache(maxsize=CRS_TRANSFORMER_CACHE_SIZE)
+def get_crs_transformer(source_crs_wkt: str, target_crs_wkt: str) -> Transformer:
+    """Get a (cached) transformer between two CRS's given as WKT, in x, y order."""
+    return Transformer.from_crs(source_crs_wkt, target_crs_wkt, always_xy=True)
+
+
+def get_transformer_between_crs(source_crs, target_crs) -> Transformer:
+    """Get the cached transformer between two CRS's, given in any form pyproj accepts."""
+    return get_crs_transformer(
+        CRS.from_user_input(source_crs).to_wkt(),
+        CRS.from_user_input(target_crs).to_wkt(),
+    )
+
+
+def transform_sampling_points_to_crs(
+    sampling_points: SamplingPoints, source_crs, target_crs
+) -> SamplingPoints:
+    """
+    Transform the sampling point coordinates to another CRS.
+
+    Parameters:
+    - sampling_points: The sampling points of the road segments.
+    - source_crs: The CRS of the sampling points.
+    - target_crs: The CRS to transform the sampling points to.
+
+    Returns:
+    - The sampling points with the transformed coordinates.
+    """
+    transformer = get_transformer_between_crs(source_crs, target_crs)
+    x, y = transformer.transform(sampling_points.x, sampling_points.y)
+    return SamplingPoints(sampling_points.osm_ids, x, y, sampling_points.offsets)
+
+
+def open_warped_raster(
+    raster_src: rasterio.io.DatasetReader,
+    raster_crs,
+    target_crs,
+    raster_cell_resolution: int,
+) -> WarpedVRT:
+    """
+    Open an on-the-fly reprojected (warped) view of a raster, resampled to the
+    given cell resolution with nearest neighbour. Nothing is written to disk.
+    """
+    transform, width, height = calculate_default_transform(
+        raster_crs,
+        target_crs,
+        raster_src.width,
+        raster_src.height,
+        *raster_src.bounds,
+        resolution=raster_cell_resolution,
+    )
+    return WarpedVRT(
+        raster_src,
+        src_crs=raster_crs,
+        crs=target_crs,
+        transform=transform,
+        width=width,
+        height=height,
+        resampling=Resampling.nearest,
+    )
+
+
+def prepare_sampling_points_for_raster(
+    sampling_points: SamplingPoints,
+    raster_src: rasterio.io.DatasetReader | InMemoryRaster,
+    raster_crs=None,
+    sampling_points_crs=None,
+    segment_geometries: np.ndarray = None,
+) -> tuple[SamplingPoints, np.ndarray | None]:
+    """
+    Get the sampling points of the segments in the raster's CRS. With
+    segment_geometries, the segments' cell pieces for the line overlay are
+    returned instead, with their lengths as weights.
+
+    Parameters:
+    - sampling_points: The sampling points of the road segments, in sampling_points_crs.
+    - raster_src: The opened raster, or an in-memory raster.
+    - raster_crs: The CRS of the raster, if it differs from sampling_points_crs.
+    - sampling_points_crs: The CRS of the sampling points and the segment geometries.
+    - segment_geometries: The segment geometries for the line overlay.
 
     Returns:
-    - A dictionary containing the raster values for each road segment.
+    - The sampling points (or the cell pieces) in the raster's CRS.
+    - The weights of the points, None for the sampling points.
     """
-    with rasterio.open(raster_file_path) as raster_src:
-        return calculate_segment_raster_values(
-            network_gdf,
-            raster_src.read(1),
+    is_same_crs = (
+        sampling_points_crs is None
+        or raster_crs is None
+        or CRS.from_user_input(raster_crs) == CRS.from_user_input(sampling_points_crs)
+    )
+    if segment_geometries is not None:
+        return get_segment_cell_pieces(
+            sampling_points.osm_ids,
+            segment_geometries,
             raster_src.transform,
-            raster_null_value=raster_null_value,
+            (
+                None
+                if is_same_crs
+                else get_transformer_between_crs(sampling_points_crs, raster_crs)
+            ),
         )
+    if is_same_crs:
+        return sampling_points, None
+    return (
+        transform_sampling_points_to_crs(
+            sampling_points, sampling_points_crs, raster_crs
+        ),
+        None,
+    )
+
+
+def get_raster_band_labels(
+    raster_bands: list[int] = None, raster_variables: list[str] = None
+) -> list[tuple[str, str | None, int]]:
+    """
+    Get the labels of the raster bands and variables to sample, in the order
+    they are sampled: b<band> for bands, <variable> for variables and
+    <variable>_b<band> for the bands of variables.
+
+    Returns:
+    - List of (label, variable, band), the variable is None for the file itself.
+    """
+    bands = raster_bands or [1]
+    if not raster_variables:
+        return [(f"b{band}", None, band) for band in bands]
+    if not raster_bands:
+        return [(variable, variable, 1) for variable in raster_variables]
+    return [
+        (f"{variable}_b{band}", variable, band)
+        for variable in raster_variables
+        for band in bands
+    ]
+
+
+def get_raster_variable_path(
+    raster_src: rasterio.io.DatasetReader, variable: str
+) -> str:
+    """Get the GDAL path of a variable (subdataset) of e.g. a NetCDF file."""
+    for subdataset in raster_src.subdatasets:
+        if subdataset.rsplit(":", 1)[-1].strip('"') == variable:
+            return subdataset
+    raise ValueError(
+        f"Variable {variable} not found in raster {raster_src.name}, found: {raster_src.subdatasets}"
+    )
+
+
+@time_logger
+def calculate_segment_raster_band_values_from_raster_file(
+    sampling_points: SamplingPoints,
+    raster_file_path: str,
+    raster_null_value: float = None,
+    window_max_bytes: int = RASTER_WINDOW_MAX_BYTES,
+    sampling_points_crs: str | int = None,
+    raster_original_crs: str | int = None,
+    raster_cell_resolution: int = None,
+    segment_statistics: list[str] = None,
+    segment_geometries: np.ndarray = None,
+    raster_bands: list[int] = None,
+    raster_variables: list[str] = None,
+    workers: int = DEFAULT_RASTER_SAMPLING_WORKERS,
+) -> dict[str, dict[str, dict]]:
+    """
+    Calculate raster values for each road segment from several bands and/or
+    variables (subdatasets, e.g. of a NetCDF file) of a raster file at once.
+    The sampling points are transformed (or the segments overlaid with the
+    raster cells) and their raster indices are calculated once for all the
+    bands and variables on the same grid, and the bands of a variable are read together.
+    If the raster is in another CRS than the sampling points, the sampling
+    points are transformed to the raster's CRS and the raster is sampled as
+    it is. Only if raster_cell_resolution is given, the raster is reprojected
+    and resampled to it on the fly (WarpedVRT) instead.
+
+    Parameters:
+    - sampling_points: The sampling points of the road segments.
+    - raster_file_path: The path to the raster file.
+    - raster_null_value: The null value used in the raster data.
+    - window_max_bytes: Maximum size of the raster data read at once, in bytes.
+    - sampling_points_crs: The CRS of the sampling points, the project CRS.
+    - raster_original_crs: The CRS of the raster, used if the file has no CRS.
+    - raster_cell_resolution: Resolution to resample the raster to, in sampling_points_crs units.
+    - segment_statistics: Statistics to calculate in addition to the default sampling strategy.
+    - segment_geometries: The segment geometries in sampling_points_crs, if given the
+      segments are overlaid with the raster cells (length weighted) instead of
+      sampling them at the sampling points.
+    - raster_bands: The band numbers to sample, the first band if not given.
+    - raster_variables: The variables (subdatasets) to sample, the file itself if not given.
+    - workers: Number of worker processes sampling the raster. The bands are
+      then read into shared memory, if they fit in window_max_bytes, and the
+      segments are sampled in chunks. Bigger rasters are sampled window by
+      window in this process.
+
+    Returns:
+    - A dictionary of the band labels (see get_raster_band_labels), each
+      containing the statistics of the raster values for each road segment.
+    """
+    band_labels = get_raster_band_labels(raster_bands, raster_variables)
+    raster_paths = {None: raster_file_path}
+    if raster_variables:
+        with rasterio.open(raster_file_path) as file_src:
+            raster_paths = {
+                variable: get_raster_variable_path(file_src, variable)
+                for variable in raster_variables
+            }
+
+    # sampling points and raster indices of each grid, shared by the bands and variables
+    prepared_grids = {}
+    band_values = {}
+    for variable, raster_path in raster_paths.items():
+        bands = [band for _, v, band in band_labels if v == variable]
+        with rasterio.open(raster_path) as raster_src:
+            raster_crs = raster_src.crs or raster_original_crs
+            is_same_crs = (
+                sampling_points_crs is None
+                or raster_crs is None
+                or CRS.from_user_input(raster_crs)
+                == CRS.from_user_input(sampling_points_crs)
+            )
+            if not is_same_crs and raster_cell_resolution:
+                LOG.info(
+                    f"Reprojecting raster {raster_path} on the fly to {sampling_points_crs} with resolution {raster_cell_resolution}."
+                )
+                dataset = open_warped_raster(
+                    raster_src,
+                    raster_crs,
+                    sampling_points_crs,
+                    raster_cell_resolution,
+                )
+                dataset_crs = sampling_points_crs
+            else:
+                if not is_same_crs:
+                    LOG.info(
+                        f"Sampling raster {raster_path} in its own CRS, transforming the segments from {sampling_points_crs}."
+                    )
+                dataset = raster_src
+                dataset_crs = raster_crs
+
+            grid_key = (
+                str(dataset_crs),
+                dataset.transform.to_gdal(),
+                dataset.shape,
+            )
+            if grid_key not in prepared_grids:
+                dataset_sampling_points, weights = prepare_sampling_points_for_raster(
+                    sampling_points,
+                    dataset,
+                    dataset_crs,
+                    sampling_points_crs,
+                    segment_geometries,
+                )
+                rows, cols, is_inside = get_raster_indices_at_points(
+                    dataset_sampling_points.x,
+                    dataset_sampling_points.y,
+                    dataset.transform,
+                    dataset.shape,
+                )
+                prepared_grids[grid_key] = (
+                    dataset_sampling_points,
+                    weights,
+                    rows,
+                    cols,
+                    is_inside,
+                )
+            dataset_sampling_points, weights, rows, cols, is_inside = prepared_grids[
+                grid_key
+            ]
+
+            item_size = np.dtype(dataset.dtypes[0]).itemsize
+            fits_in_memory = (
+                dataset.width * dataset.height * item_size * len(bands)
+                <= window_max_bytes
+            )
+            if workers > 1 and fits_in_memory and len(dataset_sampling_points) > 1:
+                variable_band_values = calculate_segment_raster_band_values_in_parallel(
+                    dataset,
+                    bands,
+                    dataset_sampling_points,
+                    raster_null_value,
+                    segment_statistics,
+                    weights,
+                    workers,
+                )
+            else:
+                values = read_raster_band_values_at_points(
+                    dataset, rows, cols, is_inside, bands, window_max_bytes
+                )
+                variable_band_values = [
+                    aggregate_point_values_to_segments(
+                        dataset_sampling_points,
+                        band_point_values,
+                        is_inside,
+                        raster_null_value,
+                        segment_statistics,
+                        weights,
+                    )
+                    for band_point_values in values
+                ]
+            if dataset is not raster_src:
+                dataset.close()
+
+        for band, segment_values in zip(bands, variable_band_values):
+            band_values[(variable, band)] = segment_values
+
+    return {
+        label: band_values[(variable, band)] for label, variable, band in band_labels
+    }
+
+
+@time_logger
+def calculate_segment_raster_band_values_from_in_memory_raster(
+    sampling_points: SamplingPoints,
+    raster: InMemoryRaster,
+    raster_null_value: float = None,
+    sampling_points_crs: str | int = None,
+    segment_statistics: list[str] = None,
+    segment_geometries: np.ndarray = None,
+    raster_bands: list[int] = None,
+    workers: int = DEFAULT_RASTER_SAMPLING_WORKERS,
+) -> dict[str, dict[str, dict]]:
+    """
+    Calculate raster values for each road segment from the bands of an in-memory
+    raster. If the raster is in another CRS than the sampling points, the
+    sampling points are transformed to the raster's CRS.
+    See calculate_segment_raster_band_values_from_raster_file for the parameters.
+
+    Returns:
+    - A dictionary of the band labels (see get_raster_band_labels), each
+      containing the statistics of the raster values for each road segment.
+    """
+    band_labels = get_raster_band_labels(raster_bands)
+    raster_data = raster.read([band for _, _, band in band_labels])
+    raster_sampling_points, weights = prepare_sampling_points_for_raster(
+        sampling_points,
+        raster,
+        raster.crs,
+        sampling_points_crs,
+        segment_geometries,
+    )
+    # the in-memory bands are already unpacked, NaN is no data
+    band_unpacking = [(1, 0, None)] * len(band_labels)
+
+    if workers > 1 and len(raster_sampling_points) > 1:
+        shared_blocks, array_descriptions = share_arrays({"raster": raster_data})
+        try:
+            band_values = calculate_segment_shared_raster_band_values_in_parallel(
+                raster_sampling_points,
+                array_descriptions["raster"],
+                raster.transform,
+                band_unpacking,
+                raster_null_value,
+                segment_statistics,
+                weights,
+                workers,
+            )
+        finally:
+            release_shared_arrays(shared_blocks)
+    else:
+        band_values = [
+            segment_value_arrays_to_dicts(raster_sampling_points.osm_ids, value_arrays)
+            for value_arrays in calculate_segment_raster_band_value_arrays(
+                raster_data,
+                raster.transform,
+                raster_sampling_points.x,
+                raster_sampling_points.y,
+                raster_sampling_points.offsets,
+                band_unpacking,
+                raster_null_value,
+                segment_statistics,
+                weights,
+            )
+        ]
+    return {
+        label: segment_values
+        for (label, _, _), segment_values in zip(band_labels, band_values)
+    }
+
+
+def calculate_segment_raster_values_from_raster_file(
+    sampling_points: SamplingPoints,
+    raster_file_path: str,
+    raster_null_value: float = None,
+    window_max_bytes: int = RASTER_WINDOW_MAX_BYTES,
+    sampling_points_crs: str | int = None,
+    raster_original_crs: str | int = None,
+    raster_cell_resolution: int = None,
+    segment_statistics: list[str] = None,
+    segment_geometries: np.ndarray = None,
+    workers: int = DEFAULT_RASTER_SAMPLING_WORKERS,
+) -> dict[str, dict]:
+    """
+    Calculate raster values for each road segment from the first band of a raster file.
+    See calculate_segment_raster_band_values_from_raster_file for the parameters.
+
+    Returns:
+    - A dictionary of the statistics, each containing the raster values for each road segment.
+    """
+    band_values = calculate_segment_raster_band_values_from_raster_file(
+        sampling_points,
+        raster_file_path,
+        raster_null_value=raster_null_value,
+        window_max_bytes=window_max_bytes,
+        sampling_points_crs=sampling_points_crs,
+        raster_original_crs=raster_original_crs,
+        raster_cell_resolution=raster_cell_resolution,
+        segment_statistics=segment_statistics,
+        segment_geometries=segment_geometries,
+        workers=workers,
+    )
+    return next(iter(band_values.values()))
 
 
 # from greenpaths 1
@@ -393,26 +1908,30 @@ def calculate_segment_raster_values_from_raster_file(
 # folderi custom functions? Testaa muillakin rastereil mihin ei tarvi tehdä custom processingii
 
 
-def describe_raster_data(filepath: str) -> tuple[float, float, int]:
+def describe_raster_data(filepath: str | InMemoryRaster) -> tuple[float, float, int]:
     """
     Describe the raster data.
 
     Parameters:
-    - filepath: Path to the raster file.
+    - filepath: Path to the raster file, or an in-memory raster.
 
     Returns:
     - min_value: Minimum value in the raster.
     - max_value: Maximum value in the raster.
     - count: Count of non-NaN values in the raster.
     """
-    with rasterio.open(filepath) as src:
-        # read only 1st band
-        array = src.read(1)
-        crs = src.crs
-        min_value = array.min()
-        max_value = array.max()
-        # count non-nan values
-        non_nan_count = np.count_nonzero(~np.isnan(array))
-        # count nan-values
-        nan_count = np.count_nonzero(np.isnan(array))
+    if isinstance(filepath, InMemoryRaster):
+        array = filepath.read([1])[0]
+        crs = filepath.crs
+    else:
+        with rasterio.open(filepath) as src:
+            # read only 1st band
+            array = src.read(1)
+            crs = src.crs
+    min_value = array.min()
+    max_value = array.max()
+    # count non-nan values
+    non_nan_count = np.count_nonzero(~np.isnan(array))
+    # count nan-values
+    nan_count = np.count_nonzero(np.isnan(array))
     return crs, min_value, max_value, non_nan_count, nan_count
@@ -0,0 +1,195 @@
+""" Cache for the rasterized vector data sources. """
+
+import glob
+import hashlib
+import json
+import os
+
+import geopandas as gpd
+import rasterio.shutil
+
+from ..config import (
+    RASTERIZATION_CACHE_CREATION_OPTIONS,
+    RASTERIZATION_CACHE_DIR_PATH,
+    RASTERIZATION_CACHE_FILE_EXTENSION,
+    RASTERIZATION_CACHE_MAX_BYTES,
+    RASTERIZATION_CACHE_VERSION,
+    RASTERIZATION_TILE_SIZE,
+)
+from ..logging import setup_logger, LoggerColors
+from .raster_operations import calculate_raster_dimensions, save_tiled_raster_file
+from .segmented_network_cache import calculate_file_sha256
+
+LOG = setup_logger(__name__, LoggerColors.BLUE.value)
+
+
+# A rasterized vector data source is stored in the cache directory as a
+# compressed Cloud-Optimized GeoTIFF, which is sampled like any raster data
+# source. The file name holds a key of the vector files' content hashes and
+# the parameters changing the raster (data column, buffer, cell resolution,
+# CRS and nodata value), so any change in them is a cache miss.
+# The cache files are touched when used, and the least recently used files
+# are removed when the cache directory grows over its maximum size.
+
+# the files of a shapefile data source, the attributes are in the .dbf
+SHAPEFILE_EXTENSIONS = [".shp", ".shx", ".dbf", ".prj", ".cpg"]
+
+
+def get_vector_source_paths(vector_file_path: str) -> list[str]:
+    """Get the paths of the files of a vector data source, e.g. the sidecar files of a shapefile."""
+    base_path, extension = os.path.splitext(vector_file_path)
+    if extension.lower() != ".shp":
+        return [vector_file_path]
+    return [
+        base_path + sidecar_extension
+        for sidecar_extension in SHAPEFILE_EXTENSIONS
+        if os.path.exists(base_path + sidecar_extension)
+    ]
+
+
+def get_rasterization_cache_key(
+    vector_file_path: str, rasterization_parameters: dict
+) -> str:
+    """
+    Get the cache key of a rasterized vector data source.
+
+    Parameters:
+    - vector_file_path: Path to the vector data source.
+    - rasterization_parameters: The parameters changing the rasterized output.
+
+    Returns:
+    - Short hash of the vector data content and the parameters.
+    """
+    key_json = json.dumps(
+        {
+            "version": RASTERIZATION_CACHE_VERSION,
+            "source_sha256": [
+                calculate_file_sha256(path)
+                for path in get_vector_source_paths(vector_file_path)
+            ],
+            "parameters": rasterization_parameters,
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(key_json.encode()).hexdigest()[:16]
+
+
+def get_rasterization_cache_path(
+    data_name: str, cache_key: str, cache_dir: str = RASTERIZATION_CACHE_DIR_PATH
+) -> str:
+    """Get the path of the rasterization cache of a vector data source."""
+    return os.path.join(
+        cache_dir, f"{data_name}.{cache_key}{RASTERIZATION_CACHE_FILE_EXTENSION}"
+    )
+
+
+def check_rasterization_cache(cache_path: str) -> bool:
+    """
+    Check if a rasterization cache exists, and mark it as recently used.
+
+    Returns:
+    - True on a cache hit.
+    """
+    if not os.path.exists(cache_path):
+        return False
+    # the modification time is the last use time for the eviction
+    os.utime(cache_path)
+    LOG.info(f"Using rasterized data from cache {cache_path}")
+    return True
+
+
+def write_rasterization_cache(
+    cache_path: str,
+    vector_data_gdf: gpd.GeoDataFrame,
+    data_column: str,
+    raster_cell_resolution: int,
+    nodata_value: float | int,
+    tile_size: int = RASTERIZATION_TILE_SIZE,
+    point_buffer: float = None,
+) -> None:
+    """
+    Rasterize the vector data to the cache as a Cloud-Optimized GeoTIFF.
+    The raster is first rasterized tile by tile to a temporary GeoTIFF, which
+    GDAL then copies to a COG with overviews.
+
+    Parameters:
+    - cache_path: Path to the cache file.
+    - vector_data_gdf: The GeoDataFrame containing the vector data.
+    - data_column: The name of the column containing the values to rasterize.
+    - raster_cell_resolution: The resolution of the raster cells in meters.
+    - nodata_value: The value of the cells without features.
+    - tile_size: The width and height of the rasterized tiles in cells.
+    - point_buffer: If given, the vector data is points, rasterized with the
+      maximum value within this distance.
+    """
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    width, height, transform = calculate_raster_dimensions(
+        vector_data_gdf, raster_cell_resolution, point_buffer or 0
+    )
+
+    # write to temporary files first, a partial cache file must never be read
+    temporary_raster_path = cache_path + ".tiles.tmp.tif"
+    temporary_cache_path = cache_path + ".tmp.tif"
+    try:
+        save_tiled_raster_file(
+            vector_data_gdf,
+            data_column,
+            temporary_raster_path,
+            width,
+            height,
+            transform,
+            nodata_value,
+            tile_size,
+            creation_options={"COMPRESS": "DEFLATE"},
+            point_buffer=point_buffer,
+        )
+        rasterio.shutil.copy(
+            temporary_raster_path,
+            temporary_cache_path,
+            driver="COG",
+            **RASTERIZATION_CACHE_CREATION_OPTIONS,
+        )
+        os.replace(temporary_cache_path, cache_path)
+    finally:
+        for path in (temporary_raster_path, temporary_cache_path):
+            if os.path.exists(path):
+                os.remove(path)
+    LOG.info(f"Saved rasterized data to cache {cache_path}")
+
+
+def evict_rasterization_caches(
+    cache_dir: str = RASTERIZATION_CACHE_DIR_PATH,
+    max_bytes: int = RASTERIZATION_CACHE_MAX_BYTES,
+    keep_paths: list[str] = None,
+) -> list[str]:
+    """
+    Remove the least recently used rasterization caches until the cache
+    directory is at most max_bytes. The caches in keep_paths are never removed.
+
+    Returns:
+    - The paths of the removed caches.
+    """
+    keep_paths = {os.path.abspath(path) for path in keep_paths or []}
+    cache_files = []
+    for cache_path in glob.glob(
+        os.path.join(glob.escape(cache_dir), f"*{RASTERIZATION_CACHE_FILE_EXTENSION}")
+    ):
+        cache_stat = os.stat(cache_path)
+        cache_files.append((cache_stat.st_mtime_ns, cache_stat.st_size, cache_path))
+
+    total_bytes = sum(size for _, size, _ in cache_files)
+    removed_paths = []
+    for _, size, cache_path in sorted(cache_files):
+        if total_bytes <= max_bytes:
+            break
+        if os.path.abspath(cache_path) in keep_paths:
+            continue
+        os.remove(cache_path)
+        total_bytes -= size
+        removed_paths.append(cache_path)
+    if removed_paths:
+        LOG.info(
+            f"Removed {len(removed_paths)} least recently used rasterization caches."
+        )
+    return removed_paths
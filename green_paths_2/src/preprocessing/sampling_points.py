@@ -0,0 +1,125 @@
+""" Sampling points of the network segments, in a packed (CSR) layout. """
+
+import numpy as np
+import shapely
+
+from ..logging import setup_logger, LoggerColors
+from ..timer import time_logger
+
+LOG = setup_logger(__name__, LoggerColors.BLUE.value)
+
+
+class SamplingPoints:
+    """
+    Sampling points of the network segments stored as flat x and y coordinate
+    arrays. The points of the segment i are x[offsets[i]:offsets[i + 1]] and
+    y[offsets[i]:offsets[i + 1]], in the order of the segments' osm_ids.
+    """
+
+    def __init__(
+        self,
+        osm_ids: np.ndarray,
+        x: np.ndarray,
+        y: np.ndarray,
+        offsets: np.ndarray,
+    ):
+        self.osm_ids = np.asarray(osm_ids, dtype=np.int64)
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        if len(self.offsets) != len(self.osm_ids) + 1 or len(self.x) != len(self.y):
+            raise ValueError("Sampling point arrays do not match the segments.")
+
+    def __len__(self) -> int:
+        return len(self.osm_ids)
+
+    @property
+    def point_count(self) -> int:
+        return len(self.x)
+
+    @property
+    def counts(self) -> np.ndarray:
+        """Number of sampling points of each segment."""
+        return np.diff(self.offsets)
+
+    def get_segment_coordinates(self, segment_index: int) -> np.ndarray:
+        """Get the (x, y) coordinates of the sampling points of a segment."""
+        start, end = self.offsets[segment_index], self.offsets[segment_index + 1]
+        return np.column_stack((self.x[start:end], self.y[start:end]))
+
+    def get_point_segment_indices(self) -> np.ndarray:
+        """Get the index of the segment of each sampling point."""
+        return np.repeat(np.arange(len(self)), self.counts)
+
+
+def calculate_sampling_point_amounts(
+    segment_lengths: np.ndarray, raster_resolution: float
+) -> np.ndarray:
+    """
+    Calculate the number of sampling points of each segment based on the
+    segment length and the raster resolution.
+    """
+    return np.ceil(segment_lengths / raster_resolution).astype(np.int64) + 1
+
+
+@time_logger
+def generate_sampling_points(
+    osm_ids: np.ndarray,
+    geometries: np.ndarray,
+    raster_resolution: float,
+    force_sampling_points_amount: int = None,
+) -> SamplingPoints:
+    """
+    Generate evenly spaced sampling points along the segments, for all the
+    segments at once. The amount of points is based on the segment length and
+    the raster resolution, or forced to force_sampling_points_amount.
+    Each part of a MultiLineString gets the segment's amount of points, spaced
+    evenly along the part. Other than line geometries get no points.
+
+    Parameters:
+    - osm_ids: The osm ids of the segments.
+    - geometries: The segment geometries, LineStrings or MultiLineStrings.
+    - raster_resolution: The most accurate raster resolution from the data sources.
+    - force_sampling_points_amount: The number of sampling points for each segment.
+
+    Returns:
+    - The packed sampling points of the segments.
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    if force_sampling_points_amount:
+        segment_point_amounts = np.full(
+            len(geometries), force_sampling_points_amount, dtype=np.int64
+        )
+    else:
+        segment_point_amounts = calculate_sampling_point_amounts(
+            shapely.length(geometries), raster_resolution
+        )
+
+    parts, part_segment_indices = shapely.get_parts(geometries, return_index=True)
+    is_line = (shapely.get_type_id(parts) == shapely.GeometryType.LINESTRING) & ~(
+        shapely.is_empty(parts)
+    )
+    parts = parts[is_line]
+    part_segment_indices = part_segment_indices[is_line]
+    part_point_amounts = segment_point_amounts[part_segment_indices]
+
+    # the distances along the parts as fractions: 0, 1 / (n - 1), ..., 1
+    part_starts = np.cumsum(part_point_amounts) - part_point_amounts
+    point_part_indices = np.repeat(np.arange(len(parts)), part_point_amounts)
+    point_numbers = np.arange(len(point_part_indices)) - part_starts[point_part_indices]
+    fractions = (
+        point_numbers / np.maximum(part_point_amounts - 1, 1)[point_part_indices]
+    )
+
+    points = shapely.line_interpolate_point(
+        parts[point_part_indices], fractions, normalized=True
+    )
+    x, y = shapely.get_coordinates(points).T
+
+    segment_point_counts = np.bincount(
+        part_segment_indices, weights=part_point_amounts, minlength=len(geometries)
+    ).astype(np.int64)
+    offsets = np.concatenate(([0], np.cumsum(segment_point_counts)))
+
+    LOG.info(f"Generated {len(x)} sampling points for {len(geometries)} segments.")
+    return SamplingPoints(osm_ids, x, y, offsets)
@@ -0,0 +1,247 @@
+""" Cache manifest for the segmented OSM networks. """
+
+import hashlib
+import json
+import os
+
+from shapely.geometry.base import BaseGeometry
+
+from ..config import (
+    DEFAULT_SEGMENTATION_WAY_FILTER,
+    OSM_SEGMENTED_MANIFEST_FILE_EXTENSION,
+    OSM_SEGMENTER_VERSION,
+    SEGMENTED_NETWORK_CACHE_HASH_CHUNK_SIZE,
+)
+from ..logging import setup_logger, LoggerColors
+
+LOG = setup_logger(__name__, LoggerColors.RED.value)
+
+
+# Every cached *_segmented.osm.pbf has a JSON manifest next to it, storing
+# the source file's content hash, size and mtime, the segmenter version and
+# the segmentation parameters. The cache is valid when the metadata matches,
+# the segmented file itself is not parsed. The source is hashed only if its
+# size or mtime changed, e.g. after a copy or a touch.
+
+
+def get_manifest_path(osm_segmented_network_path: str) -> str:
+    """Get the path of the manifest file of a segmented OSM network."""
+    return osm_segmented_network_path + OSM_SEGMENTED_MANIFEST_FILE_EXTENSION
+
+
+def get_segmentation_parameters(
+    way_filter: dict[str, list[str]] | None = DEFAULT_SEGMENTATION_WAY_FILTER,
+    clip_area: BaseGeometry = None,
+) -> dict:
+    """
+    Get the segmentation parameters which change the segmented output and
+    differ from the defaults. The number of workers and the intersection
+    index backend do not change the output.
+
+    Parameters:
+    - way_filter: Tag key to allowed values filter for the kept ways, None keeps all the ways.
+    - clip_area: Study area in WGS84 (lon, lat) the network is clipped to.
+
+    Returns:
+    - The parameters, empty for the default segmentation.
+    """
+    segmentation_parameters = {}
+    if way_filter != DEFAULT_SEGMENTATION_WAY_FILTER:
+        segmentation_parameters["way_filter"] = way_filter
+    if clip_area is not None:
+        segmentation_parameters["clip_area"] = clip_area.wkt
+    return segmentation_parameters
+
+
+def get_segmentation_variant(segmentation_parameters: dict) -> str | None:
+    """
+    Get a short key for the segmentation parameters that change the output.
+    The key is added to the segmented file name, so that networks segmented
+    with different parameters can be cached side by side.
+
+    Parameters:
+    - segmentation_parameters: Output changing parameters, which differ from the defaults.
+
+    Returns:
+    - The variant key, or None for the default segmentation.
+    """
+    if not segmentation_parameters:
+        return None
+    parameters_json = json.dumps(segmentation_parameters, sort_keys=True)
+    return hashlib.sha256(parameters_json.encode()).hexdigest()[:10]
+
+
+def calculate_file_sha256(file_path: str) -> str:
+    """Calculate the sha256 content hash of a file, reading it in chunks."""
+    file_hash = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        while chunk := file.read(SEGMENTED_NETWORK_CACHE_HASH_CHUNK_SIZE):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def _file_stat(file_path: str) -> dict:
+    file_stat = os.stat(file_path)
+    return {"size": file_stat.st_size, "mtime_ns": file_stat.st_mtime_ns}
+
+
+def _file_stat_matches(recorded_stat: dict, file_path: str) -> bool:
+    """Check if the size and mtime of a file match the ones recorded in a manifest."""
+    return all(
+        recorded_stat.get(key) == value for key, value in _file_stat(file_path).items()
+    )
+
+
+def write_segmented_network_manifest(
+    osm_segmented_network_path: str,
+    osm_source_path: str,
+    segmentation_parameters: dict,
+    segmentation_report: dict = None,
+) -> dict:
+    """
+    Write the cache manifest for a freshly segmented OSM network.
+
+    Parameters:
+    - osm_segmented_network_path: Path to the segmented OSM PBF file.
+    - osm_source_path: Path to the source OSM PBF file.
+    - segmentation_parameters: The parameters used in the segmentation.
+    - segmentation_report: Sizes and counts of the source and the segmented network.
+
+    Returns:
+    - The written manifest.
+    """
+    manifest = {
+        "segmenter_version": OSM_SEGMENTER_VERSION,
+        "segmentation_parameters": segmentation_parameters,
+        "source": {
+            "path": os.path.abspath(osm_source_path),
+            "sha256": calculate_file_sha256(osm_source_path),
+            **_file_stat(osm_source_path),
+        },
+        "segmented": _file_stat(osm_segmented_network_path),
+        "segmentation_report": segmentation_report,
+    }
+    with open(get_manifest_path(osm_segmented_network_path), "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=4)
+    return manifest
+
+
+def read_segmented_network_manifest(osm_segmented_network_path: str) -> dict | None:
+    """Read the cache manifest of a segmented OSM network, None if missing or unreadable."""
+    manifest_path = get_manifest_path(osm_segmented_network_path)
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path) as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError) as e:
+        LOG.warning(f"Could not read segmented network manifest {manifest_path}: {e}")
+        return None
+
+
+def remove_segmented_network_cache(osm_segmented_network_path: str) -> None:
+    """Remove a cached segmented OSM network and its manifest."""
+    for path in (
+        get_manifest_path(osm_segmented_network_path),
+        osm_segmented_network_path,
+    ):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def segmented_network_cache_is_valid(
+    osm_segmented_network_path: str,
+    osm_source_path: str,
+    segmentation_parameters: dict,
+) -> bool:
+    """
+    Check if a cached segmented OSM network can be used for the source file
+    by comparing the metadata in its manifest.
+
+    Parameters:
+    - osm_segmented_network_path: Path to the cached segmented OSM PBF file.
+    - osm_source_path: Path to the source OSM PBF file.
+    - segmentation_parameters: The parameters for the segmentation.
+
+    Returns:
+    - True if the cached network is up to date.
+    """
+    if not os.path.exists(osm_segmented_network_path):
+        return False
+
+    manifest = read_segmented_network_manifest(osm_segmented_network_path)
+    if manifest is None:
+        LOG.info(f"No cache manifest found for {osm_segmented_network_path}.")
+        return False
+
+    if manifest.get("segmenter_version") != OSM_SEGMENTER_VERSION:
+        LOG.info("Cached segmented network was made with another segmenter version.")
+        return False
+
+    if manifest.get("segmentation_parameters") != segmentation_parameters:
+        LOG.info("Cached segmented network was made with other parameters.")
+        return False
+
+    if not _file_stat_matches(
+        manifest.get("segmented", {}), osm_segmented_network_path
+    ):
+        LOG.info("Cached segmented network has been modified after segmentation.")
+        return False
+
+    source_manifest = manifest.get("source", {})
+    source_stat = _file_stat(osm_source_path)
+    if _file_stat_matches(source_manifest, osm_source_path):
+        return True
+
+    # size or mtime differ, only the content hash can tell if the source changed
+    if source_manifest.get("size") != source_stat["size"] or source_manifest.get(
+        "sha256"
+    ) != calculate_file_sha256(osm_source_path):
+        LOG.info("Source OSM network has changed after segmentation.")
+        return False
+
+    # same content, store the new stat to skip hashing the next time
+    source_manifest.update(source_stat)
+    with open(get_manifest_path(osm_segmented_network_path), "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=4)
+    return True
+
+
+def update_segmented_network_manifest(
+    osm_segmented_network_path: str, osm_change_path: str
+) -> None:
+    """
+    Record an applied OSM change file in the manifest of an updated segmented
+    network. The source metadata is kept, so the updated network is used as
+    the cached network of its source.
+    """
+    manifest = read_segmented_network_manifest(osm_segmented_network_path)
+    if manifest is None:
+        return
+    manifest.setdefault("applied_changes", []).append(
+        {
+            "path": os.path.abspath(osm_change_path),
+            "sha256": calculate_file_sha256(osm_change_path),
+        }
+    )
+    manifest["segmented"] = _file_stat(osm_segmented_network_path)
+    with open(get_manifest_path(osm_segmented_network_path), "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=4)
+
+
+def get_segmented_network_sha256(osm_segmented_network_path: str) -> str:
+    """
+    Get the content hash of a segmented OSM network. The hash is stored in the
+    manifest the first time, and reused as long as the size and the mtime of
+    the segmented file match the manifest, so the file is not read again.
+    Without a manifest the file is hashed every time.
+    """
+    manifest = read_segmented_network_manifest(osm_segmented_network_path)
+    segmented_manifest = (manifest or {}).get("segmented", {})
+    if not _file_stat_matches(segmented_manifest, osm_segmented_network_path):
+        return calculate_file_sha256(osm_segmented_network_path)
+    if "sha256" not in segmented_manifest:
+        segmented_manifest["sha256"] = calculate_file_sha256(osm_segmented_network_path)
+        with open(get_manifest_path(osm_segmented_network_path), "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=4)
+    return segmented_manifest["sha256"]
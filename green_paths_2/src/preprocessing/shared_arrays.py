@@ -0,0 +1,88 @@
+""" Numpy arrays in shared memory, for handing big arrays to worker processes without copying. """
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+# An array is shared by creating a shared memory block of its size, which the
+# worker processes map by its name. The arrays are described to the workers
+# with picklable (block name, dtype, shape) tuples. The creating process owns
+# the blocks and must release them when the workers are done. A block cannot
+# be closed while an array is mapped from it, so the creating process only
+# maps short lived arrays from the blocks, e.g. to read raster data into.
+
+
+def create_shared_array(
+    shape: tuple, dtype
+) -> tuple[shared_memory.SharedMemory, tuple[str, str, tuple]]:
+    """
+    Create a shared memory block for an array of the given shape and dtype.
+
+    Returns:
+    - The shared memory block.
+    - The picklable (block name, dtype, shape) description of the array.
+    """
+    dtype = np.dtype(dtype)
+    shape = tuple(int(length) for length in shape)
+    # a shared memory block cannot be empty
+    block = shared_memory.SharedMemory(
+        create=True, size=max(int(np.prod(shape, dtype=np.int64)) * dtype.itemsize, 1)
+    )
+    return block, (block.name, dtype.str, shape)
+
+
+def get_shared_array(
+    block: shared_memory.SharedMemory, description: tuple[str, str, tuple]
+) -> np.ndarray:
+    """Map the array described by description from the shared memory block."""
+    _, dtype, shape = description
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+
+
+def share_arrays(
+    arrays: dict[str, np.ndarray]
+) -> tuple[list[shared_memory.SharedMemory], dict[str, tuple[str, str, tuple]]]:
+    """
+    Copy the arrays to shared memory blocks.
+
+    Returns:
+    - The shared memory blocks, to release when the workers are done.
+    - The picklable description of each array.
+    """
+    blocks = []
+    descriptions = {}
+    try:
+        for name, array in arrays.items():
+            block, description = create_shared_array(array.shape, array.dtype)
+            blocks.append(block)
+            get_shared_array(block, description)[...] = array
+            descriptions[name] = description
+    except Exception:
+        release_shared_arrays(blocks)
+        raise
+    return blocks, descriptions
+
+
+def attach_shared_arrays(
+    descriptions: dict[str, tuple[str, str, tuple]]
+) -> tuple[list[shared_memory.SharedMemory], dict[str, np.ndarray]]:
+    """
+    Map the shared memory blocks described by share_arrays to arrays.
+    The blocks must be kept open as long as the arrays are used.
+    """
+    blocks = []
+    arrays = {}
+    for name, description in descriptions.items():
+        block = shared_memory.SharedMemory(name=description[0])
+        blocks.append(block)
+        arrays[name] = get_shared_array(block, description)
+    return blocks, arrays
+
+
+def release_shared_arrays(blocks: list[shared_memory.SharedMemory]) -> None:
+    """Remove and close the shared memory blocks created by share_arrays."""
+    for block in blocks:
+        # removed first, the memory is freed once the last mapping is closed
+        block.unlink()
+        block.close()
@@ -1,6 +1,7 @@
 """ Spatial operations for GeoDataFrames. """
 
 import geopandas as gpd
+import numpy as np
 import rasterio
 import shapely
 import geopandas as gpd
@@ -113,6 +114,17 @@ def create_buffer_for_geometries(
     return buffered_gdf
 
 
+def has_only_point_geometries(gdf: gpd.GeoDataFrame) -> bool:
+    """Check if all the geometries in GeoDataFrame are (non-empty) points."""
+    geometries = gdf.geometry.values
+    return len(geometries) > 0 and bool(
+        (
+            (shapely.get_type_id(geometries) == shapely.GeometryType.POINT)
+            & ~shapely.is_empty(geometries)
+        ).all()
+    )
+
+
 def has_invalid_geometries(gdf: gpd.GeoDataFrame, name: str = "") -> bool:
     """Check for invalid geometries in GeoDataFrame"""
     LOG.info(f"Checking for invalid geometries for {name}")
@@ -242,3 +254,17 @@ def convert_geometries_to_wkt(
             # set the geometry in values to none
             values[GEOMETRY_KEY] = None
     return data
+
+
+def convert_geometry_array_to_wkt(geometries: np.ndarray) -> np.ndarray:
+    """
+    Convert an array of geometries to WKT at once, like convert_geometries_to_wkt.
+    Other than (multi)linestring geometries are converted to None.
+    """
+    wkt_geometries = shapely.to_wkt(geometries, trim=False, rounding_precision=-1)
+    is_line = np.isin(
+        shapely.get_type_id(geometries),
+        [shapely.GeometryType.LINESTRING, shapely.GeometryType.MULTILINESTRING],
+    )
+    wkt_geometries[~is_line] = None
+    return wkt_geometries
@@ -0,0 +1,85 @@
+""" Study area (clip area) for clipping the OSM network at segmentation time. """
+
+import geopandas as gpd
+import pandas as pd
+from shapely.geometry import box
+from shapely.geometry.base import BaseGeometry
+
+from ..config import WGS84_CRS
+from ..logging import setup_logger, LoggerColors
+
+LOG = setup_logger(__name__, LoggerColors.BLUE.value)
+
+
+# The clip areas are always in WGS84 (lon, lat), which is the CRS of the OSM
+# PBF node locations. Buffers are given in meters and applied in the local UTM
+# zone of the area.
+
+
+def buffer_in_meters(
+    area_gdf: gpd.GeoDataFrame, buffer_meters: float = 0
+) -> BaseGeometry:
+    """
+    Union the geometries and buffer the union in meters.
+
+    Parameters:
+    - area_gdf: GeoDataFrame with the area geometries, in any CRS.
+    - buffer_meters: Buffer distance in meters.
+
+    Returns:
+    - The buffered area in WGS84.
+    """
+    if area_gdf.crs is None:
+        raise ValueError("Clip area geometries have no CRS.")
+    area_gdf = area_gdf.to_crs(WGS84_CRS)
+    if buffer_meters:
+        metric_crs = area_gdf.estimate_utm_crs()
+        area_gdf = area_gdf.to_crs(metric_crs).buffer(buffer_meters).to_crs(WGS84_CRS)
+    clip_area = area_gdf.unary_union
+    LOG.info(f"Clip area bounds: {clip_area.bounds}")
+    return clip_area
+
+
+def clip_area_from_bbox(
+    bbox: tuple[float, float, float, float], buffer_meters: float = 0
+) -> BaseGeometry:
+    """
+    Create a clip area from a WGS84 bounding box (min_lon, min_lat, max_lon, max_lat).
+    """
+    min_lon, min_lat, max_lon, max_lat = bbox
+    if min_lon >= max_lon or min_lat >= max_lat:
+        raise ValueError(
+            f"Invalid clip bbox {bbox}, should be min_lon, min_lat, max_lon, max_lat."
+        )
+    bbox_gdf = gpd.GeoDataFrame(geometry=[box(*bbox)], crs=WGS84_CRS)
+    return buffer_in_meters(bbox_gdf, buffer_meters)
+
+
+def clip_area_from_file(file_path: str, buffer_meters: float = 0) -> BaseGeometry:
+    """
+    Create a clip area from the (multi)polygons of a vector file, e.g. a GeoJSON
+    or a GeoPackage. The file needs to have a CRS.
+    """
+    area_gdf = gpd.read_file(file_path)
+    if area_gdf.empty:
+        raise ValueError(f"No geometries found in clip area file {file_path}.")
+    return buffer_in_meters(area_gdf, buffer_meters)
+
+
+def clip_area_from_points(
+    points_gdfs: list[gpd.GeoDataFrame], buffer_meters: float
+) -> BaseGeometry:
+    """
+    Create a clip area from the extent of point layers, e.g. the routing origins
+    and destinations. The buffer should be large enough for the routes between
+    the points, which can detour outside the extent.
+    """
+    points_gdf = pd.concat([gdf.to_crs(WGS84_CRS) for gdf in points_gdfs])
+    if not buffer_meters:
+        return clip_area_from_bbox(tuple(points_gdf.total_bounds))
+    # the extent is buffered as a geometry, as it is a point or a line
+    # if all the points share a latitude or a longitude, e.g. a single point
+    extent_gdf = gpd.GeoDataFrame(
+        geometry=[box(*points_gdf.total_bounds)], crs=WGS84_CRS
+    )
+    return buffer_in_meters(extent_gdf, buffer_meters)
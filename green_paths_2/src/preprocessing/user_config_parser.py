@@ -1,9 +1,15 @@
 """ Parse user configuration file. """
 
 import os
+import osmium
 import yaml
-from ..config import DEFAULT_CONFIGURATION_VALUES
+from ..config import (
+    DEFAULT_CONFIGURATION_VALUES,
+    SEGMENT_SAMPLING_METHODS,
+    VECTOR_OVERLAY_SAMPLING_METHOD,
+)
 from ..data_utilities import determine_file_type
+from .raster_operations import is_valid_segment_statistic
 from .spatial_operations import crs_uses_meters
 from ..logging import setup_logger, LoggerColors
 from ..green_paths_exceptions import (
@@ -181,6 +187,18 @@ class UserConfig:
                 "Invalid datas coverage safety percentage in analysing parameters. Should be float or integer."
             )
 
+        for workers_key, workers_name in [
+            (DataSourceModel.PreprocessingWorkers.value, "preprocessing workers"),
+            (DataSourceModel.RasterSamplingWorkers.value, "raster sampling workers"),
+        ]:
+            workers = config.get("project").get(workers_key)
+            if workers is not None and (
+                not isinstance(workers, int) or isinstance(workers, bool) or workers < 1
+            ):
+                self.errors.append(
+                    f"Invalid {workers_name} in project. Should be a positive integer."
+                )
+
     def _validate_osm_pbf_network_file(self, config: dict) -> None:
         """
         Validate osm_pdb_path from the given configuration.
@@ -205,8 +223,74 @@ class UserConfig:
             self.errors.append(
                 f"Invalid osm_pdb_path in data config file. Should be X.osm.pbf Path was {osm_pbf_path}"
             )
+        self._validate_osm_network_clip_area(config.get("osm_network"))
+
+        node_location_index = config.get("osm_network").get(
+            DataSourceModel.NodeLocationIndex.value
+        )
+        if (
+            node_location_index is not None
+            and node_location_index not in osmium.index.map_types()
+        ):
+            self.errors.append(
+                f"Invalid node_location_index in osm_network. Should be one of {osmium.index.map_types()}. Was {node_location_index}"
+            )
         LOG.info("OSM PBF configurations validated.")
 
+    def _validate_osm_network_clip_area(self, osm_network_config: dict) -> None:
+        """
+        Validate the optional clip area configurations of the osm network.
+
+        :param osm_network_config: The osm_network group of the configuration.
+        """
+        clip_bbox = osm_network_config.get(DataSourceModel.ClipBbox.value)
+        clip_polygon_file_path = osm_network_config.get(
+            DataSourceModel.ClipPolygonFilePath.value
+        )
+        clip_to_od_extent = osm_network_config.get(DataSourceModel.ClipToODExtent.value)
+        clip_buffer_meters = osm_network_config.get(
+            DataSourceModel.ClipBufferMeters.value
+        )
+
+        clip_options = [clip_bbox, clip_polygon_file_path, clip_to_od_extent]
+        if sum(bool(clip_option) for clip_option in clip_options) > 1:
+            self.errors.append(
+                "Give only one of clip_bbox, clip_polygon_file_path and clip_to_od_extent in osm_network."
+            )
+
+        if clip_bbox is not None:
+            if (
+                not isinstance(clip_bbox, list)
+                or len(clip_bbox) != 4
+                or not all(isinstance(value, (int, float)) for value in clip_bbox)
+            ):
+                self.errors.append(
+                    f"Invalid clip_bbox in osm_network. Should be a list of 4 numbers: [min_lon, min_lat, max_lon, max_lat]. Was {clip_bbox}"
+                )
+            elif clip_bbox[0] >= clip_bbox[2] or clip_bbox[1] >= clip_bbox[3]:
+                self.errors.append(
+                    f"Invalid clip_bbox in osm_network. Minimums should be smaller than maximums: [min_lon, min_lat, max_lon, max_lat]. Was {clip_bbox}"
+                )
+
+        if clip_polygon_file_path is not None and not os.path.exists(
+            clip_polygon_file_path
+        ):
+            self.errors.append(
+                f"Didn't find clip polygon file from path {clip_polygon_file_path}"
+            )
+
+        if clip_to_od_extent is not None and not isinstance(clip_to_od_extent, bool):
+            self.errors.append(
+                "Invalid clip_to_od_extent in osm_network. Should be True or False."
+            )
+
+        if clip_buffer_meters is not None and (
+            not isinstance(clip_buffer_meters, (int, float)) or clip_buffer_meters < 0
+        ):
+            self.errors.append(
+                "Invalid clip_buffer_meters in osm_network. Should be a positive number."
+            )
+
     def _validate_crs(self, config: dict) -> None:
         """
         Parse crs from the given configuration.
@@ -263,6 +347,13 @@ class UserConfig:
             original_crs = data.get(DataSourceModel.Originalcrs.value)
             columns_of_interest = data.get(DataSourceModel.Columnsofinterest.value)
             save_raster_file = data.get(DataSourceModel.Saverasterfile.value)
+            segment_statistics = data.get(DataSourceModel.SegmentStatistics.value)
+            segment_sampling_method = data.get(
+                DataSourceModel.SegmentSamplingMethod.value
+            )
+            raster_bands = data.get(DataSourceModel.RasterBands.value)
+            raster_variables = data.get(DataSourceModel.RasterVariables.value)
+            custom_processing_function = data.get("custom_processing_function")
 
             # see if given dataType is what expected
             determined_data_type = determine_file_type(filepath)
@@ -382,6 +473,63 @@ class UserConfig:
                     "Invalid save raster file configuration. Should be boolean. This optional attribute can be left empty. If provided, it should be boolean."
                 )
 
+            # segment statistics, optional
+            if segment_statistics and (
+                not isinstance(segment_statistics, list)
+                or not all(
+                    is_valid_segment_statistic(statistic)
+                    for statistic in segment_statistics
+                )
+            ):
+                self.errors.append(
+                    "Invalid segment statistics configuration. Should be list of statistics: mean, min, max, median, nodata_share or percentiles p0...p100 (e.g. p90). This optional attribute can be left empty."
+                )
+
+            # segment sampling method, optional
+            if (
+                segment_sampling_method
+                and segment_sampling_method not in SEGMENT_SAMPLING_METHODS
+            ):
+                self.errors.append(
+                    f"Invalid segment sampling method configuration. Should be one of {SEGMENT_SAMPLING_METHODS}. This optional attribute can be left empty."
+                )
+            if (
+                segment_sampling_method == VECTOR_OVERLAY_SAMPLING_METHOD
+                and data_type != DataTypes.Vector.value
+            ):
+                self.errors.append(
+                    f"Segment sampling method {VECTOR_OVERLAY_SAMPLING_METHOD} can only be used with vector data."
+                )
+
+            # raster bands and variables, optional and only for raster data
+            if raster_bands and (
+                not isinstance(raster_bands, list)
+                or not all(
+                    isinstance(band, int) and not isinstance(band, bool) and band > 0
+                    for band in raster_bands
+                )
+            ):
+                self.errors.append(
+                    "Invalid raster bands configuration. Should be list of band numbers (integers, starting from 1). This optional attribute can be left empty."
+                )
+            if raster_variables and (
+                not isinstance(raster_variables, list)
+                or not all(isinstance(variable, str) for variable in raster_variables)
+            ):
+                self.errors.append(
+                    "Invalid raster variables configuration. Should be list of variable names (strings). This optional attribute can be left empty."
+                )
+            if (
+                raster_bands or raster_variables
+            ) and data_type != DataTypes.Raster.value:
+                self.errors.append(
+                    "Raster bands and raster variables can only be configured for raster data."
+                )
+            if raster_variables and custom_processing_function:
+                self.errors.append(
+                    "Raster variables are sampled directly from the raster file, they cannot be used with a custom processing function."
+                )
+
         LOG.info("Data sources configurations validated.")
 
     def _validate_routing_config(self, config: dict) -> None:
@@ -0,0 +1,160 @@
+""" Direct overlay of the network segments with vector data, without rasterizing the data. """
+
+import numpy as np
+import shapely
+
+from ..config import VECTOR_OVERLAY_LENGTH_TOLERANCE
+from ..logging import setup_logger, LoggerColors
+from ..timer import time_logger
+from .raster_operations import aggregate_values_to_segments
+
+LOG = setup_logger(__name__, LoggerColors.BLUE.value)
+
+
+# The segments are intersected with the data geometries found for them with
+# one bulk STRtree query. Each intersecting (segment, feature) pair is a
+# piece of the segment with the feature's value, weighted by the length of
+# the intersection, and the uncovered length of the segment is a piece
+# without data. The pieces are packed by segment like sampling points, so the
+# same (length weighted) segment statistics apply as in the line overlay.
+# Overlapping features all count with their own intersection lengths.
+
+
+def get_overlay_feature_geometries(
+    geometries: np.ndarray,
+    data_buffer: float = None,
+    raster_cell_resolution: float = None,
+) -> np.ndarray:
+    """
+    Get the data geometries to intersect the segments with. All the geometries
+    are buffered with data_buffer if given. Otherwise only points and lines,
+    which have no area to intersect with, are buffered with half of the raster
+    cell resolution, the distance within which rasterizing them covers a segment.
+
+    Parameters:
+    - geometries: The data geometries.
+    - data_buffer: The configured buffer of the data source.
+    - raster_cell_resolution: The configured raster cell resolution of the data source.
+
+    Returns:
+    - The geometries for the overlay.
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    if data_buffer:
+        return shapely.buffer(geometries, data_buffer)
+    has_no_area = shapely.get_dimensions(geometries) < 2
+    if not has_no_area.any() or not raster_cell_resolution:
+        return geometries
+    LOG.info(
+        f"Buffering {has_no_area.sum()} point and line geometries with {raster_cell_resolution / 2}m for the overlay."
+    )
+    geometries = geometries.copy()
+    geometries[has_no_area] = shapely.buffer(
+        geometries[has_no_area], raster_cell_resolution / 2
+    )
+    return geometries
+
+
+@time_logger
+def get_segment_feature_pieces(
+    segment_geometries: np.ndarray, feature_geometries: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Intersect the segments with the features, for all the segments at once.
+
+    Parameters:
+    - segment_geometries: The segment geometries.
+    - feature_geometries: The data geometries, in the same CRS as the segments.
+
+    Returns:
+    - The segment index of each piece, in increasing order.
+    - The feature index of each piece.
+    - The length of each piece.
+    """
+    tree = shapely.STRtree(feature_geometries)
+    segment_indices, feature_indices = tree.query(
+        segment_geometries, predicate="intersects"
+    )
+    order = np.lexsort((feature_indices, segment_indices))
+    segment_indices = segment_indices[order]
+    feature_indices = feature_indices[order]
+    lengths = shapely.length(
+        shapely.intersection(
+            segment_geometries[segment_indices], feature_geometries[feature_indices]
+        )
+    )
+    # segments only touching a feature have no length in it
+    has_length = lengths > 0
+    return (
+        segment_indices[has_length],
+        feature_indices[has_length],
+        lengths[has_length],
+    )
+
+
+@time_logger
+def calculate_segment_vector_overlay_values(
+    osm_ids: np.ndarray,
+    segment_geometries: np.ndarray,
+    feature_geometries: np.ndarray,
+    feature_values: np.ndarray,
+    null_value: float = None,
+    segment_statistics: list[str] = None,
+) -> dict[str, dict]:
+    """
+    Calculate the values of the segments from the vector data features they
+    intersect, weighted by the length of the segment in each feature.
+
+    Parameters:
+    - osm_ids: The osm ids of the segments.
+    - segment_geometries: The segment geometries.
+    - feature_geometries: The data geometries, see get_overlay_feature_geometries.
+    - feature_values: The data value of each feature.
+    - null_value: The null value used in the data.
+    - segment_statistics: Statistics to calculate in addition to the default sampling strategy.
+
+    Returns:
+    - A dictionary of the statistics, each containing the values for each road segment.
+    """
+    segment_geometries = np.asarray(segment_geometries, dtype=object)
+    feature_geometries = np.asarray(feature_geometries, dtype=object)
+    segment_count = len(segment_geometries)
+    segment_indices, feature_indices, lengths = get_segment_feature_pieces(
+        segment_geometries, feature_geometries
+    )
+
+    # the uncovered length of each segment is a piece without data
+    covered_lengths = np.bincount(
+        segment_indices, weights=lengths, minlength=segment_count
+    )
+    uncovered_lengths = np.maximum(
+        shapely.length(segment_geometries) - covered_lengths, 0
+    )
+    uncovered_segments = np.flatnonzero(
+        uncovered_lengths > VECTOR_OVERLAY_LENGTH_TOLERANCE
+    )
+
+    piece_segment_indices = np.concatenate((segment_indices, uncovered_segments))
+    order = np.argsort(piece_segment_indices, kind="stable")
+    values = np.concatenate(
+        (
+            np.asarray(feature_values, dtype=np.float64)[feature_indices],
+            np.full(len(uncovered_segments), np.nan),
+        )
+    )[order]
+    weights = np.concatenate((lengths, uncovered_lengths[uncovered_segments]))[order]
+    offsets = np.concatenate(
+        ([0], np.cumsum(np.bincount(piece_segment_indices, minlength=segment_count)))
+    )
+    LOG.info(
+        f"Intersected {segment_count} segments with {len(feature_geometries)} features into {len(lengths)} pieces."
+    )
+    return aggregate_values_to_segments(
+        np.asarray(osm_ids),
+        offsets,
+        values,
+        np.ones(len(values), dtype=bool),
+        null_value,
+        segment_statistics,
+        weights,
+    )
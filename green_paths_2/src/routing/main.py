@@ -49,6 +49,7 @@ from ..timer import time_logger
 from ..data_utilities import (
     convert_gdf_to_dict,
 )
+from ..osm_network_controller import get_osm_network_clip_area
 from ..preprocessing.user_config_parser import UserConfig
 from ..preprocessing.user_data_handler import UserDataHandler
 from ..routing.router_controller import (
@@ -209,6 +210,7 @@ def handle_routing_and_saving_processes(
 def routing_pipeline(
     data_handler: UserDataHandler,
     user_config: UserConfig,
+    normalized_exposures_dict: dict = None,
 ):
     """
     Run the routing pipeline.
@@ -219,6 +221,9 @@ def routing_pipeline(
         The UserDataHandler object.
     user_config : UserConfig
         The UserConfig object.
+    normalized_exposures_dict : dict, optional
+        The normalized exposures exported from the segment store of the preprocessing,
+        by default read from the db.
 
     Returns:
     ----------
@@ -240,14 +245,16 @@ def routing_pipeline(
 
         # validate segmented osm network path
         osm_segmented_network_path = validate_segmented_osm_network_path(
-            user_config.osm_network.osm_pbf_file_path
+            user_config.osm_network.osm_pbf_file_path,
+            get_osm_network_clip_area(user_config),
         )
 
-        # get exposure values
-        normalized_exposures_dict = get_exposures_from_db(
-            db_handler,
-            data_handler,
-        )
+        # get exposure values, if not given from the preprocessing
+        if normalized_exposures_dict is None:
+            normalized_exposures_dict = get_exposures_from_db(
+                db_handler,
+                data_handler,
+            )
 
         # TODO: maybe need to add a filtering for None exposures
 
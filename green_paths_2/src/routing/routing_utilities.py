@@ -6,6 +6,7 @@ import numpy as np
 import pandas as pd
 import geopandas as gpd
 from shapely.geometry import Point
+from shapely.geometry.base import BaseGeometry
 
 from ..config import (
     NORMALIZED_DATA_SUFFIX,
@@ -14,6 +15,10 @@ from ..config import (
 from ..data_utilities import construct_osm_segmented_network_name
 from ..green_paths_exceptions import R5pyError
 from ..preprocessing.data_types import DataSourceModel
+from ..preprocessing.segmented_network_cache import (
+    get_segmentation_parameters,
+    get_segmentation_variant,
+)
 from ..preprocessing.user_config_parser import UserConfig
 
 from ..logging import setup_logger, LoggerColors
@@ -86,7 +91,9 @@ def get_normalized_data_source_names(data_source_names: list[str]) -> list[str]:
     ]
 
 
-def validate_segmented_osm_network_path(osm_segmented_network_path: str) -> str:
+def validate_segmented_osm_network_path(
+    osm_segmented_network_path: str, clip_area: BaseGeometry = None
+) -> str:
     """
     Check if segmented OSM network exists
 
@@ -94,6 +101,8 @@ def validate_segmented_osm_network_path(osm_segmented_network_path: str) -> str:
     ----------
     osm_segmented_network_path : str
         Path to the OSM segmented network.
+    clip_area : BaseGeometry, optional
+        The study area the network was clipped to at segmentation, by default not clipped.
 
     Returns
     -------
@@ -105,8 +114,10 @@ def validate_segmented_osm_network_path(osm_segmented_network_path: str) -> str:
     FileNotFoundError
         If segmented OSM network is not found.
     """
+    # the clipped networks are cached with a variant key in the name
     osm_segmented_network_path = construct_osm_segmented_network_name(
-        osm_segmented_network_path
+        osm_segmented_network_path,
+        get_segmentation_variant(get_segmentation_parameters(clip_area=clip_area)),
     )
     if not os.path.exists(osm_segmented_network_path):
         raise FileNotFoundError(
@@ -1,5 +1,8 @@
 """ Store for segment values. """
 
+from typing import Iterator
+
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 from .config import (
@@ -9,6 +12,8 @@ from .config import (
     NORMALIZED_DATA_SUFFIX,
     OSM_ID_KEY,
     RASTER_NO_DATA_VALUE,
+    SEGMENT_POINTS_DEFAULT_SAMPLING_STRATEGY,
+    SEGMENT_STORE_EXPORT_CHUNK_SIZE,
     SEGMENT_VALUES_ROUND_DECIMALS,
 )
 
@@ -18,25 +23,70 @@ from .green_paths_exceptions import (
 )
 from .logging import setup_logger, LoggerColors
 from .preprocessing.data_source import DataSource
+from .preprocessing.spatial_operations import convert_geometry_array_to_wkt
 
 
 LOG = setup_logger(__name__, LoggerColors.RED.value)
 
 
+# The store is columnar: the osm_ids of the segments are kept sorted in an
+# int64 array, and the values of each data (data source, statistic or
+# normalized values) in a float column aligned with the osm_ids, with NaN for
+# the missing values. The geometries and lengths of the segments are columns
+# too, once combined from the network. The segment values are merged, validated
+# and normalized column by column, and exported to the db in rows of python
+# values, with None for the missing values.
+
+
+def _to_python_values(column: np.ndarray) -> list:
+    """Convert a column to a list of python values, None for NaN."""
+    values = column.astype(object)
+    if column.dtype.kind == "f":
+        values[np.isnan(column)] = None
+    return values.tolist()
+
+
+def _expand_column(
+    column: np.ndarray, positions: np.ndarray, length: int, fill_value
+) -> np.ndarray:
+    """Expand a column to the given length, moving its values to the positions."""
+    expanded_column = np.full(length, fill_value, dtype=column.dtype)
+    expanded_column[positions] = column
+    return expanded_column
+
+
 class SegmentValueStore:
 
     def __init__(self):
-        self.master_segment_store: dict[str, dict[str, float]] = {}
+        self.osm_ids: np.ndarray = np.empty(0, dtype=np.int64)
+        self.data_columns: dict[str, np.ndarray] = {}
+        self.geometries: np.ndarray | None = None
+        self.lengths: np.ndarray | None = None
         self.master_segment_gdf: gpd.GeoDataFrame = gpd.GeoDataFrame()
 
-    def get_store(self) -> dict[str, dict[str, float]]:
-        return self.master_segment_store
+    def __len__(self) -> int:
+        return len(self.osm_ids)
 
-    def set_store(self, master_segment_store: dict[str, dict[str, float]]):
-        self.master_segment_store = master_segment_store
+    def get_store(self) -> dict[int, dict[str, float]]:
+        """
+        Get the store as a dictionary of the values of each segment by OSM ID.
+        The dictionaries of all the segments are built, so for big networks
+        prefer the columns, get_segment_values or iterate_db_rows.
+        """
+        column_values = self._get_column_values()
+        return {
+            osm_id: dict(zip(column_values, values))
+            for osm_id, values in zip(
+                self.osm_ids.tolist(), zip(*column_values.values())
+            )
+        }
 
     def get_all_store_data_keys(self) -> list[str]:
-        return list(self.master_segment_store.values())[0].keys()
+        return list(self.data_columns)
+
+    def get_data_column(self, data_name: str) -> np.ndarray | None:
+        """Get the values of the data aligned with the OSM IDs, NaN for the missing values."""
+        return self.data_columns.get(data_name)
 
     def get_master_segment_gdf(self) -> gpd.GeoDataFrame:
         return self.master_segment_gdf
@@ -44,11 +94,51 @@ class SegmentValueStore:
     def set_master_segment_gdf(self, master_segment_gdf: gpd.GeoDataFrame):
         self.master_segment_gdf = master_segment_gdf
 
+    def _get_column_values(
+        self, start: int = 0, stop: int = None, wkt_geometries: bool = False
+    ) -> dict[str, list]:
+        """
+        Get the values of the segments from start to stop as python values of each column.
+        The OSM IDs, geometries and lengths are included once they are combined to the store.
+        """
+        column_values = {
+            data_name: _to_python_values(column[start:stop])
+            for data_name, column in self.data_columns.items()
+        }
+        if self.geometries is not None:
+            geometries = self.geometries[start:stop]
+            column_values[OSM_ID_KEY] = self.osm_ids[start:stop].tolist()
+            column_values[GEOMETRY_KEY] = (
+                convert_geometry_array_to_wkt(geometries)
+                if wkt_geometries
+                else geometries
+            ).tolist()
+            column_values[LENGTH_KEY] = _to_python_values(self.lengths[start:stop])
+        return column_values
+
+    def _find_segment(self, osm_id: str | int) -> int | None:
+        """Get the index of the segment in the columns, None if not found."""
+        osm_id = int(osm_id)
+        index = int(np.searchsorted(self.osm_ids, osm_id))
+        if index < len(self.osm_ids) and self.osm_ids[index] == osm_id:
+            return index
+        return None
+
+    def _get_segment(self, osm_id: str | int) -> dict[str, float] | bool:
+        """Get the values of a segment, False if not found."""
+        index = self._find_segment(osm_id)
+        if index is None:
+            return False
+        return {
+            key: values[0]
+            for key, values in self._get_column_values(index, index + 1).items()
+        }
+
     def get_segment_values(
         self, segment_osmids: str | int | list[str | int], drop_osm_id: bool = False
     ) -> dict[str, float | bool]:
         """
-        Get exposure values for a single segment or multiple segments using the .get() method.
+        Get exposure values for a single segment or multiple segments.
 
         Parameters:
         - segment_osmids: OSM ID of the segment or a list of OSM IDs.
@@ -58,28 +148,21 @@ class SegmentValueStore:
         If a segment ID is not found, returns False for that ID.
         """
         if isinstance(segment_osmids, list):
-            return {
-                str(osm_id): self.master_segment_store.get(int(osm_id), False)
-                for osm_id in segment_osmids
-            }
+            return {str(osm_id): self._get_segment(osm_id) for osm_id in segment_osmids}
         else:
             if drop_osm_id:
-                return self.master_segment_store.get(int(segment_osmids), False)
+                return self._get_segment(segment_osmids)
             else:
-                return {
-                    str(segment_osmids): self.master_segment_store.get(
-                        int(segment_osmids), False
-                    )
-                }
+                return {str(segment_osmids): self._get_segment(segment_osmids)}
 
-    def get_all_segment_osmids(self) -> list[str]:
+    def get_all_segment_osmids(self) -> list[int]:
         """
         Get all segments from master segment store.
 
         Returns:
         - List of segment OSM IDs.
         """
-        return list(self.master_segment_store.keys())
+        return self.osm_ids.tolist()
 
     def remove_all_rows_without_exposure_data(
         self, segment_store_gdf: gpd.GeoDataFrame
@@ -97,27 +180,20 @@ class SegmentValueStore:
         self,
         osm_network_gdf: gpd.GeoDataFrame,
     ) -> None:
-        """Add geometries to segment store from OSM network GeoDataFrame."""
+        """Add geometries and lengths to segment store from OSM network GeoDataFrame."""
         LOG.info("Combining exposures to geometries to master_segment_gdf.")
-        try:
-            exposure_dict = self.get_store()
-            # set network_gdf index to osm_id
-            osm_network_gdf = osm_network_gdf.set_index(OSM_ID_KEY)
-            for osm_id, _ in exposure_dict.items():
-                # set value "osm_id" to the exposure_dict with the key osm_id
-                exposure_dict[osm_id][OSM_ID_KEY] = osm_id
-                # set value "geometry" to the exposure_dict with the key osm_id
-                exposure_dict[osm_id][GEOMETRY_KEY] = osm_network_gdf.loc[
-                    osm_id, GEOMETRY_KEY
-                ]
-                exposure_dict[osm_id][LENGTH_KEY] = osm_network_gdf.loc[
-                    osm_id, LENGTH_KEY
-                ]
-
-            self.set_store(exposure_dict)
-        except SegmentValueStoreError as e:
-            LOG.error(f"Error combining exposures to geometries: {e}")
-            return False
+        osm_network_gdf = osm_network_gdf.set_index(OSM_ID_KEY)
+        network_indices = osm_network_gdf.index.get_indexer(self.osm_ids)
+        if np.any(network_indices < 0):
+            raise SegmentValueStoreError(
+                f"{np.count_nonzero(network_indices < 0)} segments of the segment store not found in the OSM network."
+            )
+        self.geometries = np.asarray(
+            osm_network_gdf[GEOMETRY_KEY].values, dtype=object
+        )[network_indices]
+        self.lengths = osm_network_gdf[LENGTH_KEY].to_numpy(dtype=np.float64)[
+            network_indices
+        ]
 
     def validate_data_coverage(
         self,
@@ -127,14 +203,10 @@ class SegmentValueStore:
     ) -> None:
         """Validate that the data covers the entire network."""
         for data_name, _ in data_sources.items():
-            data_items_found = len(self.master_segment_store)
-            # loop through the master segment store and check if the data is found by data_name as key in datasource items
-            # get the length of the data found
-            data_found_count = 0
-            for _, data in self.master_segment_store.items():
-                if data_name in data.keys():
-                    if data[data_name] is not None:
-                        data_found_count += 1
+            column = self.data_columns.get(data_name)
+            data_found_count = (
+                0 if column is None else int(np.count_nonzero(~np.isnan(column)))
+            )
 
             data_coverage_percentage = round(
                 (data_found_count / osm_network_segment_count) * 100, 2
@@ -153,7 +225,7 @@ class SegmentValueStore:
                     f"Data coverage for {data_name} is: {data_coverage_percentage}%."
                 )
                 LOG.error(
-                    f"Safety limit is needed that we can be sure that the GP2 routes are actually using exposure datas."
+                    "Safety limit is needed that we can be sure that the GP2 routes are actually using exposure datas."
                 )
                 LOG.error(
                     f"Modify the safety limit if needed in the user configurations. The default from GP2 config is {DATA_COVERAGE_SAFETY_PERCENTAGE}"
@@ -164,34 +236,23 @@ class SegmentValueStore:
 
     def validate_user_min_max_values(self, data_sources: list[DataSource]) -> None:
         """Validate user-defined min and max values. If some values are not in range, print a warning."""
-        values_not_in_range = []
-        data_values_not_in_range = []
-
         for data_key, data_source in data_sources.items():
-            for osm_id, data in self.master_segment_store.items():
-                if data_key in data:
-                    # Check if the value is None, and skip it if so
-                    if (
-                        data[data_key] is None
-                        or data[data_key] == RASTER_NO_DATA_VALUE
-                        or data[data_key] == float(RASTER_NO_DATA_VALUE)
-                    ):
-                        continue
-
-                    # Now compare the value with the min and max range
-                    if (
-                        data[data_key] < data_source.min_data_value
-                        or data[data_key] > data_source.max_data_value
-                    ):
-                        values_not_in_range.append(f"{osm_id}: {data[data_key]}")
-                        data_values_not_in_range.append(data[data_key])
-
-        if values_not_in_range:
-            LOG.warning(
-                f"WARNING: {len(values_not_in_range)} values are not within the user-defined min and max values for data {data_key}. "
-                f"Values not in range: max = {max(data_values_not_in_range)}, min = {min(data_values_not_in_range)}. "
-                f"They will be fitted to the user-defined min and max values."
-            )
+            column = self.data_columns.get(data_key)
+            if column is None:
+                continue
+            # skip the missing values, NaN is never out of range
+            values = column[column != RASTER_NO_DATA_VALUE]
+            data_values_not_in_range = values[
+                (values < data_source.min_data_value)
+                | (values > data_source.max_data_value)
+            ]
+
+            if len(data_values_not_in_range):
+                LOG.warning(
+                    f"WARNING: {len(data_values_not_in_range)} values are not within the user-defined min and max values for data {data_key}. "
+                    f"Values not in range: max = {data_values_not_in_range.max()}, min = {data_values_not_in_range.min()}. "
+                    f"They will be fitted to the user-defined min and max values."
+                )
 
     def save_normalized_values_to_store(self, data_sources) -> list[str]:
         """
@@ -212,7 +273,9 @@ class SegmentValueStore:
                 data_source.min_data_value,
                 data_source.max_data_value,
             )
-            self.save_segment_values(normalized_values, normalized_data_key)
+            self.save_segment_value_array(
+                self.osm_ids, normalized_values, normalized_data_key
+            )
             normalized_data_keys.append(normalized_data_key)
         return normalized_data_keys
 
@@ -222,7 +285,7 @@ class SegmentValueStore:
         data_good_exposure: bool,
         min_data_value: float | int,
         max_data_value: float | int,
-    ) -> dict[str, float]:
+    ) -> np.ndarray:
         """
         Calculate normalised values for each segment.
 
@@ -237,43 +300,28 @@ class SegmentValueStore:
 
 
         Returns:
-        - Dictionary with the OSM IDs as keys and the normalised values as values.
+        - The normalised values aligned with the OSM IDs of the store.
+          Segments without data have the value 0, all NaN if the data is not in the store.
         """
-        normalized_values = {}
-
-        # Iterate through each segment in the master segment store
-        for osm_id, data in self.master_segment_store.items():
-            if data_key in data:
-
-                # testing setting none
-                if data[data_key] is None:
-                    normalized_values[osm_id] = 0
-                    continue
-
-                # make sure that the data is within the min and max values
-                if data[data_key] < min_data_value:
-                    exposure_data = min_data_value
-                elif data[data_key] > max_data_value:
-                    exposure_data = max_data_value
-                else:
-                    exposure_data = data[data_key]
-
-                # Calculate the normalized value, use min-max formula
-                normalized_value = (exposure_data - min_data_value) / (
-                    max_data_value - min_data_value
-                )
+        column = self.data_columns.get(data_key)
+        if column is None:
+            return np.full(len(self.osm_ids), np.nan)
 
-                # Ensure the normalized value is within 0-1
-                normalized_value = max(0, min(normalized_value, 1))
+        # make sure that the data is within the min and max values
+        exposure_data = np.clip(column, min_data_value, max_data_value)
 
-                if data_good_exposure:
-                    normalized_value = -normalized_value
+        # Calculate the normalized value, use min-max formula, within 0-1
+        normalized_values = np.clip(
+            (exposure_data - min_data_value) / (max_data_value - min_data_value), 0, 1
+        )
 
-                # Round and store to store
-                normalized_values[osm_id] = round(
-                    normalized_value, SEGMENT_VALUES_ROUND_DECIMALS
-                )
+        if data_good_exposure:
+            normalized_values = -normalized_values
+
+        normalized_values = np.round(normalized_values, SEGMENT_VALUES_ROUND_DECIMALS)
 
+        # segments without data do not change the traversing cost
+        normalized_values[np.isnan(column)] = 0
         return normalized_values
 
     def convert_segment_store_to_gdf(self) -> None:
@@ -283,57 +331,163 @@ class SegmentValueStore:
         Returns:
         - GeoDataFrame with segment geometries and values.
         """
-        try:
-            segment_store = self.get_store()
-            # Convert segment store to DataFrame
-            df = pd.DataFrame.from_dict(segment_store, orient="index")
-            # handle geometry if gdf has geometry
-            if "geometry" in df.columns:
-                # Convert geometry column to GeoSeries
-                geometries = gpd.GeoSeries(df.pop("geometry"))
-                # Convert DataFrame to GeoDataFrame
-                gdf = gpd.GeoDataFrame(df, geometry=geometries)
-            else:
-                gdf = gpd.GeoDataFrame(df)
-            self.set_master_segment_gdf(gdf)
-        except SegmentValueStoreError as e:
-            LOG.error(f"Error converting segment store to GeoDataFrame: {e}")
+        df = pd.DataFrame(self.data_columns, index=self.osm_ids)
+        # handle geometry if the store has geometries
+        if self.geometries is not None:
+            df[OSM_ID_KEY] = self.osm_ids
+            df[LENGTH_KEY] = self.lengths
+            gdf = gpd.GeoDataFrame(
+                df, geometry=gpd.GeoSeries(self.geometries, index=df.index)
+            )
+        else:
+            gdf = gpd.GeoDataFrame(df)
+        self.set_master_segment_gdf(gdf)
+
+    def get_db_table_structure(self) -> dict[str, float | int | str]:
+        """
+        Get a row of the store's db table with a value of the type of each column,
+        for creating the table with create_table_from_dict_data.
+        """
+        table_structure = {data_name: 0.0 for data_name in self.data_columns}
+        if self.geometries is not None:
+            table_structure.update({OSM_ID_KEY: 0, GEOMETRY_KEY: "", LENGTH_KEY: 0.0})
+        return table_structure
+
+    def iterate_db_rows(
+        self, chunk_size: int = SEGMENT_STORE_EXPORT_CHUNK_SIZE
+    ) -> Iterator[tuple]:
+        """
+        Iterate the rows of the store's db table, in the order of the columns of
+        get_db_table_structure. The rows are converted from the columns chunk by
+        chunk, with the geometries as WKT and None for the missing values.
+        """
+        for start in range(0, len(self.osm_ids), chunk_size):
+            column_values = self._get_column_values(
+                start, start + chunk_size, wkt_geometries=True
+            )
+            yield from zip(*column_values.values())
+
+    def get_normalized_exposures(self, data_names: list[str]) -> dict[str, dict]:
+        """
+        Get the normalized values of the data for routing, in the same format as
+        get_normalized_exposures_from_db: a dictionary of OSM ID (as string) ->
+        normalized value of each normalized data name, without the missing values.
+
+        Parameters:
+        - data_names: The names of the data sources.
+
+        Returns:
+        - The normalized values by the normalized data names.
+        """
+        normalized_exposures = {}
+        osm_ids = self.osm_ids.astype(str)
+        for data_name in data_names:
+            normalized_data_name = f"{data_name}{NORMALIZED_DATA_SUFFIX}"
+            column = self.data_columns.get(normalized_data_name)
+            if column is None:
+                raise SegmentValueStoreError(
+                    f"Normalized values of {data_name} not found in the segment store."
+                )
+            has_value = ~np.isnan(column)
+            normalized_exposures[normalized_data_name] = dict(
+                zip(osm_ids[has_value].tolist(), column[has_value].tolist())
+            )
+        return normalized_exposures
+
+    def save_segment_statistics(
+        self,
+        data_segment_statistics: dict[str, dict],
+        data_name: str,
+        segment_statistics: list[str] = None,
+    ) -> None:
+        """
+        Save the segment statistics of a data source to the master segment store.
+        The default sampling strategy is saved as the data source's value (data_name),
+        and each of the requested statistics as its own {data_name}_{statistic} value.
+
+        Parameters:
+        - data_segment_statistics: The segment values of each statistic of the current data.
+        - data_name: The name of the data source.
+        - segment_statistics: The statistics requested for the data source.
+        """
+        self.save_segment_values(
+            data_segment_statistics[SEGMENT_POINTS_DEFAULT_SAMPLING_STRATEGY], data_name
+        )
+        for statistic in segment_statistics or []:
+            self.save_segment_values(
+                data_segment_statistics[statistic], f"{data_name}_{statistic}"
+            )
 
     def save_segment_values(self, data_segment_values: dict, data_name: str) -> None:
         """
         Merge segment values from current data to master segment values.
 
         Parameters:
-        - segment_values_current_data: The segment values from the current data.
+        - data_segment_values: The segment values from the current data by OSM ID, None if missing.
         - data_name: The name of the data source.
+        """
+        segment_count = len(data_segment_values)
+        osm_ids = np.fromiter(data_segment_values.keys(), np.int64, segment_count)
+        values = np.fromiter(
+            (
+                np.nan if value is None else value
+                for value in data_segment_values.values()
+            ),
+            np.float64,
+            segment_count,
+        )
+        self.save_segment_value_array(osm_ids, values, data_name)
+
+    def save_segment_value_array(
+        self, osm_ids: np.ndarray, values: np.ndarray, data_name: str
+    ) -> None:
+        """
+        Merge segment values from current data to master segment values.
+        Segments not in the store yet are added, with missing values for the other data.
+        The segments of the store not in the current data have missing values,
+        unless the data was already saved for them.
 
-        Returns:
-        - The updated master segment values dictionary.
+        Parameters:
+        - osm_ids: The unique OSM IDs of the segments of the current data.
+        - values: The segment values of the current data, NaN if missing.
+        - data_name: The name of the data source.
         """
-        default_values_set_count = 0
-        try:
-            master_store = self.master_segment_store.copy()
-            for osm_id, value in data_segment_values.items():
-                if osm_id not in master_store:
-                    master_store[osm_id] = {}
-                # If value exists, save it; otherwise, set it to 0
-                if value is not None:
-                    master_store[osm_id][data_name] = value
-                else:
-                    default_values_set_count += 1
-                    master_store[osm_id][data_name] = None
-
-            # After all osm_ids are processed, ensure all data sources are present
-            # all_data_names = self.get_all_data_names()  # Add a method to fetch all possible data names
-            for osm_id in master_store:
-                if data_name not in master_store[osm_id]:
-                    default_values_set_count += 1
-                    master_store[osm_id][data_name] = None
-
-            self.set_store(master_store)
-            LOG.info(
-                f"Replaced {default_values_set_count} missing values with None for {data_name}."
+        osm_ids = np.asarray(osm_ids, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        if len(osm_ids) != len(values):
+            raise SegmentValueStoreError(
+                f"Got {len(values)} values for {len(osm_ids)} segments for {data_name}."
             )
-
-        except SegmentValueStoreError as e:
-            LOG.error(f"Error saving segment values: {e}")
+        if len(np.unique(osm_ids)) != len(osm_ids):
+            raise SegmentValueStoreError(f"Duplicate segment OSM IDs for {data_name}.")
+
+        self._add_segments(osm_ids)
+        column = self.data_columns.get(data_name)
+        if column is None:
+            column = np.full(len(self.osm_ids), np.nan)
+        column[np.searchsorted(self.osm_ids, osm_ids)] = values
+        self.data_columns[data_name] = column
+
+        LOG.info(
+            f"Replaced {np.count_nonzero(np.isnan(column))} missing values with None for {data_name}."
+        )
+
+    def _add_segments(self, osm_ids: np.ndarray) -> None:
+        """Add the segments not in the store yet, expanding the columns with missing values."""
+        new_osm_ids = np.setdiff1d(osm_ids, self.osm_ids)
+        if not len(new_osm_ids):
+            return
+        all_osm_ids = np.union1d(self.osm_ids, new_osm_ids)
+        positions = np.searchsorted(all_osm_ids, self.osm_ids)
+        for data_name, column in self.data_columns.items():
+            self.data_columns[data_name] = _expand_column(
+                column, positions, len(all_osm_ids), np.nan
+            )
+        if self.geometries is not None:
+            self.geometries = _expand_column(
+                self.geometries, positions, len(all_osm_ids), None
+            )
+            self.lengths = _expand_column(
+                self.lengths, positions, len(all_osm_ids), np.nan
+            )
+        self.osm_ids = all_osm_ids
@@ -0,0 +1 @@
+"""Benchmarks for green_paths_2, run as modules e.g. python -m green_paths_2.tests.benchmarks.benchmark_osm_segmenter"""
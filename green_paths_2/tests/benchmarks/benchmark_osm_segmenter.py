@@ -0,0 +1,237 @@
+""" Benchmark the streaming OSM segmenter against the original three pass segmenter. """
+
+# run from the project root:
+# python -m green_paths_2.tests.benchmarks.benchmark_osm_segmenter
+# peak memory is read from /proc/self/status, so this runs only on linux
+
+import argparse
+import datetime
+import multiprocessing as mp
+import os
+import tempfile
+import time
+
+import osmium
+
+from ...src.config import (
+    DEFAULT_INTERSECTION_INDEX_BACKEND,
+    DEFAULT_SEGMENTATION_WAY_FILTER,
+)
+from ...src.preprocessing import osm_segmenter
+
+BENCHMARK_OSM_PBF_PATH = "green_paths_2/tests/data/osm/test_hki_centra.osm.pbf"
+
+
+# ORIGINAL IMPLEMENTATION (reads the source three times and buffers all segments)
+
+
+class LegacyNodeCopyHandler(osmium.SimpleHandler):
+    def __init__(self, writer):
+        super().__init__()
+        self.writer = writer
+
+    def node(self, n):
+        self.writer.add_node(n)
+
+
+class LegacyIntersectionCollector(osmium.SimpleHandler):
+    def __init__(self):
+        osmium.SimpleHandler.__init__(self)
+        self.node_refs = set()
+        self.intersection_nodes = set()
+
+    def way(self, w):
+        for node in w.nodes:
+            if node.ref in self.node_refs:
+                self.intersection_nodes.add(node.ref)
+            else:
+                self.node_refs.add(node.ref)
+
+
+class LegacySegmentCreator(osmium.SimpleHandler):
+    def __init__(self, intersection_nodes):
+        osmium.SimpleHandler.__init__(self)
+        self.intersection_nodes = intersection_nodes
+        self.segments = []
+
+    def way(self, w):
+        current_segment_nodes = []
+        for node in w.nodes:
+            current_segment_nodes.append(node.ref)
+            if node.ref in self.intersection_nodes:
+                if len(current_segment_nodes) > 1:
+                    tags_dict = {tag.k: tag.v for tag in w.tags}
+                    merged_tags = {**tags_dict, **{"parent_id": str(w.id)}}
+                    self.segments.append(
+                        {"nodes": current_segment_nodes.copy(), "tags": merged_tags}
+                    )
+                current_segment_nodes = [node.ref]
+
+        if len(current_segment_nodes) > 1:
+            tags_dict = {tag.k: tag.v for tag in w.tags}
+            merged_tags = {**tags_dict, **{"parent_id": str(w.id)}}
+            self.segments.append(
+                {"nodes": current_segment_nodes.copy(), "tags": merged_tags}
+            )
+
+
+def legacy_segment(osm_source_path: str, output_path: str) -> None:
+    writer = osmium.SimpleWriter(output_path)
+    LegacyNodeCopyHandler(writer).apply_file(osm_source_path)
+
+    collector = LegacyIntersectionCollector()
+    collector.apply_file(osm_source_path)
+
+    creator = LegacySegmentCreator(collector.intersection_nodes)
+    creator.apply_file(osm_source_path)
+
+    segment_id = -1
+    for segment in creator.segments:
+        segment["tags"]["gp2_osm_id"] = str(segment_id)
+        writer.add_way(
+            osmium.osm.mutable.Way(
+                id=segment_id,
+                version=1,
+                visible=True,
+                changeset=1,
+                timestamp=datetime.datetime.now(),
+                uid=1,
+                user="GreenPaths2",
+                tags=dict(segment["tags"]),
+                nodes=list(segment["nodes"]),
+            )
+        )
+        segment_id -= 1
+    writer.close()
+
+
+def streaming_segment(
+    osm_source_path: str,
+    output_path: str,
+    intersection_index_backend: str,
+    way_filter: dict = None,
+    workers: int = 1,
+) -> None:
+    osm_segmenter.construct_osm_segmented_network_name = lambda *_: output_path
+    osm_segmenter.segment_or_use_cache_osm_network(
+        osm_source_path,
+        intersection_index_backend=intersection_index_backend,
+        way_filter=way_filter,
+        workers=workers,
+    )
+
+
+# BENCHMARK RUNNER
+
+
+def _run_in_process(segment_function, args, results):
+    start_time = time.perf_counter()
+    segment_function(*args)
+    elapsed_time = time.perf_counter() - start_time
+    results.put((elapsed_time, read_peak_memory_mb()))
+
+
+def read_peak_memory_mb() -> float:
+    """Peak resident memory of this process (VmHWM, unlike ru_maxrss not inherited from the parent)."""
+    with open("/proc/self/status") as status_file:
+        for line in status_file:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def measure(segment_function, osm_source_path: str, output_path: str, *args) -> tuple:
+    """Run the segmentation in a fresh process to measure its own peak memory."""
+    # spawn so that the process does not inherit the memory of this process
+    spawn_context = mp.get_context("spawn")
+    results = spawn_context.Queue()
+    process = spawn_context.Process(
+        target=_run_in_process,
+        args=(segment_function, (osm_source_path, output_path, *args), results),
+    )
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"Benchmark run {segment_function.__name__} failed.")
+    elapsed_time, peak_memory_mb = results.get()
+    return elapsed_time, peak_memory_mb, os.path.getsize(output_path)
+
+
+def read_segments(osm_pbf_path: str) -> list[tuple]:
+    # segment ids differ between the legacy counter and the stable ids, compare without them
+    return [
+        (
+            tuple(node.ref for node in way.nodes),
+            {
+                key: value
+                for key, value in dict(way.tags).items()
+                if key != "gp2_osm_id"
+            },
+        )
+        for way in osmium.FileProcessor(osm_pbf_path, osmium.osm.WAY)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the OSM segmenter.")
+    parser.add_argument("-fp", "--filepath", default=BENCHMARK_OSM_PBF_PATH)
+    parser.add_argument(
+        "-w", "--workers", type=int, nargs="+", default=[2, 4, os.cpu_count()]
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        legacy_output = os.path.join(tmp_dir, "legacy_segmented.osm.pbf")
+        elapsed_time, peak_memory_mb, file_size = measure(
+            legacy_segment, args.filepath, legacy_output
+        )
+        print(
+            f"{'legacy (3 passes, buffered)':<40} time: {elapsed_time:7.2f}s  peak memory: {peak_memory_mb:8.1f}MB  output: {file_size / 1e6:.1f}MB"
+        )
+        legacy_segments = read_segments(legacy_output)
+
+        for backend in osm_segmenter.INTERSECTION_INDEX_BACKENDS:
+            streaming_output = os.path.join(tmp_dir, f"{backend}_segmented.osm.pbf")
+            elapsed_time, peak_memory_mb, file_size = measure(
+                streaming_segment, args.filepath, streaming_output, backend
+            )
+            identical = read_segments(streaming_output) == legacy_segments
+            print(
+                f"{f'streaming (2 passes, {backend} index)':<40} time: {elapsed_time:7.2f}s  peak memory: {peak_memory_mb:8.1f}MB  output: {file_size / 1e6:.1f}MB  identical: {identical}"
+            )
+
+        # the default routable highway filter, not comparable to the legacy output
+        routable_output = os.path.join(tmp_dir, "routable_segmented.osm.pbf")
+        elapsed_time, peak_memory_mb, file_size = measure(
+            streaming_segment,
+            args.filepath,
+            routable_output,
+            DEFAULT_INTERSECTION_INDEX_BACKEND,
+            DEFAULT_SEGMENTATION_WAY_FILTER,
+        )
+        print(
+            f"{'streaming (routable highways only)':<40} time: {elapsed_time:7.2f}s  peak memory: {peak_memory_mb:8.1f}MB  output: {file_size / 1e6:.1f}MB"
+        )
+        routable_segments = read_segments(routable_output)
+
+        # the second pass split by the source blocks, peak memory is the main process only
+        for workers in sorted(set(args.workers) - {1}):
+            parallel_output = os.path.join(
+                tmp_dir, f"routable_{workers}_workers_segmented.osm.pbf"
+            )
+            elapsed_time, peak_memory_mb, file_size = measure(
+                streaming_segment,
+                args.filepath,
+                parallel_output,
+                DEFAULT_INTERSECTION_INDEX_BACKEND,
+                DEFAULT_SEGMENTATION_WAY_FILTER,
+                workers,
+            )
+            identical = read_segments(parallel_output) == routable_segments
+            print(
+                f"{f'streaming (routable, {workers} workers)':<40} time: {elapsed_time:7.2f}s  peak memory: {peak_memory_mb:8.1f}MB  output: {file_size / 1e6:.1f}MB  identical: {identical}"
+            )
+
+
+if __name__ == "__main__":
+    main()
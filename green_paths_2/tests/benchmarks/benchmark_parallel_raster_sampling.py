@@ -0,0 +1,78 @@
+""" Benchmark the raster sampling with a pool of worker processes against sampling in one process. """
+
+# run from the project root:
+# python -m green_paths_2.tests.benchmarks.benchmark_parallel_raster_sampling
+
+import argparse
+import os
+import time
+
+import numpy as np
+from rasterio.transform import from_origin
+from shapely.geometry import LineString
+
+from ...src.preprocessing.raster_operations import calculate_segment_raster_values
+from ...src.preprocessing.sampling_points import generate_sampling_points
+
+
+def create_benchmark_segments(
+    segment_count: int, extent: float, rng: np.random.Generator
+) -> np.ndarray:
+    """Random segments of 3 vertices and up to a few hundred meters, inside the extent."""
+    starts = rng.uniform(0, extent, (segment_count, 1, 2))
+    steps = rng.normal(0, 100, (segment_count, 2, 2))
+    coordinates = np.clip(
+        np.concatenate((starts, starts + np.cumsum(steps, axis=1)), axis=1), 0, extent
+    )
+    return np.array([LineString(segment) for segment in coordinates])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the parallel raster sampling."
+    )
+    parser.add_argument("-s", "--segments", type=int, default=200_000)
+    parser.add_argument("-c", "--cells", type=int, default=8000)
+    parser.add_argument("-r", "--resolution", type=float, default=10)
+    parser.add_argument(
+        "-w", "--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count()]
+    )
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    extent = args.cells * args.resolution
+    raster = rng.uniform(0, 100, (args.cells, args.cells)).astype(np.float32)
+    transform = from_origin(0, extent, args.resolution, args.resolution)
+    geometries = create_benchmark_segments(args.segments, extent, rng)
+    sampling_points = generate_sampling_points(
+        np.arange(-1, -args.segments - 1, -1), geometries, args.resolution
+    )
+    print(
+        f"{args.segments} segments, {sampling_points.point_count} points, raster {args.cells} x {args.cells} cells ({raster.nbytes / 1024**2:.0f}MB), {os.cpu_count()} cores"
+    )
+
+    reference = None
+    for workers in sorted(set(args.workers)):
+        for name, segment_geometries in (
+            ("points", None),
+            ("line overlay", geometries),
+        ):
+            start_time = time.perf_counter()
+            segment_values = calculate_segment_raster_values(
+                sampling_points,
+                raster,
+                transform,
+                segment_statistics=["p90"],
+                segment_geometries=segment_geometries,
+                workers=workers,
+            )
+            elapsed_time = time.perf_counter() - start_time
+            if name == "points":
+                if reference is None:
+                    reference = segment_values
+                assert segment_values == reference
+            print(f"{name:<14} workers: {workers:3d}  time: {elapsed_time:7.3f}s")
+
+
+if __name__ == "__main__":
+    main()
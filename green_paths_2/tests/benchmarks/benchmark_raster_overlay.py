@@ -0,0 +1,107 @@
+""" Benchmark the line overlay against the point sampling of the segment raster values. """
+
+# run from the project root:
+# python -m green_paths_2.tests.benchmarks.benchmark_raster_overlay
+
+import argparse
+import time
+
+import numpy as np
+from rasterio.transform import from_origin
+
+from ...src.preprocessing.line_raster_overlay import get_segment_cell_pieces
+from ...src.preprocessing.osm_network_loader import load_osm_network
+from ...src.preprocessing.raster_operations import calculate_segment_raster_values
+from ...src.preprocessing.sampling_points import generate_sampling_points
+
+BENCHMARK_OSM_PBF_PATH = "green_paths_2/tests/data/osm/test_hki_centra.osm.pbf"
+BENCHMARK_CRS = 3067
+
+# the reference values are sampled with this many points per raster cell length
+REFERENCE_OVERSAMPLING = 50
+
+
+def create_benchmark_raster(
+    bounds: tuple[float, float, float, float], resolution: float
+) -> tuple[np.ndarray, object]:
+    """Random raster with both smooth variation and cell to cell noise over the bounds."""
+    min_x, min_y, max_x, max_y = bounds
+    width = int(np.ceil((max_x - min_x) / resolution)) + 2
+    height = int(np.ceil((max_y - min_y) / resolution)) + 2
+    rng = np.random.default_rng(0)
+    rows, cols = np.mgrid[0:height, 0:width]
+    raster = (
+        50
+        + 20 * np.sin(cols / 25) * np.cos(rows / 40)
+        + rng.normal(0, 10, (height, width))
+    ).astype(np.float32)
+    transform = from_origin(
+        min_x - resolution, max_y + resolution, resolution, resolution
+    )
+    return raster, transform
+
+
+def to_array(segment_values: dict) -> np.ndarray:
+    return np.array(
+        [np.nan if value is None else value for value in segment_values.values()]
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the raster overlay.")
+    parser.add_argument("-fp", "--filepath", default=BENCHMARK_OSM_PBF_PATH)
+    parser.add_argument("-r", "--resolution", type=float, default=10)
+    args = parser.parse_args()
+
+    network_gdf = load_osm_network(args.filepath).to_crs(BENCHMARK_CRS)
+    osm_ids = network_gdf["id"].to_numpy()
+    geometries = network_gdf.geometry.values
+    raster, transform = create_benchmark_raster(
+        network_gdf.total_bounds, args.resolution
+    )
+    print(
+        f"{len(network_gdf)} segments, {network_gdf.length.sum() / 1000:.0f}km, raster {raster.shape[1]} x {raster.shape[0]} cells of {args.resolution}m"
+    )
+
+    reference_points = generate_sampling_points(
+        osm_ids, geometries, args.resolution / REFERENCE_OVERSAMPLING
+    )
+    reference = to_array(
+        calculate_segment_raster_values(reference_points, raster, transform)["mean"]
+    )
+
+    def report(name: str, elapsed_time: float, point_count: int, values: np.ndarray):
+        errors = np.abs(values - reference)[~np.isnan(reference)]
+        print(
+            f"{name:<28} time: {elapsed_time:7.3f}s  points: {point_count:9d}  mean abs error: {np.nanmean(errors):.4f}  max abs error: {np.nanmax(errors):.4f}"
+        )
+
+    for oversampling in (1, 2, 4, 8):
+        start_time = time.perf_counter()
+        sampling_points = generate_sampling_points(
+            osm_ids, geometries, args.resolution / oversampling
+        )
+        values = to_array(
+            calculate_segment_raster_values(sampling_points, raster, transform)["mean"]
+        )
+        report(
+            f"points (x{oversampling} oversampling)",
+            time.perf_counter() - start_time,
+            sampling_points.point_count,
+            values,
+        )
+
+    # the line overlay uses the sampling points only for the osm ids
+    start_time = time.perf_counter()
+    values = to_array(
+        calculate_segment_raster_values(
+            sampling_points, raster, transform, segment_geometries=geometries
+        )["mean"]
+    )
+    elapsed_time = time.perf_counter() - start_time
+    pieces, _ = get_segment_cell_pieces(osm_ids, geometries, transform)
+    report("line overlay (cell pieces)", elapsed_time, pieces.point_count, values)
+
+
+if __name__ == "__main__":
+    main()
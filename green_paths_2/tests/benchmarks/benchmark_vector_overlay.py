@@ -0,0 +1,98 @@
+""" Benchmark the vector overlay against rasterizing the vector data. """
+
+# run from the project root:
+# python -m green_paths_2.tests.benchmarks.benchmark_vector_overlay
+
+import argparse
+import time
+
+import geopandas as gpd
+import numpy as np
+
+from ...src.config import RASTER_NO_DATA_VALUE
+from ...src.preprocessing.osm_network_loader import load_osm_network
+from ...src.preprocessing.raster_operations import (
+    rasterize_and_calculate_segment_values,
+)
+from ...src.preprocessing.sampling_points import generate_sampling_points
+from ...src.preprocessing.vector_overlay import (
+    calculate_segment_vector_overlay_values,
+    get_overlay_feature_geometries,
+)
+
+BENCHMARK_OSM_PBF_PATH = (
+    "green_paths_2/user/example_data/gp2_working_example_lintsi_pieni_segmented.osm.pbf"
+)
+BENCHMARK_VECTOR_PATH = (
+    "green_paths_2/user/example_data/gp2_working_example_greenery_road_data.gpkg"
+)
+BENCHMARK_DATA_COLUMN = "LU_GVI"
+BENCHMARK_CRS = 3067
+
+
+def to_array(segment_values: dict) -> np.ndarray:
+    return np.array(
+        [np.nan if value is None else value for value in segment_values.values()]
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the vector overlay.")
+    parser.add_argument("-fp", "--filepath", default=BENCHMARK_OSM_PBF_PATH)
+    parser.add_argument("-vp", "--vector_filepath", default=BENCHMARK_VECTOR_PATH)
+    parser.add_argument("-c", "--data_column", default=BENCHMARK_DATA_COLUMN)
+    parser.add_argument("-r", "--resolution", type=float, default=10)
+    args = parser.parse_args()
+
+    network_gdf = load_osm_network(args.filepath).to_crs(BENCHMARK_CRS)
+    osm_ids = network_gdf["id"].to_numpy()
+    geometries = network_gdf.geometry.values
+    vector_data_gdf = gpd.read_file(args.vector_filepath).to_crs(BENCHMARK_CRS)
+    print(
+        f"{len(network_gdf)} segments, {len(vector_data_gdf)} features, raster cells of {args.resolution}m"
+    )
+
+    start_time = time.perf_counter()
+    overlay_values = to_array(
+        calculate_segment_vector_overlay_values(
+            osm_ids,
+            geometries,
+            get_overlay_feature_geometries(
+                vector_data_gdf.geometry.values, raster_cell_resolution=args.resolution
+            ),
+            vector_data_gdf[args.data_column].to_numpy(),
+            RASTER_NO_DATA_VALUE,
+        )["mean"]
+    )
+    overlay_time = time.perf_counter() - start_time
+
+    def report(name: str, elapsed_time: float, values: np.ndarray):
+        both = ~np.isnan(values) & ~np.isnan(overlay_values)
+        print(
+            f"{name:<24} time: {elapsed_time:7.3f}s  segments with value: {(~np.isnan(values)).sum():6d}  mean abs difference to vector overlay: {np.abs(values - overlay_values)[both].mean():.3f}"
+        )
+
+    report("vector overlay", overlay_time, overlay_values)
+
+    sampling_points = generate_sampling_points(osm_ids, geometries, args.resolution)
+    for name, segment_geometries in (
+        ("rasterize, points", None),
+        ("rasterize, line overlay", geometries),
+    ):
+        start_time = time.perf_counter()
+        values = to_array(
+            rasterize_and_calculate_segment_values(
+                "benchmark",
+                vector_data_gdf,
+                sampling_points,
+                args.data_column,
+                args.resolution,
+                raster_null_value=RASTER_NO_DATA_VALUE,
+                segment_geometries=segment_geometries,
+            )["mean"]
+        )
+        report(name, time.perf_counter() - start_time, values)
+
+
+if __name__ == "__main__":
+    main()
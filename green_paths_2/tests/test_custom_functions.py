@@ -0,0 +1,65 @@
+import numpy as np
+import xarray
+from shapely.geometry import LineString
+
+from ..src.preprocessing.custom_functions import (
+    convert_raster_nc_to_tif,
+    fix_aqi_tiff_scale_offset,
+    load_raster_nc_to_memory,
+)
+from ..src.preprocessing.raster_operations import (
+    calculate_segment_raster_band_values_from_in_memory_raster,
+    calculate_segment_raster_values_from_raster_file,
+)
+from ..src.preprocessing.sampling_points import generate_sampling_points
+
+
+def test_load_raster_nc_to_memory(tmp_path):
+    # AQI like variable packed to int8 with a scale and an offset
+    rng = np.random.default_rng(0)
+    aqi = rng.uniform(1, 5, (1, 20, 20))
+    aqi[0, rng.random((20, 20)) < 0.1] = np.nan
+    nc_path = str(tmp_path / "aqi.nc")
+    xarray.Dataset(
+        {"AQI": (("time", "latitude", "longitude"), aqi)},
+        coords={
+            "time": [0],
+            "latitude": np.linspace(60.295, 60.105, 20),
+            "longitude": np.linspace(24.805, 24.995, 20),
+        },
+    ).to_netcdf(
+        nc_path,
+        encoding={
+            "AQI": {
+                "dtype": "int8",
+                "scale_factor": 0.05,
+                "add_offset": 1.0,
+                "_FillValue": -128,
+            }
+        },
+    )
+
+    raster = load_raster_nc_to_memory(nc_path, 4326, "AQI")
+    assert raster.count == 1 and raster.shape == (20, 20)
+    assert raster.data.dtype == np.float32
+    # the missing values are filled with 1.0
+    assert np.all(raster.data[0][np.isnan(aqi[0])] == 1.0)
+    np.testing.assert_allclose(
+        raster.data[0][~np.isnan(aqi[0])], aqi[0][~np.isnan(aqi[0])], atol=0.03
+    )
+
+    # sampled like the GeoTIFF converted from the same file
+    tif_path = convert_raster_nc_to_tif(nc_path, str(tmp_path / "aqi.tif"), 4326, "AQI")
+    fix_aqi_tiff_scale_offset(tif_path)
+    geometries = np.array(
+        [LineString(rng.uniform((24.8, 60.1), (25.0, 60.3), (3, 2))) for _ in range(20)]
+    )
+    sampling_points = generate_sampling_points(np.arange(-1, -21, -1), geometries, 0.01)
+    in_memory_values = calculate_segment_raster_band_values_from_in_memory_raster(
+        sampling_points, raster, sampling_points_crs=4326
+    )["b1"]
+    file_values = calculate_segment_raster_values_from_raster_file(
+        sampling_points, tif_path, sampling_points_crs=4326
+    )
+    for osm_id, value in file_values["mean"].items():
+        assert np.isclose(in_memory_values["mean"][osm_id], value)
@@ -0,0 +1,104 @@
+import os
+
+import geopandas as gpd
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from shapely.geometry import LineString, Point
+
+from ..src.preprocessing.data_source import DataSource
+from ..src.preprocessing.data_source_processor import (
+    pack_segment_values,
+    process_data_sources,
+)
+from ..src.preprocessing.raster_operations import segment_value_arrays_to_dicts
+from ..src.preprocessing.sampling_points import generate_sampling_points
+
+
+def test_process_data_sources_in_parallel(tmp_path):
+    rng = np.random.default_rng(0)
+    raster_path = os.path.join(tmp_path, "raster.tif")
+    with rasterio.open(
+        raster_path,
+        "w",
+        driver="GTiff",
+        width=50,
+        height=50,
+        count=1,
+        dtype="float32",
+        crs=3067,
+        transform=from_origin(0, 500, 10, 10),
+    ) as raster_dst:
+        raster_dst.write(rng.uniform(1, 100, (1, 50, 50)).astype(np.float32))
+
+    vector_path = os.path.join(tmp_path, "circles.gpkg")
+    gpd.GeoDataFrame(
+        {"value": rng.integers(1, 100, 20).astype(float)},
+        geometry=[Point(x, y).buffer(30) for x, y in rng.uniform(0, 500, (20, 2))],
+        crs=3067,
+    ).to_file(vector_path)
+
+    def create_data_source(name, filepath, data_type, sampling_method=None):
+        return DataSource(
+            name,
+            filepath,
+            good_exposure=False,
+            min_data_value=0,
+            max_data_value=100,
+            data_column="value",
+            raster_cell_resolution=10,
+            data_type=data_type,
+            segment_statistics=["max"],
+            segment_sampling_method=sampling_method,
+        )
+
+    data_sources = {
+        "raster": create_data_source("raster", raster_path, "raster"),
+        "raster_overlay": create_data_source(
+            "raster_overlay", raster_path, "raster", "line_overlay"
+        ),
+        "circles": create_data_source(
+            "circles", vector_path, "vector", "vector_overlay"
+        ),
+        "circles_rasterized": create_data_source(
+            "circles_rasterized", vector_path, "vector"
+        ),
+    }
+    osm_ids = np.arange(-1, -31, -1)
+    geometries = np.array(
+        [LineString(rng.uniform(0, 600, (3, 2))) for _ in range(len(osm_ids))]
+    )
+    sampling_points = generate_sampling_points(osm_ids, geometries, 10)
+
+    serial_values = process_data_sources(
+        data_sources,
+        sampling_points,
+        geometries,
+        3067,
+        use_rasterization_cache=False,
+        workers=1,
+    )
+    parallel_values = process_data_sources(
+        data_sources,
+        sampling_points,
+        geometries,
+        3067,
+        use_rasterization_cache=False,
+        workers=2,
+    )
+    assert list(parallel_values) == list(data_sources)
+    assert parallel_values == serial_values
+    assert any(serial_values["circles"]["circles"]["mean"].values())
+
+
+def test_pack_segment_values():
+    segment_values = {
+        "mean": {-1: 1.5, -2: None, -3: 0.001},
+        "max": {-1: 2.0, -2: None, -3: 3.0},
+    }
+    packed_values = pack_segment_values(segment_values)
+    assert np.isnan(packed_values["mean"][1])
+    assert (
+        segment_value_arrays_to_dicts(np.array([-1, -2, -3]), packed_values)
+        == segment_values
+    )
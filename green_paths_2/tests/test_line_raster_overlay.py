@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from rasterio.transform import from_origin
+from shapely.geometry import LineString, MultiLineString, Point
+
+from ..src.preprocessing.line_raster_overlay import get_segment_cell_pieces
+
+
+def test_get_segment_cell_pieces():
+    # 10m cells, top left corner at (0, 100)
+    transform = from_origin(0, 100, 10, 10)
+    geometries = [
+        LineString([(5, 95), (35, 95)]),
+        LineString([(0, 100), (20, 80), (25, 80)]),
+        LineString([(-10, 50), (10, 50)]),
+        MultiLineString([[(1, 1), (1, 1.5)], [(2, 2), (2, 22)]]),
+        Point(1, 1),
+    ]
+    pieces, lengths = get_segment_cell_pieces(
+        np.array([-1, -2, -3, -4, -5]), geometries, transform
+    )
+
+    assert pieces.counts.tolist() == [4, 3, 2, 4, 0]
+    # the lengths of the pieces add up to the segment lengths
+    segment_lengths = np.add.reduceat(lengths, pieces.offsets[:-1][pieces.counts > 0])
+    assert segment_lengths == pytest.approx([30, 20 * np.sqrt(2) + 5, 20, 20.5])
+    assert lengths[:4] == pytest.approx([5, 10, 10, 5])
+    # the diagonal crosses the cell corners, no empty pieces
+    assert lengths[4:7] == pytest.approx([10 * np.sqrt(2), 10 * np.sqrt(2), 5])
+    assert pieces.get_segment_coordinates(1) == pytest.approx(
+        np.array([[5, 95], [15, 85], [22.5, 80]])
+    )
+    # the piece left of the raster has no coordinates
+    assert np.isnan(pieces.get_segment_coordinates(2)[0]).all()
+    assert pieces.get_segment_coordinates(2)[1].tolist() == [5, 50]
@@ -0,0 +1,51 @@
+import os
+
+import osmium
+import pytest
+import shapely
+
+from ..src.config import ID_KEY
+from ..src.green_paths_exceptions import OsmSegmenterError
+from ..src.preprocessing.osm_network_loader import load_osm_network
+from .test_osm_segmenter import write_test_osm_pbf
+
+
+@pytest.mark.parametrize("node_location_index", ["flex_mem", "sparse_file_array"])
+def test_load_osm_network(tmp_path, node_location_index):
+    source_path = write_test_osm_pbf(
+        os.path.join(tmp_path, "source.osm.pbf"),
+        {-10: [1, 2, 3], -11: [3, 4], 12: [5, 6], 13: [6, 7], 14: [7, 8, 7]},
+        way_tags={
+            12: {"building": "yes"},
+            13: {"highway": "proposed"},
+            14: {"highway": "pedestrian", "area": "yes"},
+        },
+    )
+    network_gdf = load_osm_network(source_path, node_location_index)
+
+    assert network_gdf.crs.to_epsg() == 4326
+    assert list(network_gdf.columns) == [ID_KEY, "geometry"]
+    assert network_gdf[ID_KEY].tolist() == [-10, -11]
+    assert network_gdf.geometry.iloc[0].equals_exact(
+        shapely.LineString([(24.901, 60.101), (24.902, 60.102), (24.903, 60.103)]),
+        1e-7,
+    )
+
+
+def test_load_osm_network_missing_locations(tmp_path):
+    source_path = os.path.join(tmp_path, "source.osm.pbf")
+    writer = osmium.SimpleWriter(source_path)
+    for node_id in (1, 2, 4):
+        writer.add_node(osmium.osm.mutable.Node(id=node_id, location=(24.9, 60.1)))
+    for way_id, node_refs in {1: [1, 2], 2: [2, 3], 3: [4]}.items():
+        writer.add_way(
+            osmium.osm.mutable.Way(
+                id=way_id, nodes=node_refs, tags={"highway": "footway"}
+            )
+        )
+    writer.close()
+
+    # node 3 is missing and way 3 has a single node
+    assert load_osm_network(source_path)[ID_KEY].tolist() == [1]
+    with pytest.raises(OsmSegmenterError):
+        load_osm_network(source_path, "not_an_index")
@@ -0,0 +1,542 @@
+import json
+import os
+
+import geopandas as gpd
+import numpy as np
+import osmium
+import pytest
+from shapely.geometry import Point
+
+from ..src.preprocessing import osm_segmenter
+from ..src.preprocessing.osm_segmenter import (
+    INTERSECTION_INDEX_BACKENDS,
+    create_segment_id,
+    split_segment_id,
+    split_way_node_refs,
+)
+from ..src.preprocessing.osm_network_updater import update_segmented_osm_network
+from ..src.preprocessing.study_area import clip_area_from_bbox, clip_area_from_points
+from ..src.preprocessing.segmented_network_cache import (
+    calculate_file_sha256,
+    get_segmentation_parameters,
+    get_segmentation_variant,
+    read_segmented_network_manifest,
+    segmented_network_cache_is_valid,
+)
+from ..src import data_utilities
+from ..src.data_utilities import construct_osm_segmented_network_name
+from ..src.green_paths_exceptions import OsmSegmenterError
+
+
+def write_test_osm_pbf(
+    path: str, ways: dict[int, list[int]], way_tags: dict[int, dict] = None
+) -> str:
+    """Write a small OSM PBF with the given ways, nodes are placed on a line."""
+    way_tags = way_tags or {}
+    node_ids = sorted({node_id for node_ids in ways.values() for node_id in node_ids})
+    writer = osmium.SimpleWriter(path)
+    for node_id in node_ids:
+        writer.add_node(
+            osmium.osm.mutable.Node(
+                id=node_id, location=(24.9 + node_id * 0.001, 60.1 + node_id * 0.001)
+            )
+        )
+    for way_id, node_refs in ways.items():
+        writer.add_way(
+            osmium.osm.mutable.Way(
+                id=way_id,
+                nodes=node_refs,
+                tags=way_tags.get(way_id, {"highway": "footway"}),
+            )
+        )
+    writer.close()
+    return path
+
+
+def read_segments(path: str) -> dict[int, tuple]:
+    return {
+        way.id: (way.tags["parent_id"], [node.ref for node in way.nodes])
+        for way in osmium.FileProcessor(path, osmium.osm.WAY)
+    }
+
+
+def read_nodes(path: str) -> list[tuple]:
+    return [
+        (node.id, node.location.lon, node.location.lat)
+        for node in osmium.FileProcessor(path, osmium.osm.NODE)
+    ]
+
+
+def split(node_refs: list[int], intersection_nodes: set[int]) -> list[list[int]]:
+    node_refs = np.array(node_refs, dtype=np.int64)
+    return split_way_node_refs(node_refs, np.isin(node_refs, list(intersection_nodes)))
+
+
+def test_split_way_node_refs():
+    assert split([1, 2, 3, 4], {3}) == [[1, 2, 3], [3, 4]]
+    assert split([1, 2, 3, 4], {1, 4}) == [[1, 2, 3, 4]]
+    assert split([1, 2, 3, 1], {1}) == [[1, 2, 3, 1]]
+    assert split([1], set()) == []
+
+
+@pytest.mark.parametrize("backend", list(INTERSECTION_INDEX_BACKENDS))
+def test_intersection_index_backends(backend):
+    # tiny chunks to exercise merging the chunks
+    intersection_index = INTERSECTION_INDEX_BACKENDS[backend](chunk_size=4)
+    ways = [[1, 2, 3, 4], [5, 3, 6], [7, 8, 9, 7], [10, 11], [6, 12]]
+    for node_refs in ways:
+        intersection_index.add_way(np.array(node_refs, dtype=np.int64))
+    intersection_index.finalize()
+
+    queried_refs = np.arange(0, 20, dtype=np.int64)
+    expected = np.isin(queried_refs, [3, 6, 7])
+    assert np.array_equal(intersection_index.is_intersection(queried_refs), expected)
+    assert len(intersection_index) == 3
+    intersection_index.close()
+
+    # random ways over many chunks, compared with counting the refs
+    rng = np.random.default_rng(0)
+    ways = [rng.integers(1, 2000, rng.integers(2, 8)) for _ in range(500)]
+    intersection_index = INTERSECTION_INDEX_BACKENDS[backend](chunk_size=64)
+    for node_refs in ways:
+        intersection_index.add_way(node_refs.astype(np.int64))
+    intersection_index.finalize()
+    refs, ref_counts = np.unique(np.concatenate(ways), return_counts=True)
+    queried_refs = np.arange(0, 2001, dtype=np.int64)
+    assert np.array_equal(
+        intersection_index.is_intersection(queried_refs),
+        np.isin(queried_refs, refs[ref_counts > 1]),
+    )
+    assert len(intersection_index) == np.count_nonzero(ref_counts > 1)
+    assert [
+        intersection_index.is_referenced_node(node_id)
+        for node_id in queried_refs.tolist()
+    ] == np.isin(queried_refs, refs).tolist()
+    intersection_index.close()
+
+
+def test_segment_osm_network(tmp_path, monkeypatch):
+    source_path = write_test_osm_pbf(
+        os.path.join(tmp_path, "source.osm.pbf"),
+        {10: [1, 2, 3, 4], 11: [5, 3, 6]},
+    )
+    segmented_path = os.path.join(tmp_path, "source_segmented.osm.pbf")
+    monkeypatch.setattr(
+        osm_segmenter,
+        "construct_osm_segmented_network_name",
+        lambda *_: segmented_path,
+    )
+
+    assert osm_segmenter.segment_or_use_cache_osm_network(source_path) == segmented_path
+
+    assert read_segments(segmented_path) == {
+        create_segment_id(10, 0): ("10", [1, 2, 3]),
+        create_segment_id(10, 1): ("10", [3, 4]),
+        create_segment_id(11, 0): ("11", [5, 3]),
+        create_segment_id(11, 1): ("11", [3, 6]),
+    }
+
+
+def test_segment_osm_network_way_filter(tmp_path, monkeypatch):
+    source_path = write_test_osm_pbf(
+        os.path.join(tmp_path, "source.osm.pbf"),
+        {10: [1, 2, 3], 11: [4, 2, 5], 12: [6, 7, 8, 6], 13: [3, 9]},
+        way_tags={
+            11: {"building": "yes"},
+            12: {"landuse": "grass"},
+            13: {"highway": "motorway"},
+        },
+    )
+    segmented_path = os.path.join(tmp_path, "source_segmented.osm.pbf")
+    monkeypatch.setattr(
+        osm_segmenter,
+        "construct_osm_segmented_network_name",
+        lambda *_: segmented_path,
+    )
+    osm_segmenter.segment_or_use_cache_osm_network(source_path)
+
+    # the building does not cut the footway, and only its nodes are kept
+    assert read_segments(segmented_path) == {
+        create_segment_id(10, 0): ("10", [1, 2, 3])
+    }
+    assert [node[0] for node in read_nodes(segmented_path)] == [1, 2, 3]
+    report = read_segmented_network_manifest(segmented_path)["segmentation_report"]
+    assert (report["way_count"], report["kept_way_count"]) == (4, 1)
+    assert (report["node_count"], report["kept_node_count"]) == (9, 3)
+
+    # keeping all the ways is cached as another variant
+    monkeypatch.setattr(
+        osm_segmenter,
+        "construct_osm_segmented_network_name",
+        construct_osm_segmented_network_name,
+    )
+    monkeypatch.setenv("ENV", "")
+    monkeypatch.setattr(data_utilities, "DATA_CACHE_DIR_PATH", str(tmp_path))
+    os.makedirs(os.path.join(tmp_path, "osm", "segmented"))
+    all_ways_path = osm_segmenter.segment_or_use_cache_osm_network(
+        source_path, way_filter=None
+    )
+    assert all_ways_path != segmented_path
+    assert len(read_segments(all_ways_path)) == 6
+    assert len(read_nodes(all_ways_path)) == 9
+
+
+def test_segment_osm_network_clip_area(tmp_path, monkeypatch):
+    source_path = write_test_osm_pbf(
+        os.path.join(tmp_path, "source.osm.pbf"),
+        {10: [1, 2, 3], 11: [3, 4, 5], 12: [6, 7], 13: [7, 8]},
+    )
+    segmented_path = os.path.join(tmp_path, "source_segmented.osm.pbf")
+    monkeypatch.setattr(
+        osm_segmenter,
+        "construct_osm_segmented_network_name",
+        lambda *_: segmented_path,
+    )
+
+    # nodes 1-3 are inside, the way crossing the border is kept whole
+    clip_area = clip_area_from_bbox((24.9005, 60.1005, 24.9035, 60.1035))
+    osm_segmenter.segment_or_use_cache_osm_network(source_path, clip_area=clip_area)
+    assert read_segments(segmented_path) == {
+        create_segment_id(10, 0): ("10", [1, 2, 3]),
+        create_segment_id(11, 0): ("11", [3, 4, 5]),
+    }
+    assert [node[0] for node in read_nodes(segmented_path)] == [1, 2, 3, 4, 5]
+    manifest = read_segmented_network_manifest(segmented_path)
+    assert manifest["segmentation_parameters"] == {"clip_area": clip_area.wkt}
+
+    # another clip area invalidates the cache, the buffer reaches nodes 5 and 7
+    buffered_clip_area = clip_area_from_bbox(
+        (24.9055, 60.1055, 24.9065, 60.1065), buffer_meters=100
+    )
+    osm_segmenter.segment_or_use_cache_osm_network(
+        source_path, clip_area=buffered_clip_area
+    )
+    assert {parent for parent, _ in read_segments(segmented_path).values()} == {
+        "11",
+        "12",
+        "13",
+    }
+
+
+def test_clip_area_from_points():
+    # a single point and points on a line are buffered to an area
+    points_gdf = gpd.GeoDataFrame(
+        geometry=[Point(24.9, 60.1), Point(24.9, 60.1)], crs=4326
+    )
+    clip_area = clip_area_from_points([points_gdf], buffer_meters=100)
+    assert clip_area.contains(Point(24.9, 60.1))
+    assert clip_area.contains(Point(24.9, 60.1008))
+    assert not clip_area.contains(Point(24.9, 60.102))
+    line_points_gdf = gpd.GeoDataFrame(
+        geometry=[Point(24.9, 60.1), Point(24.91, 60.1)], crs=4326
+    )
+    assert clip_area_from_points(
+        [points_gdf, line_points_gdf], buffer_meters=100
+    ).contains(Point(24.905, 60.1005))
+
+    # without a buffer the points need an extent
+    with pytest.raises(ValueError):
+        clip_area_from_points([points_gdf], buffer_meters=0)
+
+
+def test_segment_id():
+    segment_id = create_segment_id(1307836802, 3)
+    assert segment_id < 0
+    assert split_segment_id(segment_id) == (1307836802, 3)
+    assert create_segment_id(10, 1) != create_segment_id(11, 0)
+    with pytest.raises(OsmSegmenterError):
+        create_segment_id(10, 1 << 16)
+
+
+def test_split_pbf_data_blobs(tmp_path, monkeypatch):
+    # 20000 nodes and 10000 ways, written in blocks of at most 8000 objects
+    source_path = os.path.join(tmp_path, "source.osm.pbf")
+    rng = np.random.default_rng(0)
+    writer = osmium.SimpleWriter(source_path)
+    for node_id in range(1, 20001):
+        writer.add_node(
+            osmium.osm.mutable.Node(
+                id=node_id, location=tuple(rng.uniform((24.8, 60.1), (25.0, 60.3)))
+            )
+        )
+    for way_id in range(1, 10001):
+        writer.add_way(
+            osmium.osm.mutable.Way(
+                id=way_id,
+                nodes=[2 * way_id - 1, 2 * way_id],
+                tags={"highway": "footway"},
+            )
+        )
+    writer.close()
+    blobs = osm_segmenter.read_pbf_blobs(source_path)
+    assert [blob_type for blob_type, _, _ in blobs] == ["OSMHeader"] + ["OSMData"] * 5
+    assert blobs[-1][1] + blobs[-1][2] == os.path.getsize(source_path)
+
+    # contiguous ranges of whole blobs covering all the data blobs
+    block_ranges = osm_segmenter.split_pbf_data_blobs(blobs, 3)
+    assert len(block_ranges) == 3
+    assert block_ranges[0][0] == blobs[1][1]
+    assert block_ranges[-1][1] == os.path.getsize(source_path)
+    blob_offsets = {offset for _, offset, _ in blobs}
+    for (_, range_end), (next_range_start, _) in zip(block_ranges, block_ranges[1:]):
+        assert range_end == next_range_start and range_end in blob_offsets
+    assert len(osm_segmenter.split_pbf_data_blobs(blobs, 10)) == 5
+    assert osm_segmenter.split_pbf_data_blobs(blobs[:1], 3) == []
+
+    # the blocks of each worker are segmented like in one process
+    segmented_networks = {}
+    for workers in (1, 3):
+        segmented_path = os.path.join(tmp_path, f"segmented_{workers}.osm.pbf")
+        monkeypatch.setattr(
+            osm_segmenter,
+            "construct_osm_segmented_network_name",
+            lambda *_: segmented_path,
+        )
+        osm_segmenter.segment_or_use_cache_osm_network(source_path, workers=workers)
+        segmented_networks[workers] = (
+            read_segments(segmented_path),
+            read_nodes(segmented_path),
+        )
+    assert segmented_networks[1] == segmented_networks[3]
+    assert len(segmented_networks[3][0]) == 10000
+
+    # an OSM XML file has no blobs
+    xml_path = tmp_path / "network.osm"
+    xml_path.write_text('<?xml version="1.0"?><osm version="0.6"></osm>')
+    with pytest.raises(OsmSegmenterError):
+        osm_segmenter.read_pbf_blobs(str(xml_path))
+
+
+@pytest.mark.parametrize("backend", ["numpy", "disk"])
+def test_segment_osm_network_workers(tmp_path, monkeypatch, backend):
+    source_path = write_test_osm_pbf(
+        os.path.join(tmp_path, "source.osm.pbf"),
+        {
+            10: [1, 2, 3, 4],
+            11: [5, 3, 6],
+            12: [6, 7, 8, 9],
+            13: [8, 10, 11],
+            14: [11, 12, 1],
+            15: [13, 14],
+        },
+    )
+    segmented_networks = {}
+    for workers in (1, 3):
+        segmented_path = os.path.join(tmp_path, f"segmented_{workers}.osm.pbf")
+        monkeypatch.setattr(
+            osm_segmenter,
+            "construct_osm_segmented_network_name",
+            lambda *_: segmented_path,
+        )
+        osm_segmenter.segment_or_use_cache_osm_network(
+            source_path, intersection_index_backend=backend, workers=workers
+        )
+        segmented_networks[workers] = (
+            read_segments(segmented_path),
+            sorted(
+                node.id
+                for node in osmium.FileProcessor(segmented_path, osmium.osm.NODE)
+            ),
+        )
+
+    # same segments with the same ids, and all the nodes copied once
+    assert segmented_networks[1] == segmented_networks[3]
+    assert segmented_networks[3][1] == list(range(1, 15))
+    assert len(segmented_networks[3][0]) == 9
+
+
+def test_segmented_network_cache(tmp_path, monkeypatch):
+    source_path = write_test_osm_pbf(
+        os.path.join(tmp_path, "source.osm.pbf"),
+        {10: [1, 2, 3, 4], 11: [5, 3, 6]},
+    )
+    segmented_path = os.path.join(tmp_path, "source_segmented.osm.pbf")
+    monkeypatch.setattr(
+        osm_segmenter,
+        "construct_osm_segmented_network_name",
+        lambda *_: segmented_path,
+    )
+    osm_segmenter.segment_or_use_cache_osm_network(source_path)
+    manifest = read_segmented_network_manifest(segmented_path)
+    assert manifest["source"]["sha256"] == calculate_file_sha256(source_path)
+    assert segmented_network_cache_is_valid(segmented_path, source_path, {})
+    assert not segmented_network_cache_is_valid(
+        segmented_path, source_path, {"other": "parameters"}
+    )
+
+    # same content with a new mtime is still valid
+    os.utime(source_path, ns=(0, 0))
+    assert segmented_network_cache_is_valid(segmented_path, source_path, {})
+    assert read_segmented_network_manifest(segmented_path)["source"]["mtime_ns"] == 0
+
+    # changed source with the same name is segmented again
+    os.remove(source_path)
+    write_test_osm_pbf(source_path, {12: [1, 2, 3]})
+    assert not segmented_network_cache_is_valid(segmented_path, source_path, {})
+    osm_segmenter.segment_or_use_cache_osm_network(source_path)
+    assert read_segments(segmented_path) == {
+        create_segment_id(12, 0): ("12", [1, 2, 3])
+    }
+    assert segmented_network_cache_is_valid(segmented_path, source_path, {})
+
+
+def test_segmented_network_variant_names(monkeypatch):
+    monkeypatch.delenv("ENV", raising=False)
+    source_path = "data/helsinki.osm.pbf"
+    default_path = construct_osm_segmented_network_name(source_path)
+    variant = get_segmentation_variant({"bbox": [24.9, 60.1, 25.0, 60.2]})
+    variant_path = construct_osm_segmented_network_name(source_path, variant)
+    assert get_segmentation_variant({}) is None
+    assert default_path.endswith("helsinki_segmented.osm.pbf")
+    assert variant_path.endswith(f"helsinki_segmented_{variant}.osm.pbf")
+
+    # clipped networks are cached side by side, by the clip area
+    clip_area = clip_area_from_bbox((24.9, 60.1, 25.0, 60.2))
+    other_clip_area = clip_area_from_bbox((24.9, 60.1, 25.0, 60.3))
+    assert get_segmentation_parameters() == {}
+    clip_variants = {
+        get_segmentation_variant(get_segmentation_parameters(clip_area=area))
+        for area in (clip_area, other_clip_area)
+    }
+    assert len(clip_variants) == 2 and None not in clip_variants
+
+
+class ChangeApplier(osmium.SimpleHandler):
+    def __init__(self, writer):
+        super().__init__()
+        self.writer = writer
+
+    def node(self, n):
+        if not n.deleted:
+            self.writer.add_node(n)
+
+    def way(self, w):
+        if not w.deleted:
+            self.writer.add_way(w)
+
+
+def test_update_segmented_osm_network(tmp_path, monkeypatch):
+    source_path = write_test_osm_pbf(
+        os.path.join(tmp_path, "source.osm.pbf"),
+        {10: [1, 2, 3, 4], 11: [5, 3, 6], 12: [7, 8, 9], 13: [9, 10]},
+    )
+    change_path = os.path.join(tmp_path, "changes.osc")
+    writer = osmium.SimpleWriter(change_path)
+    writer.add_node(osmium.osm.mutable.Node(id=4, location=(25.5, 60.5), version=2))
+    writer.add_node(osmium.osm.mutable.Node(id=11, location=(25.6, 60.6), version=1))
+    writer.add_way(
+        osmium.osm.mutable.Way(id=11, nodes=[5, 3, 6], version=2, visible=False)
+    )
+    writer.add_way(
+        osmium.osm.mutable.Way(
+            id=12, nodes=[7, 8, 9, 2], tags={"highway": "footway"}, version=2
+        )
+    )
+    writer.add_way(
+        osmium.osm.mutable.Way(
+            id=14, nodes=[10, 11], tags={"highway": "footway"}, version=1
+        )
+    )
+    writer.close()
+
+    segmented_path = os.path.join(tmp_path, "source_segmented.osm.pbf")
+    monkeypatch.setattr(
+        osm_segmenter,
+        "construct_osm_segmented_network_name",
+        lambda *_: segmented_path,
+    )
+    osm_segmenter.segment_or_use_cache_osm_network(source_path)
+    segment_changes = update_segmented_osm_network(segmented_path, change_path)
+
+    # same result as segmenting the updated source from scratch
+    updated_source_path = os.path.join(tmp_path, "updated.osm.pbf")
+    writer = osmium.SimpleWriter(updated_source_path)
+    merge_reader = osmium.MergeInputReader()
+    merge_reader.add_file(source_path)
+    merge_reader.add_file(change_path)
+    merge_reader.apply(ChangeApplier(writer), simplify=True)
+    writer.close()
+    resegmented_path = os.path.join(tmp_path, "updated_segmented.osm.pbf")
+    monkeypatch.setattr(
+        osm_segmenter,
+        "construct_osm_segmented_network_name",
+        lambda *_: resegmented_path,
+    )
+    osm_segmenter.segment_or_use_cache_osm_network(updated_source_path)
+    assert read_segments(segmented_path) == read_segments(resegmented_path)
+    assert read_nodes(segmented_path) == read_nodes(resegmented_path)
+
+    assert segment_changes == {
+        "added": sorted([create_segment_id(12, 1), create_segment_id(14, 0)]),
+        "removed": sorted([create_segment_id(11, 0), create_segment_id(11, 1)]),
+        # way 10 is cut at node 2 instead of node 3, and node 4 moved
+        "modified": sorted([create_segment_id(10, 0), create_segment_id(10, 1)]),
+    }
+    with open(segmented_path + ".changes.json") as changes_file:
+        assert json.load(changes_file) == segment_changes
+    assert read_segmented_network_manifest(segmented_path)["applied_changes"][0][
+        "sha256"
+    ] == calculate_file_sha256(change_path)
+
+
+def test_update_segmented_osm_network_pruned_nodes(tmp_path, monkeypatch):
+    building_tags = {"building": "yes"}
+    source_path = write_test_osm_pbf(
+        os.path.join(tmp_path, "source.osm.pbf"),
+        {10: [1, 2, 3], 11: [4, 5, 6], 12: [7, 8], 13: [8, 9]},
+        {11: building_tags, 13: building_tags},
+    )
+    change_path = os.path.join(tmp_path, "changes.osc")
+    writer = osmium.SimpleWriter(change_path)
+    # way 11 is retagged as routable and way 12 is extended to a pruned node
+    writer.add_way(
+        osmium.osm.mutable.Way(
+            id=11, nodes=[4, 5, 6, 3], tags={"highway": "footway"}, version=2
+        )
+    )
+    writer.add_way(
+        osmium.osm.mutable.Way(
+            id=12, nodes=[7, 8, 9], tags={"highway": "footway"}, version=2
+        )
+    )
+    writer.close()
+
+    segmented_path = os.path.join(tmp_path, "source_segmented.osm.pbf")
+    monkeypatch.setattr(
+        osm_segmenter,
+        "construct_osm_segmented_network_name",
+        lambda *_: segmented_path,
+    )
+    osm_segmenter.segment_or_use_cache_osm_network(source_path)
+    assert [node[0] for node in read_nodes(segmented_path)] == [1, 2, 3, 7, 8]
+    update_segmented_osm_network(segmented_path, change_path)
+
+    # the pruned nodes are read from the source network
+    updated_source_path = os.path.join(tmp_path, "updated.osm.pbf")
+    writer = osmium.SimpleWriter(updated_source_path)
+    merge_reader = osmium.MergeInputReader()
+    merge_reader.add_file(source_path)
+    merge_reader.add_file(change_path)
+    merge_reader.apply(ChangeApplier(writer), simplify=True)
+    writer.close()
+    resegmented_path = os.path.join(tmp_path, "updated_segmented.osm.pbf")
+    monkeypatch.setattr(
+        osm_segmenter,
+        "construct_osm_segmented_network_name",
+        lambda *_: resegmented_path,
+    )
+    osm_segmenter.segment_or_use_cache_osm_network(updated_source_path)
+    assert read_segments(segmented_path) == read_segments(resegmented_path)
+    assert read_nodes(segmented_path) == read_nodes(resegmented_path)
+
+    # a node missing from the source network too is an error
+    change_path = os.path.join(tmp_path, "missing_node_changes.osc")
+    writer = osmium.SimpleWriter(change_path)
+    writer.add_way(
+        osmium.osm.mutable.Way(
+            id=12, nodes=[7, 8, 99], tags={"highway": "footway"}, version=3
+        )
+    )
+    writer.close()
+    with pytest.raises(OsmSegmenterError):
+        update_segmented_osm_network(segmented_path, change_path)
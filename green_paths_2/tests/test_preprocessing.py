@@ -37,7 +37,7 @@ def test_preprocessing(conn, config_dir, valid_user_config):
         assert check_data_types(conn, SEGMENT_STORE_TABLE, column, expected_type)
 
     # osm_id of the first row of select *
-    aqi_row_osm_id = -166684
+    aqi_row_osm_id = -85710392655872
 
     aqi = get_column_value_by_osm_id(conn, SEGMENT_STORE_TABLE, aqi_row_osm_id, "aqi")
     aqi_normalized = get_column_value_by_osm_id(
@@ -64,7 +64,7 @@ def test_preprocessing(conn, config_dir, valid_user_config):
     assert no_gvi_normalized_in_first_row == 0.0
 
     # osm_id from second row
-    gvi_row_osm_id = -166609
+    gvi_row_osm_id = -85704645541888
 
     gvi = get_column_value_by_osm_id(conn, SEGMENT_STORE_TABLE, gvi_row_osm_id, "gvi")
     gvi_normalized = get_column_value_by_osm_id(
@@ -0,0 +1,98 @@
+import os
+
+import numpy as np
+
+from ..src.config import LENGTH_KEY, OSM_ID_KEY
+from ..src.preprocessing.osm_network_handler import OsmNetworkHandler
+from ..src.preprocessing import segmented_network_cache
+from ..src.preprocessing.processed_network_cache import (
+    get_processed_network_cache_key,
+)
+from ..src.preprocessing.segmented_network_cache import (
+    write_segmented_network_manifest,
+)
+from .test_osm_segmenter import write_test_osm_pbf
+
+DATA_SOURCES = [{"name": "test", "raster_cell_resolution": 50}]
+
+
+def process_network(osm_pbf_file: str, **kwargs):
+    network = OsmNetworkHandler(osm_pbf_file)
+    network.process_osm_network(
+        project_crs=3067, original_crs=4326, data_sources=DATA_SOURCES, **kwargs
+    )
+    return network.get_network_gdf(), network.get_sampling_points()
+
+
+def test_processed_network_cache(tmp_path, monkeypatch):
+    network_path = write_test_osm_pbf(
+        os.path.join(tmp_path, "network_segmented.osm.pbf"),
+        {-10: [1, 2, 3], -11: [3, 4], -12: [4, 5, 6, 7]},
+    )
+    network_gdf, sampling_points = process_network(
+        network_path, use_network_cache=False
+    )
+    assert not [path for path in os.listdir(tmp_path) if path.endswith(".npz")]
+
+    # the first run writes the cache, the second one reads it
+    assert process_network(network_path)[0].equals(network_gdf)
+
+    def convert_network_to_gdf(_):
+        raise AssertionError("cached network was processed again")
+
+    monkeypatch.setattr(
+        OsmNetworkHandler, "convert_network_to_gdf", convert_network_to_gdf
+    )
+    cached_network_gdf, cached_sampling_points = process_network(network_path)
+    assert cached_network_gdf.crs == network_gdf.crs
+    assert cached_network_gdf[OSM_ID_KEY].tolist() == network_gdf[OSM_ID_KEY].tolist()
+    assert cached_network_gdf.geometry.geom_equals_exact(network_gdf.geometry, 0).all()
+    assert cached_network_gdf[LENGTH_KEY].tolist() == network_gdf[LENGTH_KEY].tolist()
+    for array_name in ("osm_ids", "x", "y", "offsets"):
+        assert np.array_equal(
+            getattr(cached_sampling_points, array_name),
+            getattr(sampling_points, array_name),
+        )
+
+    # other sampling parameters are a cache miss
+    monkeypatch.undo()
+    process_network(network_path, force_sampling_points_amount=2)
+    cache_files = [path for path in os.listdir(tmp_path) if path.endswith(".npz")]
+    assert len(cache_files) == 1
+    assert (
+        get_processed_network_cache_key(
+            network_path,
+            {
+                "project_crs": 3067,
+                "original_crs": 4326,
+                "raster_resolution": 50,
+                "force_sampling_points_amount": 2,
+            },
+        )
+        in cache_files[0]
+    )
+
+
+def test_processed_network_cache_key_reuses_manifest_hash(tmp_path, monkeypatch):
+    network_path = write_test_osm_pbf(
+        os.path.join(tmp_path, "network_segmented.osm.pbf"),
+        {-10: [1, 2, 3], -11: [3, 4]},
+    )
+    write_segmented_network_manifest(network_path, network_path, {})
+    parameters = {"project_crs": 3067}
+    cache_key = get_processed_network_cache_key(network_path, parameters)
+
+    # the hash is stored in the manifest, so the next key does not read the network
+    def calculate_file_sha256(_):
+        raise AssertionError("segmented network was hashed again")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(
+            segmented_network_cache, "calculate_file_sha256", calculate_file_sha256
+        )
+        assert get_processed_network_cache_key(network_path, parameters) == cache_key
+
+    # a modified network is hashed again
+    os.remove(network_path)
+    write_test_osm_pbf(network_path, {-10: [1, 2, 3]})
+    assert get_processed_network_cache_key(network_path, parameters) != cache_key
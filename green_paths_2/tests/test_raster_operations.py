@@ -0,0 +1,524 @@
+import geopandas as gpd
+import numpy as np
+import pytest
+import rasterio
+import shapely
+from pyproj import Transformer
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+from shapely.geometry import LineString, Point
+
+from ..src.config import RASTER_NO_DATA_VALUE
+from ..src.preprocessing.raster_operations import (
+    calculate_segment_statistics,
+    calculate_segment_raster_band_values_from_in_memory_raster,
+    calculate_segment_raster_band_values_from_raster_file,
+    calculate_segment_raster_values,
+    calculate_segment_raster_values_from_raster_file,
+    calculate_raster_dimensions,
+    get_vector_features_to_rasterize,
+    rasterize_and_calculate_segment_values,
+    rasterize_tile,
+    save_tiled_raster_file,
+    split_segments_into_chunks,
+)
+from ..src.preprocessing.in_memory_raster import InMemoryRaster
+from ..src.preprocessing.spatial_operations import create_buffer_for_geometries
+from ..src.preprocessing.sampling_points import generate_sampling_points
+
+
+def rasterize_in_one_tile(vector_data_gdf, width, height, transform):
+    """Rasterize the value column of the vector data in one tile covering the whole grid."""
+    geometries, feature_values = get_vector_features_to_rasterize(
+        vector_data_gdf, "value"
+    )
+    return rasterize_tile(
+        geometries,
+        feature_values,
+        shapely.STRtree(geometries),
+        transform,
+        Window(0, 0, width, height),
+        RASTER_NO_DATA_VALUE,
+    )
+
+
+def test_calculate_segment_raster_values():
+    # 10 x 10 raster of 10m cells, values 0..99 row by row from the top left corner
+    raster = np.arange(100, dtype=np.float32).reshape(10, 10)
+    raster[5, 5] = RASTER_NO_DATA_VALUE
+    raster[5, 6] = 255
+    raster[5, 7] = np.nan
+    transform = from_origin(0, 100, 10, 10)
+
+    sampling_points = generate_sampling_points(
+        np.array([-1, -2, -3, -4, -5]),
+        [
+            LineString([(5, 95), (35, 95)]),
+            LineString([(55, 45), (75, 45)]),
+            LineString([(150, 150), (250, 150)]),
+            LineString([(5, 95), (5, 95)]),
+            LineString([(-5, 45), (15, 45)]),
+        ],
+        raster_resolution=10,
+    )
+    assert calculate_segment_raster_values(
+        sampling_points, raster, transform, raster_null_value=255
+    )["mean"] == {
+        # mean of 0, 1, 2, 3
+        -1: 1.5,
+        # no data, null value and NaN are dropped
+        -2: None,
+        # outside the raster
+        -3: None,
+        # zero is not stored
+        -4: None,
+        # -0.5 is truncated to the first column, like int()
+        -5: 50.333,
+    }
+
+    # only a zero mean is not stored, a zero min or percentile is
+    segment_values = calculate_segment_raster_values(
+        sampling_points, raster, transform, segment_statistics=["min", "p10"]
+    )
+    assert segment_values["min"][-1] == 0
+    assert segment_values["p10"][-1] == 0.3
+    assert segment_values["min"][-4] == 0
+    assert segment_values["p10"][-4] == 0
+    assert segment_values["mean"][-4] is None
+
+
+def test_calculate_segment_raster_values_in_windows(tmp_path):
+    # 100 x 100 raster of 16 x 16 tiles, sampled with windows of a single tile
+    raster = np.random.default_rng(0).random((100, 100)).astype(np.float32)
+    raster_path = tmp_path / "tiled.tif"
+    with rasterio.open(
+        raster_path,
+        "w",
+        driver="GTiff",
+        width=100,
+        height=100,
+        count=1,
+        dtype="float32",
+        transform=from_origin(0, 100, 1, 1),
+        tiled=True,
+        blockxsize=16,
+        blockysize=16,
+    ) as dst:
+        dst.write(raster, 1)
+
+    sampling_points = generate_sampling_points(
+        np.array([-1, -2, -3]),
+        [
+            LineString([(0, 0), (100, 100)]),
+            LineString([(3, 97), (60, 97), (60, 40)]),
+            LineString([(90, 10), (150, 10)]),
+        ],
+        raster_resolution=1,
+    )
+    full_read_values = calculate_segment_raster_values(
+        sampling_points, raster, from_origin(0, 100, 1, 1)
+    )
+    assert (
+        calculate_segment_raster_values_from_raster_file(
+            sampling_points, str(raster_path), window_max_bytes=16 * 16 * 4
+        )
+        == full_read_values
+    )
+
+
+def test_calculate_segment_raster_values_in_raster_crs(tmp_path):
+    # 10 x 10 raster in WGS84, sampled with sampling points in ETRS-TM35FIN
+    raster = np.arange(1, 101, dtype=np.float32).reshape(10, 10)
+    raster_path = tmp_path / "wgs84.tif"
+    with rasterio.open(
+        raster_path,
+        "w",
+        driver="GTiff",
+        width=10,
+        height=10,
+        count=1,
+        dtype="float32",
+        crs="EPSG:4326",
+        transform=from_origin(24.9, 60.2, 0.001, 0.001),
+    ) as dst:
+        dst.write(raster, 1)
+
+    # the centers of the cells at row 5, column 3 and row 2, column 8
+    to_project_crs = Transformer.from_crs(4326, 3067, always_xy=True)
+    first_point = to_project_crs.transform(24.9035, 60.1945)
+    second_point = to_project_crs.transform(24.9085, 60.1975)
+    sampling_points = generate_sampling_points(
+        np.array([-1, -2]),
+        [
+            LineString([first_point, first_point]),
+            LineString([second_point, second_point]),
+        ],
+        raster_resolution=10,
+    )
+    assert calculate_segment_raster_values_from_raster_file(
+        sampling_points, str(raster_path), sampling_points_crs=3067
+    )["mean"] == {-1: 54.0, -2: 29.0}
+
+
+def test_calculate_segment_raster_band_values(tmp_path):
+    # 3 bands of 10 x 10 cells, the second band has a scale and an offset
+    raster = np.arange(1, 301, dtype=np.float32).reshape(3, 10, 10)
+    raster_path = tmp_path / "bands.tif"
+    with rasterio.open(
+        raster_path,
+        "w",
+        driver="GTiff",
+        width=10,
+        height=10,
+        count=3,
+        dtype="float32",
+        nodata=RASTER_NO_DATA_VALUE,
+        transform=from_origin(0, 10, 1, 1),
+    ) as dst:
+        dst.write(raster)
+        dst.scales = (1, 0.5, 1)
+        dst.offsets = (0, 10, 0)
+
+    # cells at row 5, column 3 and row 2, column 8
+    sampling_points = generate_sampling_points(
+        np.array([-1, -2]),
+        [LineString([(3.5, 4.5), (3.5, 4.5)]), LineString([(8.5, 7.5), (8.5, 7.5)])],
+        raster_resolution=1,
+    )
+    band_values = calculate_segment_raster_band_values_from_raster_file(
+        sampling_points, str(raster_path), raster_bands=[3, 2]
+    )
+    assert list(band_values) == ["b3", "b2"]
+    assert band_values["b3"]["mean"] == {-1: 254.0, -2: 229.0}
+    assert band_values["b2"]["mean"] == {-1: 87.0, -2: 74.5}
+
+    # the first band is sampled without any bands given
+    assert calculate_segment_raster_values_from_raster_file(
+        sampling_points, str(raster_path)
+    )["mean"] == {-1: 54.0, -2: 29.0}
+
+
+@pytest.mark.parametrize("use_line_overlay", [False, True])
+def test_calculate_segment_raster_values_in_parallel(tmp_path, use_line_overlay):
+    rng = np.random.default_rng(0)
+    raster = rng.uniform(0, 100, (3, 60, 60)).astype(np.float32)
+    raster[:, rng.random((60, 60)) < 0.1] = RASTER_NO_DATA_VALUE
+    transform = from_origin(0, 600, 10, 10)
+    raster_path = tmp_path / "bands.tif"
+    with rasterio.open(
+        raster_path,
+        "w",
+        driver="GTiff",
+        width=60,
+        height=60,
+        count=3,
+        dtype="float32",
+        nodata=RASTER_NO_DATA_VALUE,
+        transform=transform,
+    ) as dst:
+        dst.write(raster)
+        dst.scales = (1, 0.5, 1)
+        dst.offsets = (0, 10, 0)
+
+    geometries = np.array(
+        [LineString(rng.uniform(-50, 650, (3, 2))) for _ in range(50)]
+    )
+    sampling_points = generate_sampling_points(np.arange(-1, -51, -1), geometries, 10)
+    segment_geometries = geometries if use_line_overlay else None
+    statistics = ["max", "p90", "nodata_share"]
+
+    # the segments are sampled in chunks by the workers with the same values
+    assert calculate_segment_raster_values(
+        sampling_points,
+        raster[0],
+        transform,
+        segment_statistics=statistics,
+        segment_geometries=segment_geometries,
+        workers=2,
+    ) == calculate_segment_raster_values(
+        sampling_points,
+        raster[0],
+        transform,
+        segment_statistics=statistics,
+        segment_geometries=segment_geometries,
+    )
+    assert calculate_segment_raster_band_values_from_raster_file(
+        sampling_points,
+        str(raster_path),
+        segment_statistics=statistics,
+        segment_geometries=segment_geometries,
+        raster_bands=[1, 2, 3],
+        workers=3,
+    ) == calculate_segment_raster_band_values_from_raster_file(
+        sampling_points,
+        str(raster_path),
+        segment_statistics=statistics,
+        segment_geometries=segment_geometries,
+        raster_bands=[1, 2, 3],
+    )
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_calculate_segment_raster_band_values_from_in_memory_raster(tmp_path, workers):
+    rng = np.random.default_rng(0)
+    raster = rng.uniform(0, 100, (2, 30, 30)).astype(np.float32)
+    raster[:, rng.random((30, 30)) < 0.1] = RASTER_NO_DATA_VALUE
+    transform = from_origin(0, 300, 10, 10)
+    raster_path = tmp_path / "bands.tif"
+    with rasterio.open(
+        raster_path,
+        "w",
+        driver="GTiff",
+        width=30,
+        height=30,
+        count=2,
+        dtype="float32",
+        crs=3067,
+        nodata=RASTER_NO_DATA_VALUE,
+        transform=transform,
+    ) as dst:
+        dst.write(raster)
+
+    geometries = np.array(
+        [LineString(rng.uniform(-20, 320, (3, 2))) for _ in range(20)]
+    )
+    sampling_points = generate_sampling_points(np.arange(-1, -21, -1), geometries, 10)
+    # NaN is the no data of in-memory rasters
+    in_memory_raster = InMemoryRaster(
+        np.where(raster == RASTER_NO_DATA_VALUE, np.nan, raster), transform, 3067
+    )
+    statistics = ["mean", "max", "nodata_share"]
+
+    # the in-memory raster is sampled like the same raster in a file
+    assert calculate_segment_raster_band_values_from_in_memory_raster(
+        sampling_points,
+        in_memory_raster,
+        sampling_points_crs=3067,
+        segment_statistics=statistics,
+        raster_bands=[2, 1],
+        workers=workers,
+    ) == calculate_segment_raster_band_values_from_raster_file(
+        sampling_points,
+        str(raster_path),
+        sampling_points_crs=3067,
+        segment_statistics=statistics,
+        raster_bands=[2, 1],
+    )
+
+    # the first band is sampled without any bands given
+    assert list(
+        calculate_segment_raster_band_values_from_in_memory_raster(
+            sampling_points, in_memory_raster, sampling_points_crs=3067
+        )
+    ) == ["b1"]
+    with pytest.raises(ValueError):
+        in_memory_raster.read([3])
+
+
+def test_split_segments_into_chunks():
+    # 10 points in each segment, except for the empty segments 2 and 3
+    offsets = np.array([0, 10, 20, 20, 20, 30, 40, 50])
+    assert split_segments_into_chunks(offsets, 2) == [(0, 5), (5, 7)]
+    assert split_segments_into_chunks(offsets, 5) == [
+        (0, 1),
+        (1, 2),
+        (2, 5),
+        (5, 6),
+        (6, 7),
+    ]
+    assert split_segments_into_chunks(offsets, 100) == [
+        (0, 1),
+        (1, 2),
+        (2, 5),
+        (5, 6),
+        (6, 7),
+    ]
+
+
+def test_calculate_segment_statistics():
+    rng = np.random.default_rng(0)
+    counts = np.array([5, 0, 1, 12, 3])
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    values = rng.random(offsets[-1])
+    is_valid = rng.random(offsets[-1]) > 0.3
+    is_valid[offsets[4] : offsets[5]] = False
+
+    statistics = calculate_segment_statistics(
+        values,
+        is_valid,
+        offsets,
+        ["mean", "min", "max", "median", "p90", "nodata_share"],
+    )
+    for segment, (start, end) in enumerate(zip(offsets[:-1], offsets[1:])):
+        segment_values = values[start:end][is_valid[start:end]]
+        if len(segment_values) == 0:
+            assert not statistics["mean"][1][segment]
+            continue
+        assert statistics["mean"][0][segment] == pytest.approx(segment_values.mean())
+        assert statistics["min"][0][segment] == segment_values.min()
+        assert statistics["max"][0][segment] == segment_values.max()
+        assert statistics["median"][0][segment] == pytest.approx(
+            np.median(segment_values)
+        )
+        assert statistics["p90"][0][segment] == pytest.approx(
+            np.percentile(segment_values, 90)
+        )
+        assert statistics["nodata_share"][0][segment] == pytest.approx(
+            1 - len(segment_values) / (end - start)
+        )
+    # a segment without points has no nodata share, all invalid points share is 1
+    assert not statistics["nodata_share"][1][1]
+    assert statistics["nodata_share"][0][4] == 1
+
+
+def test_calculate_segment_raster_values_with_line_overlay():
+    raster = np.arange(100, dtype=np.float32).reshape(10, 10)
+    transform = from_origin(0, 100, 10, 10)
+    geometries = [LineString([(0, 95), (25, 95)]), LineString([(45, 45), (55, 45)])]
+    raster[5, 5] = RASTER_NO_DATA_VALUE
+
+    sampling_points = generate_sampling_points(
+        np.array([-1, -2]), geometries, raster_resolution=10
+    )
+    point_values = calculate_segment_raster_values(
+        sampling_points, raster, transform, segment_statistics=["nodata_share"]
+    )
+    line_values = calculate_segment_raster_values(
+        sampling_points,
+        raster,
+        transform,
+        segment_statistics=["nodata_share"],
+        segment_geometries=np.array(geometries),
+    )
+    # 4 points in the cells 0, 0, 1, 2
+    assert point_values["mean"][-1] == 0.75
+    # 10m in the cells 0 and 1, 5m in the cell 2
+    assert line_values["mean"][-1] == 0.8
+    # half of the second segment is in the no data cell
+    assert line_values["mean"][-2] == 54
+    assert line_values["nodata_share"] == {-1: 0, -2: 0.5}
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_rasterize_and_calculate_segment_values_in_tiles(tmp_path, workers):
+    # overlapping circles of random values, rasterized at 1m
+    rng = np.random.default_rng(0)
+    centers = rng.uniform(0, 60, (40, 2))
+    vector_data_gdf = gpd.GeoDataFrame(
+        {"value": rng.integers(1, 100, 40).astype(float)},
+        geometry=[
+            Point(x, y).buffer(radius)
+            for (x, y), radius in zip(centers, rng.uniform(1, 6, 40))
+        ],
+        crs=3067,
+    )
+    geometries = [LineString(rng.uniform(0, 60, (3, 2))) for _ in range(20)]
+    sampling_points = generate_sampling_points(
+        np.arange(-1, -21, -1), geometries, raster_resolution=1
+    )
+
+    width, height, transform = calculate_raster_dimensions(vector_data_gdf, 1)
+    raster = rasterize_in_one_tile(vector_data_gdf, width, height, transform)
+    for segment_geometries in (None, np.array(geometries)):
+        expected = calculate_segment_raster_values(
+            sampling_points,
+            raster,
+            transform,
+            segment_statistics=["max"],
+            segment_geometries=segment_geometries,
+        )
+        tiled = rasterize_and_calculate_segment_values(
+            "circles",
+            vector_data_gdf,
+            sampling_points,
+            "value",
+            raster_cell_resolution=1,
+            raster_null_value=RASTER_NO_DATA_VALUE,
+            segment_statistics=["max"],
+            segment_geometries=segment_geometries,
+            tile_size=7,
+            workers=workers,
+        )
+        assert tiled == expected
+
+    raster_path = tmp_path / "circles.tif"
+    save_tiled_raster_file(
+        vector_data_gdf,
+        "value",
+        str(raster_path),
+        width,
+        height,
+        transform,
+        RASTER_NO_DATA_VALUE,
+        tile_size=7,
+    )
+    with rasterio.open(raster_path) as raster_src:
+        assert np.array_equal(raster_src.read(1), raster)
+
+
+def test_save_tiled_raster_file_with_point_buffer(tmp_path):
+    rng = np.random.default_rng(0)
+    # points at the cell centers of a 10m grid, the 23m buffers do not graze any cells
+    cell_centers = rng.integers(0, 30, (200, 2)) * 10 + 5
+    points_gdf = gpd.GeoDataFrame(
+        {"value": rng.integers(1, 100, 200).astype(float)},
+        geometry=[Point(x, y) for x, y in cell_centers],
+        crs=3067,
+    )
+    buffered_gdf = create_buffer_for_geometries("points", points_gdf, 23)
+    assert calculate_raster_dimensions(
+        points_gdf, 10, 23
+    ) == calculate_raster_dimensions(buffered_gdf, 10)
+
+    width, height, transform = 30, 30, from_origin(0, 300, 10, 10)
+    buffered_raster = rasterize_in_one_tile(buffered_gdf, width, height, transform)
+
+    raster_path = tmp_path / "points.tif"
+    save_tiled_raster_file(
+        points_gdf,
+        "value",
+        str(raster_path),
+        width,
+        height,
+        transform,
+        RASTER_NO_DATA_VALUE,
+        tile_size=16,
+        point_buffer=23,
+    )
+    with rasterio.open(raster_path) as raster_src:
+        assert np.array_equal(raster_src.read(1), buffered_raster)
+
+    # points anywhere in their cells differ from the buffers only at the buffer edges
+    points_gdf.geometry = [
+        Point(x, y) for x, y in cell_centers + rng.uniform(-5, 5, (200, 2))
+    ]
+    buffered_gdf = create_buffer_for_geometries("points", points_gdf, 23)
+    width, height, transform = calculate_raster_dimensions(buffered_gdf, 10)
+    sampling_points = generate_sampling_points(
+        np.arange(-1, -51, -1),
+        [LineString(rng.uniform(0, 300, (3, 2))) for _ in range(50)],
+        raster_resolution=10,
+    )
+    point_values = rasterize_and_calculate_segment_values(
+        "points",
+        points_gdf,
+        sampling_points,
+        "value",
+        raster_cell_resolution=10,
+        raster_null_value=RASTER_NO_DATA_VALUE,
+        tile_size=16,
+        point_buffer=23,
+    )["mean"]
+    buffered_values = calculate_segment_raster_values(
+        sampling_points,
+        rasterize_in_one_tile(buffered_gdf, width, height, transform),
+        transform,
+        RASTER_NO_DATA_VALUE,
+    )["mean"]
+    differences = [
+        abs(point_values[osm_id] - value)
+        for osm_id, value in buffered_values.items()
+        if value is not None and point_values[osm_id] is not None
+    ]
+    assert len(differences) > 40
+    assert np.mean(differences) < 2
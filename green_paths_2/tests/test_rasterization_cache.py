@@ -0,0 +1,101 @@
+import os
+
+import geopandas as gpd
+import numpy as np
+import rasterio
+from shapely.geometry import LineString, Point
+
+from ..src.config import RASTER_NO_DATA_VALUE
+from ..src.preprocessing.raster_operations import (
+    calculate_raster_dimensions,
+    calculate_segment_raster_values_from_raster_file,
+    rasterize_and_calculate_segment_values,
+)
+from ..src.preprocessing.rasterization_cache import (
+    check_rasterization_cache,
+    evict_rasterization_caches,
+    get_rasterization_cache_key,
+    get_rasterization_cache_path,
+    write_rasterization_cache,
+)
+from ..src.preprocessing.sampling_points import generate_sampling_points
+from .test_raster_operations import rasterize_in_one_tile
+
+PARAMETERS = {"data_column": "value", "raster_cell_resolution": 1}
+
+
+def test_rasterization_cache(tmp_path):
+    rng = np.random.default_rng(0)
+    vector_data_gdf = gpd.GeoDataFrame(
+        {"value": rng.integers(1, 100, 30).astype(float)},
+        geometry=[Point(x, y).buffer(3) for x, y in rng.uniform(0, 50, (30, 2))],
+        crs=3067,
+    )
+    vector_path = os.path.join(tmp_path, "circles.gpkg")
+    vector_data_gdf.to_file(vector_path)
+
+    # the key changes with the content and the parameters
+    cache_key = get_rasterization_cache_key(vector_path, PARAMETERS)
+    assert cache_key == get_rasterization_cache_key(vector_path, PARAMETERS)
+    assert cache_key != get_rasterization_cache_key(
+        vector_path, {**PARAMETERS, "data_buffer": 5}
+    )
+    vector_data_gdf.iloc[:-1].to_file(os.path.join(tmp_path, "changed.gpkg"))
+    assert cache_key != get_rasterization_cache_key(
+        os.path.join(tmp_path, "changed.gpkg"), PARAMETERS
+    )
+
+    cache_dir = os.path.join(tmp_path, "cache")
+    cache_path = get_rasterization_cache_path("circles", cache_key, cache_dir)
+    assert not check_rasterization_cache(cache_path)
+    write_rasterization_cache(
+        cache_path, vector_data_gdf, "value", 1, RASTER_NO_DATA_VALUE, tile_size=16
+    )
+    assert check_rasterization_cache(cache_path)
+    assert os.listdir(cache_dir) == [os.path.basename(cache_path)]
+
+    width, height, transform = calculate_raster_dimensions(vector_data_gdf, 1)
+    with rasterio.open(cache_path) as raster_src:
+        assert raster_src.profile["tiled"]
+        assert raster_src.compression.value == "DEFLATE"
+        assert np.array_equal(
+            raster_src.read(1),
+            rasterize_in_one_tile(vector_data_gdf, width, height, transform),
+        )
+
+    # the cached raster gives the same segment values as rasterizing again
+    sampling_points = generate_sampling_points(
+        np.arange(-1, -11, -1),
+        [LineString(rng.uniform(0, 50, (3, 2))) for _ in range(10)],
+        raster_resolution=1,
+    )
+    assert calculate_segment_raster_values_from_raster_file(
+        sampling_points, cache_path, RASTER_NO_DATA_VALUE
+    ) == rasterize_and_calculate_segment_values(
+        "circles",
+        vector_data_gdf,
+        sampling_points,
+        "value",
+        raster_cell_resolution=1,
+        raster_null_value=RASTER_NO_DATA_VALUE,
+    )
+
+
+def test_evict_rasterization_caches(tmp_path):
+    cache_paths = [
+        get_rasterization_cache_path(f"data_{number}", "key", str(tmp_path))
+        for number in range(4)
+    ]
+    for number, cache_path in enumerate(cache_paths):
+        with open(cache_path, "wb") as cache_file:
+            cache_file.write(b"0" * 100)
+        os.utime(cache_path, ns=(number * 10**9, number * 10**9))
+
+    # the oldest cache is used again, the kept cache is never removed
+    check_rasterization_cache(cache_paths[0])
+    assert evict_rasterization_caches(
+        str(tmp_path), max_bytes=200, keep_paths=[cache_paths[1]]
+    ) == [cache_paths[2], cache_paths[3]]
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        os.path.basename(path) for path in cache_paths[:2]
+    )
@@ -0,0 +1,48 @@
+import numpy as np
+from shapely.geometry import LineString, MultiLineString, Point
+
+from ..src.preprocessing.sampling_points import generate_sampling_points
+
+
+def test_generate_sampling_points():
+    geometries = [
+        LineString([(0, 0), (10, 0), (10, 10)]),
+        MultiLineString([[(0, 0), (0, 4)], [(5, 5), (9, 5)]]),
+        Point(1, 1),
+        LineString([(0, 0), (5, 0)]),
+    ]
+    sampling_points = generate_sampling_points(
+        np.array([-1, -2, -3, -4]), geometries, raster_resolution=10
+    )
+
+    # length 20 -> 3 points, both parts of the multilinestring get 2 points each
+    assert sampling_points.counts.tolist() == [3, 4, 0, 2]
+    assert sampling_points.osm_ids.tolist() == [-1, -2, -3, -4]
+    assert sampling_points.get_segment_coordinates(0).tolist() == [
+        [0, 0],
+        [10, 0],
+        [10, 10],
+    ]
+    assert sampling_points.get_segment_coordinates(1).tolist() == [
+        [0, 0],
+        [0, 4],
+        [5, 5],
+        [9, 5],
+    ]
+    assert sampling_points.get_segment_coordinates(2).shape == (0, 2)
+    assert sampling_points.get_point_segment_indices().tolist() == [
+        0,
+        0,
+        0,
+        1,
+        1,
+        1,
+        1,
+        3,
+        3,
+    ]
+
+    forced_sampling_points = generate_sampling_points(
+        np.array([-4]), geometries[3:], 10, force_sampling_points_amount=6
+    )
+    assert forced_sampling_points.x.tolist() == [0, 1, 2, 3, 4, 5]
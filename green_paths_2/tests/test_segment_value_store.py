@@ -0,0 +1,126 @@
+import geopandas as gpd
+import numpy as np
+import pytest
+from shapely.geometry import LineString
+from shapely.wkt import dumps
+
+from ..src.green_paths_exceptions import DataManagingError
+from ..src.preprocessing.data_source import DataSource
+from ..src.segment_value_store import SegmentValueStore
+
+
+def create_data_source(name, good_exposure):
+    return DataSource(
+        name,
+        f"{name}.tif",
+        good_exposure=good_exposure,
+        min_data_value=0,
+        max_data_value=10,
+        data_type="raster",
+        segment_statistics=["max"],
+    )
+
+
+def create_segment_store():
+    segment_store = SegmentValueStore()
+    segment_store.save_segment_statistics(
+        {"mean": {3: 5.0, 1: None, 2: 12.0}, "max": {3: 6.0, 1: None, 2: 14.0}},
+        "noise",
+        ["max"],
+    )
+    segment_store.save_segment_values({4: 2.5, 1: 7.5}, "gvi")
+    return segment_store
+
+
+def test_save_segment_values():
+    segment_store = create_segment_store()
+
+    # the segments are merged to sorted columns, NaN for the missing values
+    assert segment_store.get_all_segment_osmids() == [1, 2, 3, 4]
+    assert segment_store.get_all_store_data_keys() == ["noise", "noise_max", "gvi"]
+    np.testing.assert_array_equal(
+        segment_store.get_data_column("gvi"), [7.5, np.nan, np.nan, 2.5]
+    )
+
+    # the values are returned like from a dictionary store, None for the missing values
+    assert segment_store.get_segment_values(3) == {
+        "3": {"noise": 5.0, "noise_max": 6.0, "gvi": None}
+    }
+    assert segment_store.get_segment_values("1", drop_osm_id=True) == {
+        "noise": None,
+        "noise_max": None,
+        "gvi": 7.5,
+    }
+    assert segment_store.get_segment_values([4, 5]) == {
+        "4": {"noise": None, "noise_max": None, "gvi": 2.5},
+        "5": False,
+    }
+    assert segment_store.get_store()[2] == {
+        "noise": 12.0,
+        "noise_max": 14.0,
+        "gvi": None,
+    }
+
+
+def test_normalize_and_export_segment_values():
+    segment_store = create_segment_store()
+    data_sources = {
+        "noise": create_data_source("noise", False),
+        "gvi": create_data_source("gvi", True),
+    }
+
+    segment_store.validate_data_coverage(data_sources, 4, 50)
+    with pytest.raises(DataManagingError):
+        segment_store.validate_data_coverage(data_sources, 4, 60)
+
+    # the values are fitted to the min and max values, and segments without data have 0
+    assert segment_store.save_normalized_values_to_store(data_sources) == [
+        "noise_normalized",
+        "gvi_normalized",
+    ]
+    np.testing.assert_array_equal(
+        segment_store.get_data_column("noise_normalized"), [0, 1, 0.5, 0]
+    )
+    np.testing.assert_array_equal(
+        segment_store.get_data_column("gvi_normalized"), [-0.75, 0, 0, -0.25]
+    )
+    assert segment_store.get_normalized_exposures(["gvi"]) == {
+        "gvi_normalized": {"1": -0.75, "2": 0.0, "3": 0.0, "4": -0.25}
+    }
+
+    osm_network_gdf = gpd.GeoDataFrame(
+        {
+            "osm_id": [4, 3, 2, 1, 5],
+            "length": [40.0, 30.0, 20.0, 10.0, 50.0],
+        },
+        geometry=[LineString([(i, 0), (i, 1)]) for i in range(5)],
+    )
+    segment_store.combine_exposures_to_geometries_and_lenghts(osm_network_gdf)
+    table_structure = segment_store.get_db_table_structure()
+    assert list(table_structure) == [
+        "noise",
+        "noise_max",
+        "gvi",
+        "noise_normalized",
+        "gvi_normalized",
+        "osm_id",
+        "geometry",
+        "length",
+    ]
+    rows = list(segment_store.iterate_db_rows(chunk_size=3))
+    assert rows[0] == (
+        None,
+        None,
+        7.5,
+        0.0,
+        -0.75,
+        1,
+        dumps(LineString([(3, 0), (3, 1)])),
+        10.0,
+    )
+    assert [row[5] for row in rows] == [1, 2, 3, 4]
+
+    segment_store.convert_segment_store_to_gdf()
+    segment_store_gdf = segment_store.get_master_segment_gdf()
+    assert segment_store_gdf.loc[4, "length"] == 40.0
+    assert segment_store_gdf.loc[4, "geometry"].equals(LineString([(0, 0), (0, 1)]))
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from shapely.geometry import LineString, Point, box
+
+from ..src.config import RASTER_NO_DATA_VALUE
+from ..src.preprocessing.vector_overlay import (
+    calculate_segment_vector_overlay_values,
+    get_overlay_feature_geometries,
+)
+
+
+def test_calculate_segment_vector_overlay_values():
+    features = np.array(
+        [box(0, 0, 10, 10), box(10, 0, 30, 10), box(50, 0, 60, 10), box(5, 20, 15, 30)]
+    )
+    values = np.array([10.0, 40.0, 1.0, RASTER_NO_DATA_VALUE])
+    segments = np.array(
+        [
+            # 10m in the first box, 20m in the second box and 10m without data
+            LineString([(0, 5), (40, 5)]),
+            # only touches the third box
+            LineString([(60, 5), (70, 5)]),
+            # half in the no data box
+            LineString([(5, 25), (25, 25)]),
+            LineString([(100, 100), (110, 100)]),
+        ]
+    )
+    segment_values = calculate_segment_vector_overlay_values(
+        np.array([-1, -2, -3, -4]),
+        segments,
+        features,
+        values,
+        segment_statistics=["max", "nodata_share"],
+    )
+    assert segment_values["mean"][-1] == 30.0
+    assert segment_values["max"][-1] == 40.0
+    assert segment_values["nodata_share"][-1] == 0.25
+    assert segment_values["mean"][-2] is None
+    assert segment_values["nodata_share"][-2] == 1
+    assert segment_values["mean"][-3] is None
+    assert segment_values["nodata_share"][-3] == 1
+    assert segment_values["mean"][-4] is None
+
+
+def test_get_overlay_feature_geometries():
+    geometries = np.array(
+        [box(0, 0, 10, 10), LineString([(0, 20), (10, 20)]), Point(50, 50)]
+    )
+
+    # only the geometries without area are buffered with half of the cell resolution
+    overlay_geometries = get_overlay_feature_geometries(
+        geometries, raster_cell_resolution=10
+    )
+    assert overlay_geometries[0].equals(geometries[0])
+    assert overlay_geometries[1].bounds == pytest.approx((-5, 15, 15, 25))
+    assert overlay_geometries[2].bounds == pytest.approx((45, 45, 55, 55))
+
+    # with a data buffer all the geometries are buffered
+    overlay_geometries = get_overlay_feature_geometries(geometries, data_buffer=2)
+    assert overlay_geometries[0].bounds == pytest.approx((-2, -2, 12, 12))
+    assert overlay_geometries[2].bounds == pytest.approx((48, 48, 52, 52))
@@ -10,6 +10,11 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".
 
 import argparse
 
+from green_paths_2.src.config import (
+    DEFAULT_INTERSECTION_INDEX_BACKEND,
+    DEFAULT_SEGMENTATION_WAY_FILTER,
+    DEFAULT_SEGMENTATION_WORKERS,
+)
 from green_paths_2.src.pipeline_controller import handle_pipelines
 from green_paths_2.src.cache_cleaner import clear_db
 from green_paths_2.src.config_validator import validate_user_config
@@ -19,8 +24,16 @@ from green_paths_2.src.preprocessing.data_descriptor import (
 )
 
 from green_paths_2.src.preprocessing.osm_segmenter import (
+    INTERSECTION_INDEX_BACKENDS,
     segment_or_use_cache_osm_network,
 )
+from green_paths_2.src.preprocessing.osm_network_updater import (
+    update_segmented_osm_network,
+)
+from green_paths_2.src.preprocessing.study_area import (
+    clip_area_from_bbox,
+    clip_area_from_file,
+)
 
 LOG = setup_logger(__name__, LoggerColors.BLUE.value)
 
@@ -90,6 +103,72 @@ def main():
         required=False,
     )
 
+    osm_segmenter_parser.add_argument(
+        "-ii",
+        "--intersection_index",
+        type=str,
+        choices=list(INTERSECTION_INDEX_BACKENDS),
+        default=DEFAULT_INTERSECTION_INDEX_BACKEND,
+        help="Backend for the intersection index. Use disk for extracts bigger than memory.",
+        required=False,
+    )
+
+    osm_segmenter_parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=DEFAULT_SEGMENTATION_WORKERS,
+        help=(
+            "Number of worker processes for copying the nodes and writing the segments. "
+            "The source file blocks are split between the workers, "
+            "the intersection pass is always serial."
+        ),
+        required=False,
+    )
+
+    osm_segmenter_parser.add_argument(
+        "-kaw",
+        "--keep_all_ways",
+        action="store_true",
+        help="Keep all ways, not only the walk and bike routable highways.",
+        required=False,
+    )
+
+    osm_segmenter_parser.add_argument(
+        "-oc",
+        "--osm_change",
+        type=str,
+        help="Filepath to OSM change file (.osc) to apply to the segmented network.",
+        required=False,
+    )
+
+    osm_segmenter_parser.add_argument(
+        "-cb",
+        "--clip_bbox",
+        type=float,
+        nargs=4,
+        metavar=("MIN_LON", "MIN_LAT", "MAX_LON", "MAX_LAT"),
+        help="Keep only the ways with a node inside this WGS84 bounding box.",
+        required=False,
+    )
+
+    osm_segmenter_parser.add_argument(
+        "-cp",
+        "--clip_polygon",
+        type=str,
+        help="Filepath to a polygon file (e.g. GeoJSON), keep only the ways with a node inside the polygons.",
+        required=False,
+    )
+
+    osm_segmenter_parser.add_argument(
+        "-cbm",
+        "--clip_buffer_meters",
+        type=float,
+        default=0,
+        help="Buffer in meters for the clip bbox or polygon.",
+        required=False,
+    )
+
     # Subparser for validation module
     validation_parsers = subparsers.add_parser(
         "validate", help="Validate user configuration"
@@ -142,7 +221,35 @@ def main():
         LOG.info("Running the all pipeline.")
         handle_pipelines("all", args.config, args.use_exposure_cache)
     elif args.action == "segment_osm_network":
-        segment_or_use_cache_osm_network(args.filepath)
+        way_filter = None if args.keep_all_ways else DEFAULT_SEGMENTATION_WAY_FILTER
+        clip_area = None
+        if args.clip_bbox and args.clip_polygon:
+            osm_segmenter_parser.error(
+                "Give only one of --clip_bbox and --clip_polygon."
+            )
+        if (args.clip_bbox or args.clip_polygon) and args.osm_change:
+            osm_segmenter_parser.error(
+                "OSM change files can't be applied to a clipped network."
+            )
+        if args.clip_bbox:
+            clip_area = clip_area_from_bbox(args.clip_bbox, args.clip_buffer_meters)
+        elif args.clip_polygon:
+            clip_area = clip_area_from_file(args.clip_polygon, args.clip_buffer_meters)
+        osm_segmented_network_path = segment_or_use_cache_osm_network(
+            args.filepath,
+            intersection_index_backend=args.intersection_index,
+            workers=args.workers,
+            way_filter=way_filter,
+            clip_area=clip_area,
+        )
+        if args.osm_change:
+            update_segmented_osm_network(
+                osm_segmented_network_path,
+                args.osm_change,
+                intersection_index_backend=args.intersection_index,
+                way_filter=way_filter,
+                osm_source_path=args.filepath,
+            )
     else:
         # print help if no action is given
         parser.print_help()